@@ -0,0 +1,225 @@
+import os
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+ROOT_ENV='COVID_PROJECT_ROOT'
+
+# processed data sets relative to the project root
+FINAL_SET='data/processed/COVID_final_set.csv'
+RELATIONAL_CONFIRMED='data/processed/COVID_relational_confirmed.csv'
+DISTRICT_SET='data/processed/COVID_final_set_GER.csv'
+POPULATION='data/processed/world_population.csv'
+ONSET_INDEX='data/processed/COVID_onset_index.csv'
+
+project_root=None
+
+# loaded data sets: key -> (file version, result), a new file version invalidates the entry
+memo={}
+# one lock per key, a parse only blocks callers of the same data set
+key_locks={}
+memo_lock=threading.Lock()
+
+
+def get_project_root():
+    ''' Project directory, resolved once from $COVID_PROJECT_ROOT or the location of this file'''
+    global project_root
+    if project_root is None:
+        project_root=os.path.abspath(os.environ.get(ROOT_ENV) or
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','..'))
+    return project_root
+
+
+def get_path(*parts):
+    ''' Absolute path of a file or directory of the project e.g. get_path('data/processed')'''
+    return os.path.join(get_project_root(),*parts)
+
+
+def get_data_version(file_path):
+    ''' Version tag of a processed data file, changes whenever the file is rewritten
+
+        Parameters:
+        ----------
+        file_path : str
+
+        Returns:
+        ----------
+        version: str
+    '''
+    stat=os.stat(file_path)
+    tag='{}:{}:{}'.format(os.path.abspath(file_path),stat.st_size,stat.st_mtime_ns)
+    return hashlib.sha1(tag.encode()).hexdigest()[:16]
+
+
+def write_csv(df_output,file_path,**kwargs):
+    ''' to_csv into a temporary file which replaces file_path when complete, readers
+        and watchers (DataProvider, refresh_scheduler) never see a partly written file'''
+    df_output.to_csv(file_path+'.tmp',**kwargs)
+    os.replace(file_path+'.tmp',file_path)
+
+
+def freeze(result):
+    ''' Read-only copy of a shared pd.DataFrame or pd.Series, an in-place write
+        (df.loc[...]=...) raises instead of changing the data of every caller.
+
+        Every numpy column is copied into an array of its own which is marked
+        read-only, the frame is built on these arrays without a further copy.
+        Object and extension columns stay writeable, pandas string kernels reject
+        read-only buffers.'''
+    def frozen(series):
+        if not isinstance(series.dtype,np.dtype) or series.dtype==object:
+            return series
+        values=series.to_numpy(copy=True)
+        values.flags.writeable=False
+        return values
+
+    if isinstance(result,pd.Series):
+        return pd.Series(frozen(result),index=result.index,name=result.name,copy=False)
+    if isinstance(result,pd.DataFrame) and result.columns.is_unique:
+        df_frozen=pd.DataFrame({column:frozen(result[column]) for column in result.columns},
+                               index=result.index,copy=False)
+        df_frozen.columns=result.columns # keeps the column index name
+        return df_frozen
+    return result
+
+
+def memoized(key,relative_path,parse):
+    ''' Result of parse() for the current version of a file, parsed once per version
+
+        Data frames and series are shared read-only (copy-on-write): every caller gets
+        a shallow copy, adding or replacing columns only changes the caller's copy,
+        writing into the shared values raises ValueError. Callers of the same key
+        wait for one parse, other keys are loaded in parallel.
+
+        Parameters:
+        ----------
+        key: hashable
+        relative_path: str
+            file the result depends on
+        parse: callable without arguments
+    '''
+    file_path=get_path(relative_path)
+    version=get_data_version(file_path) # FileNotFoundError if missing
+    with memo_lock:
+        key_lock=key_locks.setdefault(key,threading.Lock())
+    with key_lock:
+        entry=memo.get(key)
+        if entry is None or entry[0]!=version:
+            entry=(version,freeze(parse()))
+            with memo_lock:
+                memo[key]=entry
+    result=entry[1]
+    return result.copy(deep=False) if isinstance(result,(pd.DataFrame,pd.Series)) else result
+
+
+def clear_cache():
+    with memo_lock:
+        memo.clear()
+
+
+def project(df_input,columns=None,countries=None):
+    ''' Column and country projection of a (shared) data set, returns a new frame'''
+    if countries is not None:
+        df_input=df_input[df_input['country'].isin(list(countries))]
+    if columns is not None:
+        df_input=df_input[list(columns)]
+    return df_input.copy() if columns is None and countries is None else df_input.reset_index(drop=True)
+
+
+def load_final_set(columns=None,countries=None,parse_dates=False):
+    ''' Processed data set with filtered counts, doubling rates and Rt
+
+        Parameters:
+        ----------
+        columns: list of str
+            default all columns
+        countries: list of str
+            default all countries
+        parse_dates: bool
+            date as datetime64 instead of 'YYYY-MM-DD' strings
+
+        Returns:
+        ----------
+        df_final: pd.DataFrame
+            values shared read-only between callers if no projection is requested
+    '''
+    df_final=memoized('final_set',FINAL_SET,lambda: pd.read_csv(get_path(FINAL_SET),sep=';'))
+    if parse_dates:
+        df_final=memoized('final_set_dates',FINAL_SET,
+                          lambda: df_final.assign(date=pd.to_datetime(df_final['date'])))
+    if columns is None and countries is None:
+        return df_final
+    return project(df_final,columns,countries)
+
+
+def load_relational_confirmed(columns=None,countries=None):
+    ''' Relational confirmed cases (date, state, country, confirmed)'''
+    df_relational=memoized('relational_confirmed',RELATIONAL_CONFIRMED,
+                           lambda: pd.read_csv(get_path(RELATIONAL_CONFIRMED),sep=';',parse_dates=[0]))
+    if columns is None and countries is None:
+        return df_relational
+    return project(df_relational,columns,countries)
+
+
+def load_district_set(columns=None):
+    ''' German district features built by build_features.py --germany'''
+    df_districts=memoized('district_set',DISTRICT_SET,
+                          lambda: pd.read_csv(get_path(DISTRICT_SET),sep=';',dtype={'RS':str}))
+    return df_districts if columns is None else df_districts[list(columns)]
+
+
+def load_population():
+    ''' Population per country
+
+        Returns:
+        ----------
+        population: pd.Series (index country)
+    '''
+    return memoized('population',POPULATION,
+                    lambda: pd.read_csv(get_path(POPULATION),sep=';',index_col=0)['population'])
+
+
+def load_onset_index():
+    ''' First day of every series above the onset thresholds (see features/onset_index.py)
+
+        Returns:
+        ----------
+        df_onset: pd.DataFrame
+            index key ('country' or 'country|state'), one datetime column per threshold
+    '''
+    def parse():
+        df_onset=pd.read_csv(get_path(ONSET_INDEX),sep=';',index_col='key')
+        return df_onset.apply(pd.to_datetime)
+
+    return memoized('onset_index',ONSET_INDEX,parse)
+
+
+def load_wide_confirmed(countries=None):
+    ''' Confirmed cases per country in wide format (column date plus one column per country),
+        states are summed up
+
+        Returns:
+        ----------
+        df_confirmed: pd.DataFrame
+            values shared read-only between callers if no projection is requested
+    '''
+    def parse():
+        df_final=load_final_set(columns=['date','country','confirmed'])
+        df_wide=df_final.groupby(['date','country'])['confirmed'].sum().unstack('country')
+        df_wide=df_wide[list(df_final['country'].unique())].reset_index()
+        df_wide['date']=pd.to_datetime(df_wide['date'])
+        df_wide.columns.name=None
+        return df_wide
+
+    df_confirmed=memoized('wide_confirmed',FINAL_SET,parse)
+    if countries is None:
+        return df_confirmed
+    return df_confirmed[['date']+list(countries)].copy()
+
+
+if __name__ == '__main__':
+    print('project root: '+get_project_root())
+    print(load_wide_confirmed(countries=['Germany']).tail())
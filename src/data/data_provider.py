@@ -0,0 +1,170 @@
+import os
+import time
+import random
+import logging
+import weakref
+import threading
+
+from src.data.data_access import get_path, get_data_version
+
+
+logger=logging.getLogger(__name__)
+
+VERSION_PATH=get_path('data/processed/VERSION')
+
+# set by the refresh scheduler for its stages, it publishes one marker after the last stage
+DEFER_VERSION_ENV='COVID_DEFER_VERSION'
+
+
+def get_file_version(file_path):
+    ''' Version tag of a file (see data_access.get_data_version) or None if it does not exist'''
+    try:
+        return get_data_version(file_path)
+    except FileNotFoundError:
+        return None
+
+
+def write_version_marker(marker_path=VERSION_PATH):
+    ''' Publish a new version of the processed data, called after all files are written
+
+        Returns:
+        ----------
+        version: str
+            None if publishing is deferred to the refresh scheduler ($COVID_DEFER_VERSION)
+    '''
+    if os.environ.get(DEFER_VERSION_ENV):
+        return None
+    version='{}-{:04x}'.format(time.strftime('%Y%m%dT%H%M%S'),random.getrandbits(16))
+    with open(marker_path+'.tmp','w') as f:
+        f.write(version+'\n')
+    os.replace(marker_path+'.tmp',marker_path)
+    return version
+
+
+def read_version_marker(marker_path=VERSION_PATH):
+    try:
+        with open(marker_path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+class DataProvider():
+    '''Serves the loaded data sets of a running dashboard and replaces them without downtime.
+       A watcher thread polls the version marker, changed files are loaded in the background
+       and swapped in with one assignment. Requests keep the object they got from get()
+       until they finish, an old version is freed with its last reference.
+       Args:
+       -------
+       marker_path: version marker written by the feature pipeline
+       interval: seconds between two checks of the marker (plus up to 20% jitter, so
+                 several worker processes do not reload at the same moment)
+    '''
+
+    def __init__(self, marker_path=VERSION_PATH, interval=30):
+
+        self.marker_path = marker_path
+        self.interval = interval
+        self.sources = {}       # name -> (file_path, loader)
+        self.current = {}       # name -> (file version, data)
+        self.listeners = {}     # name -> callbacks after a swap
+        self.released = {}      # name -> weak references of replaced versions
+        self.marker = None
+        self._load_lock = threading.Lock()
+        self._released_lock = threading.Lock() # short, not held while a data set loads
+        self._thread = None
+        self._stop = threading.Event()
+
+    def register(self, name, file_path, loader):
+        ''' Add a data set, loader(file_path) returns the loaded object'''
+        self.sources[name] = (file_path, loader)
+
+    def on_swap(self, name, callback):
+        ''' Call callback() whenever a new version of the data set name was swapped in,
+            used to invalidate caches derived from it'''
+        self.listeners.setdefault(name, []).append(callback)
+
+    def get(self, name):
+        ''' Current version of a data set, loaded on first use'''
+        entry = self.current.get(name)
+        if entry is None:
+            with self._load_lock:
+                entry = self.current.get(name)
+                if entry is None:
+                    if self.marker is None:
+                        self.marker = read_version_marker(self.marker_path)
+                    file_path, loader = self.sources[name]
+                    entry = (get_file_version(file_path), loader(file_path))
+                    self.current[name] = entry
+        return entry[1]
+
+    def version(self, name):
+        entry = self.current.get(name)
+        return entry[0] if entry else None
+
+    def check(self):
+        ''' Reload all loaded data sets whose file changed since the marker changed
+
+            Returns:
+            ----------
+            swapped: list of str
+                names of the data sets which were replaced
+        '''
+        marker = read_version_marker(self.marker_path)
+        if marker == self.marker:
+            return []
+
+        swapped = []
+        with self._load_lock:
+            for name, (file_path, loader) in self.sources.items():
+                if name not in self.current:
+                    continue # never used, loaded on demand
+                file_version = get_file_version(file_path)
+                if file_version is None or file_version == self.current[name][0]:
+                    continue
+                data = loader(file_path) # requests are still served from the old version
+                old = self.current[name][1]
+                self.current[name] = (file_version, data)
+                self._track_release(name, old)
+                swapped.append(name)
+            self.marker = marker
+
+        for name in swapped:
+            for callback in self.listeners.get(name, []):
+                callback()
+        return swapped
+
+    def _track_release(self, name, data):
+        try:
+            ref = weakref.ref(data)
+        except TypeError: # object without weak reference support
+            return
+        with self._released_lock:
+            self.released.setdefault(name, []).append(ref)
+
+    def live_versions(self):
+        ''' Number of replaced versions per data set which are still referenced by a request'''
+        result = {}
+        with self._released_lock:
+            for name, refs in self.released.items():
+                self.released[name] = [each for each in refs if each() is not None]
+                result[name] = len(self.released[name])
+        return result
+
+    def start(self):
+        ''' Start the watcher thread (once per process)'''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='data-provider', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval*(1+0.2*random.random())):
+            try:
+                self.check()
+            except Exception: # keep serving the old version, retry with the next check
+                logger.exception('data reload failed')
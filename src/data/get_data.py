@@ -5,44 +5,39 @@ import numpy as np
 
 import subprocess
 import os
+import sys
 
 from datetime import datetime
 
-import requests
 import json
 
-def get_john_hopkins():
-    ''' Get data by a git pull request, the source code has to be pulled first
-        Result is stored in the predifined csv structure
-    '''
-    # clone git repo
-    git_repo = 'https://github.com/CSSEGISandData/COVID-19.git'
-    git_clone = subprocess.Popen( "git clone " + git_repo ,
-                             cwd = os.path.dirname( 'data/raw/' ),
-                             shell = True,
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE )
-    (out, error) = git_clone.communicate()
+from src.data.data_access import get_path
 
-    print('out:', out)
-    print('error:', error)
-    
-    # pull if repo is already cloned
-    git_pull = subprocess.Popen( "git pull" ,
-                         cwd = os.path.dirname( 'data/raw/COVID-19/' ),
-                         shell = True,
-                         stdout = subprocess.PIPE,
-                         stderr = subprocess.PIPE )
-    (out, error) = git_pull.communicate()
+def get_john_hopkins(git_repo='https://github.com/CSSEGISandData/COVID-19.git'):
+    ''' Get data by a git clone (first run) or a git pull of the cloned repository
+        Result is stored in the predifined csv structure, raises RuntimeError if git fails
+    '''
+    repo_dir = get_path('data/raw/COVID-19')
+    if os.path.isdir(os.path.join(repo_dir, '.git')):
+        command, cwd = ['git', 'pull'], repo_dir
+    else:
+        command, cwd = ['git', 'clone', git_repo], get_path('data/raw')
+    result = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
 
-    print("Error : " + str(error))
-    print("out : " + str(out))
+    print("Error : " + result.stderr)
+    print("out : " + result.stdout)
+    if result.returncode != 0:
+        raise RuntimeError(' '.join(command)+' failed: '+result.stderr.strip())
 
-def get_current_data_germany():
+def get_current_data_germany(geometry=False):
     ''' Get current data from germany, attention API endpoint not too stable
         Result data frame is stored as pd.DataFrame
 
+        geometry=True additionally stores the district polygons as GeoJSON
+        (data/raw/NPGEO/GER_districts.geojson) for the map view
     '''
+    import requests
+
     # 16 states
     #data=requests.get('https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/Coronaf%C3%A4lle_in_den_Bundesl%C3%A4ndern/FeatureServer/0/query?where=1%3D1&outFields=*&outSR=4326&f=json')
 
@@ -57,13 +52,26 @@ def get_current_data_germany():
     pd_full_list=pd.DataFrame(full_list)
     
     # save data into csv file
-    directory = 'data/raw/NPGEO'
+    directory = get_path('data/raw/NPGEO')
     if not os.path.exists(directory):
         os.mkdir(directory)
         
-    pd_full_list.to_csv('data/raw/NPGEO/GER_state_data.csv',sep=';')
+    pd_full_list.to_csv(get_path('data/raw/NPGEO/GER_state_data.csv'),sep=';')
     print('Number of rows for regional Germany: '+str(pd_full_list.shape[0]))
+
+    # daily accumulation, the csv above only holds the latest snapshot
+    from src.data.npgeo_store import append_daily_snapshot
+    date=append_daily_snapshot(pd_full_list)
+    print('NPGEO snapshot '+(date+' stored' if date else 'already stored'))
+
+    if geometry:
+        data=requests.get('https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/RKI_Landkreisdaten/FeatureServer/0/query?where=1%3D1&outFields=OBJECTID,RS,GEN,county&returnGeometry=true&outSR=4326&f=geojson')
+        data.raise_for_status()
+        with open(get_path('data/raw/NPGEO/GER_districts.geojson.tmp'),'wb') as f:
+            f.write(data.content)
+        os.replace(get_path('data/raw/NPGEO/GER_districts.geojson.tmp'),get_path('data/raw/NPGEO/GER_districts.geojson'))
+        print('Number of district geometries: '+str(len(json.loads(data.content)['features'])))
     
 if __name__ == '__main__':
     get_john_hopkins()
-    get_current_data_germany()
\ No newline at end of file
+    get_current_data_germany(geometry='--geometry' in sys.argv)
\ No newline at end of file
@@ -4,12 +4,19 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 
-def get_large_dataset():
+from src.data.data_access import get_path, load_final_set, load_wide_confirmed, POPULATION
+
+def get_large_dataset(data_path=None):
     ''' Get COVID confirmed case for all countries
 
+        default is the memoized processed data set (data_access.load_wide_confirmed),
+        do not modify the returned frame
     '''
+    if data_path is None:
+        return load_wide_confirmed()
+
     # get large data frame
-    df_full=pd.read_csv('../data/processed/COVID_final_set.csv',sep=';')  
+    df_full=pd.read_csv(data_path,sep=';')  
     df_full.reset_index(drop=True)
 
     country_list = df_full.country.unique()
@@ -28,16 +35,14 @@ def get_large_dataset():
     
     return df_confirmed
 
-import requests
-from bs4 import BeautifulSoup
-
 def world_population():
-    
-    # get large data frame
-    df_full=pd.read_csv('../data/processed/COVID_final_set.csv',sep=';')  
-    df_full.reset_index(drop=True)
+    ''' Scrap the population per country from worldometers and store it as csv
 
-    country_list = df_full.country.unique()
+    '''
+    import requests                  # only needed for scraping, keep module import light
+    from bs4 import BeautifulSoup
+
+    country_list = load_final_set(columns=['country'])['country'].unique()
     
     page = requests.get("https://www.worldometers.info/coronavirus/")    # get webpage
     soup = BeautifulSoup(page.content, 'html.parser')                    # get page content 
@@ -84,7 +89,7 @@ def world_population():
                 
     df_population = pd.DataFrame([pop]).T.rename(columns={0:'population'})
     
-    df_population.to_csv('../data/processed/world_population.csv',sep=';')
+    df_population.to_csv(get_path(POPULATION),sep=';')
     
     return df_population, country_list
 
@@ -0,0 +1,138 @@
+import os
+import re
+import glob
+
+import pandas as pd
+
+from src.data.data_access import get_path
+
+
+NPGEO_STORE_DIR=get_path('data/raw/NPGEO/districts')
+
+# district attributes are stored once, the daily partitions only keep the counts
+DISTRICT_COLUMNS=['OBJECTID','RS','GEN','BEZ','BL','county','EWZ']
+COUNT_COLUMNS=['cases','deaths']
+PARTITION_PATTERN=re.compile(r'date=(\d{4}-\d{2}-\d{2})\.csv\.gz$')
+
+
+def get_snapshot_date(pd_raw):
+    ''' Reporting day of a snapshot from the RKI last_update attribute e.g. '19.10.2026, 00:00 Uhr'
+
+        Returns:
+        ----------
+        date: str 'YYYY-MM-DD', today if the attribute is missing
+    '''
+    if 'last_update' in pd_raw.columns:
+        for each in pd_raw['last_update'].dropna().astype(str):
+            match=re.search(r'(\d{2})\.(\d{2})\.(\d{4})',each)
+            if match:
+                return '{}-{}-{}'.format(match.group(3),match.group(2),match.group(1))
+    return str(pd.Timestamp.now().date())
+
+
+def get_partition_path(store_dir,date):
+    return os.path.join(store_dir,'date='+date+'.csv.gz')
+
+
+def list_partitions(store_dir=NPGEO_STORE_DIR):
+    ''' Stored days with their partition files
+
+        Returns:
+        ----------
+        partitions: dict date -> file path (sorted by date)
+    '''
+    partitions={}
+    for each in sorted(glob.glob(os.path.join(store_dir,'date=*.csv.gz'))):
+        match=PARTITION_PATTERN.search(each)
+        if match:
+            partitions[match.group(1)]=each
+    return partitions
+
+
+def _write_atomic(pd_frame,file_path,**kwargs):
+    pd_frame.to_csv(file_path+'.tmp',sep=';',index=False,**kwargs)
+    os.replace(file_path+'.tmp',file_path)
+
+
+def append_daily_snapshot(pd_raw,store_dir=NPGEO_STORE_DIR,snapshot_date=None):
+    ''' Add one snapshot of the 400 Landkreise to the date partitioned store
+
+        Rows are deduplicated on OBJECTID (the ArcGIS feature id), a second ingest of
+        the same day is merged into the existing partition and only written if a count changed.
+
+        Parameters:
+        ----------
+        pd_raw: pd.DataFrame
+            attributes as returned by the RKI_Landkreisdaten feature service
+        store_dir: str
+        snapshot_date: str
+            default the reporting day of the snapshot
+
+        Returns:
+        ----------
+        date: str or None if the store already contained the snapshot
+    '''
+    os.makedirs(store_dir,exist_ok=True)
+    date=snapshot_date or get_snapshot_date(pd_raw)
+    pd_raw=pd_raw.drop_duplicates('OBJECTID',keep='last')
+
+    # district attributes, new districts are added, changed attributes updated
+    district_path=os.path.join(store_dir,'districts.csv')
+    pd_districts=pd_raw[[each for each in DISTRICT_COLUMNS if each in pd_raw.columns]]
+    if os.path.exists(district_path):
+        pd_stored=pd.read_csv(district_path,sep=';',dtype={'RS':str})
+        pd_merged=pd.concat([pd_stored,pd_districts]).drop_duplicates('OBJECTID',keep='last')
+        if not pd_merged.sort_values('OBJECTID').reset_index(drop=True).astype(str).equals(
+                pd_stored.sort_values('OBJECTID').reset_index(drop=True).astype(str)):
+            _write_atomic(pd_merged.sort_values('OBJECTID'),district_path)
+    else:
+        _write_atomic(pd_districts.sort_values('OBJECTID'),district_path)
+
+    pd_counts=pd_raw[['OBJECTID']+COUNT_COLUMNS].astype('int32')
+    partition_path=get_partition_path(store_dir,date)
+    if os.path.exists(partition_path):
+        pd_stored=pd.read_csv(partition_path,sep=';',dtype='int32')
+        pd_counts=pd.concat([pd_stored,pd_counts]).drop_duplicates('OBJECTID',keep='last')
+        if pd_counts.sort_values('OBJECTID').reset_index(drop=True).equals(
+                pd_stored.sort_values('OBJECTID').reset_index(drop=True)):
+            return None
+
+    _write_atomic(pd_counts.sort_values('OBJECTID'),partition_path,compression='gzip')
+    return date
+
+
+def load_district_data(store_dir=NPGEO_STORE_DIR):
+    ''' Relational district data set of all stored days
+
+        Returns:
+        ----------
+        pd_districts: pd.DataFrame
+            columns date, state (Bundesland), country, county (Landkreis), RS, EWZ,
+            confirmed, deaths, ready for the batched feature engine with the keys
+            ('state','country','county')
+    '''
+    partitions=list_partitions(store_dir)
+    if not partitions:
+        raise FileNotFoundError('no NPGEO snapshots in '+store_dir)
+
+    pd_counts=pd.concat([pd.read_csv(path,sep=';',dtype='int32').assign(date=pd.Timestamp(date))
+                         for date,path in partitions.items()],ignore_index=True)
+    pd_attributes=pd.read_csv(os.path.join(store_dir,'districts.csv'),sep=';',dtype={'RS':str})
+
+    pd_districts=pd_counts.merge(pd_attributes,on='OBJECTID',how='left')
+    pd_districts=pd_districts.rename(columns={'BL':'state','cases':'confirmed'})
+    pd_districts['country']='Germany'
+    pd_districts['county']=pd_districts['county'].fillna(pd_districts['GEN'])
+    for each in ['state','country','county']:
+        pd_districts[each]=pd_districts[each].astype('category')
+
+    return pd_districts[['date','state','country','county','RS','EWZ','confirmed','deaths']] \
+        .sort_values(['date','county']).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    # backfill from the single snapshot written by get_data.get_current_data_germany
+    pd_raw=pd.read_csv(get_path('data/raw/NPGEO/GER_state_data.csv'),sep=';',index_col=0,dtype={'RS':str})
+    date=append_daily_snapshot(pd_raw)
+    print('stored snapshot of '+str(date) if date else 'snapshot already stored')
+    print('days in store: '+str(len(list_partitions())))
@@ -1,15 +1,20 @@
 import pandas as pd
 import numpy as np
 
+import os
+
 from datetime import datetime
 
+from src.data.snapshot_store import SnapshotStore
+from src.data.data_access import get_path, write_csv
+
 
 def store_relational_JH_data():
     ''' Transformes the COVID data in a relational data set
 
     '''
 
-    data_path='data/raw/COVID-19/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv'
+    data_path=get_path('data/raw/COVID-19/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv')
     pd_raw=pd.read_csv(data_path)
 
     pd_data_base=pd_raw.rename(columns={'Country/Region':'country',
@@ -30,9 +35,47 @@ def store_relational_JH_data():
 
     pd_relational_model['date']=pd_relational_model.date.astype('datetime64[ns]')
 
-    pd_relational_model.to_csv('data/processed/COVID_relational_confirmed.csv',sep=';',index=False)
+    write_csv(pd_relational_model,get_path('data/processed/COVID_relational_confirmed.csv'),sep=';',index=False)
+    # keep every refresh, JHU revises history retroactively
+    SnapshotStore('COVID_relational_confirmed').append(pd_relational_model)
     print('Number of rows stored: '+str(pd_relational_model.shape[0]))
     print('Last updated on: '+str(max(pd_relational_model.date)))
     
+
+def store_relational_JH_US_data():
+    ''' Transformes the US county data in a relational data set
+
+        Same schema as store_relational_JH_data with the extra level county (Admin2)
+        and its FIPS code, counts are stored as int32 to keep 3000+ series small
+    '''
+
+    data_path=get_path('data/raw/COVID-19/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv')
+    pd_raw=pd.read_csv(data_path)
+
+    pd_data_base=pd_raw.rename(columns={'Country_Region':'country',
+                                        'Province_State':'state',
+                                        'Admin2':'county',
+                                        'FIPS':'fips'})
+
+    pd_data_base['state']=pd_data_base['state'].fillna('no')
+    pd_data_base['county']=pd_data_base['county'].fillna('no')
+    pd_data_base['fips']=pd_data_base['fips'].fillna(0).astype('int64')
+
+    pd_data_base=pd_data_base.drop(['UID','iso2','iso3','code3','Lat','Long_','Combined_Key'],axis=1,errors='ignore')
+
+    pd_relational_model=pd_data_base.melt(id_vars=['state','country','county','fips'],
+                                          var_name='date',
+                                          value_name='confirmed')
+
+    pd_relational_model['date']=pd.to_datetime(pd_relational_model['date'],format='%m/%d/%y')
+    pd_relational_model['confirmed']=pd_relational_model['confirmed'].fillna(0).astype('int32')
+    pd_relational_model=pd_relational_model[['date','state','country','county','fips','confirmed']]
+
+    write_csv(pd_relational_model,get_path('data/processed/COVID_relational_confirmed_US.csv'),sep=';',index=False)
+    print('Number of rows stored: '+str(pd_relational_model.shape[0]))
+    print('Last updated on: '+str(max(pd_relational_model.date)))
+
 if __name__ == '__main__':
-    store_relational_JH_data()
\ No newline at end of file
+    store_relational_JH_data()
+    if os.path.exists(get_path('data/raw/COVID-19/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv')):
+        store_relational_JH_US_data()
\ No newline at end of file
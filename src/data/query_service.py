@@ -0,0 +1,332 @@
+import pandas as pd
+import numpy as np
+
+import re
+import gzip
+import json
+import hashlib
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import click
+
+from src.data.data_access import get_path, get_data_version, FINAL_SET
+from src.features.build_features import calc_dense_doubling_rate
+
+COUNT_METRICS = ['confirmed', 'confirmed_filtered']
+RATE_METRICS = ['confirmed_DR', 'confirmed_filtered_DR', 'confirmed_Rt', 'confirmed_Rt_lower', 'confirmed_Rt_upper',
+                'confirmed_country_Rt', 'confirmed_country_Rt_lower', 'confirmed_country_Rt_upper']
+# Rt of the summed country counts (rt_estimation.calc_country_Rt), served as confirmed_Rt on country level
+COUNTRY_RT = {'confirmed_Rt': 'confirmed_country_Rt',
+              'confirmed_Rt_lower': 'confirmed_country_Rt_lower',
+              'confirmed_Rt_upper': 'confirmed_country_Rt_upper'}
+
+
+class TimeSeriesStore():
+    '''Indexed in-memory store of the processed COVID data set.
+       Every metric is kept as a dense array (series x dates) per aggregation level,
+       so a query only slices rows and a date range.
+       Args:
+       -------
+       file_path: path of COVID_final_set.csv
+    '''
+
+    def __init__(self, file_path=get_path(FINAL_SET)):
+
+        self.file_path = file_path
+        # version, metrics, dates and levels of one data version, replaced as a whole on reload
+        self.state = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    @property
+    def version(self):
+        return self.state['version']
+
+    @property
+    def metrics(self):
+        return self.state['metrics']
+
+    @property
+    def dates(self):
+        return self.state['dates']
+
+    @property
+    def levels(self):
+        return self.state['levels']
+
+    def reload(self):
+        '''(Re-)load the data set if the file version changed, running queries keep the previous state'''
+        version = get_data_version(self.file_path)
+        if self.state is not None and version == self.state['version']:
+            return False
+
+        with self._lock:
+            if self.state is not None and version == self.state['version']:
+                return False # loaded by a concurrent request
+            df = pd.read_csv(self.file_path, sep=';', parse_dates=['date'])
+            metrics = [each for each in COUNT_METRICS + RATE_METRICS if each in df.columns]
+            dates = np.array(sorted(df['date'].unique()), dtype='datetime64[D]')
+
+            levels = {'state': self._build_level(df, ['country', 'state'], metrics, dates),
+                      'country': self._build_level(df, ['country'], metrics, dates)}
+            self.state = {'version': version, 'metrics': metrics, 'dates': dates, 'levels': levels}
+        return True
+
+    def _build_level(self, df, keys, metrics, dates):
+        ''' Pivot all metrics to dense arrays for one aggregation level
+
+            Counts are summed over the states of a country, rates are not averaged
+            but taken from the summed counts: the doubling rates are recomputed
+            and Rt is the country Rt of the features.
+
+            Returns:
+            ----------
+            level: dict with the key index and one array per metric
+        '''
+        grouped = df.groupby(keys + ['date'])
+        agg = {each: ('sum' if each in COUNT_METRICS else 'first') for each in metrics}
+        df_level = grouped.agg(agg)
+
+        index = {}
+        arrays = {}
+        for metric in metrics:
+            wide = df_level[metric].unstack('date').reindex(columns=pd.DatetimeIndex(dates))
+            arrays[metric] = wide.to_numpy(dtype=np.float64)
+        for pos, key in enumerate(wide.index):
+            key = '|'.join(key) if isinstance(key, tuple) else key # 'country|state' as in the feature modules
+            index[key] = pos
+
+        if keys == ['country']:
+            for metric in ['confirmed_DR', 'confirmed_filtered_DR']:
+                if metric in arrays and metric[:-3] in arrays:
+                    arrays[metric] = calc_dense_doubling_rate(arrays[metric[:-3]])
+            if 'confirmed_filtered_DR' in arrays and 'confirmed' in arrays:
+                arrays['confirmed_filtered_DR'][~(arrays['confirmed'] > 100)] = np.nan
+            for metric, source in COUNTRY_RT.items():
+                if metric in arrays and source in arrays:
+                    arrays[metric] = arrays[source]
+
+        return {'index': index, 'arrays': arrays}
+
+    def keys(self, level='country', state=None):
+        levels = (state or self.state)['levels']
+        if level not in levels:
+            raise ValueError('unknown aggregation level: ' + str(level))
+        return list(levels[level]['index'].keys())
+
+    def query(self, countries=None, metric='confirmed', start=None, end=None, level='country', state=None):
+        ''' Slice series out of the store
+
+            Parameters:
+            ----------
+            countries : list of str
+                country names (level 'country') or 'country|state' keys (level 'state'),
+                for level 'state' a bare country name selects all its states
+            metric : str
+            start, end : str
+                inclusive date range as YYYY-MM-DD
+            level : str
+                'country' or 'state'
+            state : dict
+                data version to query, default the current one (queries of a
+                batch pass the same state)
+
+            Returns:
+            ----------
+            result: dict
+        '''
+        state = state or self.state # one reference, a reload does not change it under the query
+        if level not in state['levels']:
+            raise ValueError('unknown aggregation level: ' + str(level))
+        if metric not in state['metrics']:
+            raise ValueError('unknown metric: ' + str(metric))
+
+        dates = state['dates']
+        index = state['levels'][level]['index']
+        if countries is None:
+            selected = list(index.keys())
+        else:
+            selected = []
+            for each in countries:
+                if each in index:
+                    selected.append(each)
+                elif level == 'state':
+                    selected += [key for key in index if key.split('|')[0] == each]
+                else:
+                    raise KeyError(each)
+
+        lo = 0 if start is None else np.searchsorted(dates, np.datetime64(start, 'D'), side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(end, 'D'), side='right')
+
+        rows = [index[each] for each in selected]
+        values = state['levels'][level]['arrays'][metric][rows, lo:hi]
+        values = np.where(np.isfinite(values), values, np.nan).round(6)
+
+        return {'version': state['version'],
+                'metric': metric,
+                'level': level,
+                'dates': [str(each) for each in dates[lo:hi]],
+                'series': {key: [None if np.isnan(v) else v for v in row.tolist()]
+                           for key, row in zip(selected, values)}
+                }
+
+
+def _split_countries(value):
+    ''' Comma separated list of a query string, a comma followed by a space is part
+        of the name ('Korea, South')'''
+    return [each for each in re.split(r',(?!\s)', value) if each]
+
+
+def _parse_query(params, query_string=False):
+    ''' Translate query string or JSON parameters to store.query keywords
+
+        Parameters:
+        ----------
+        params: dict
+            parse_qs result (query_string=True) or one query of a batch
+        query_string: bool
+            every country parameter may hold a comma separated list and the
+            parameter may be repeated, JSON lists are taken as they are
+    '''
+    def single(name, default=None):
+        value = params.get(name, default)
+        return value[0] if isinstance(value, list) else value
+
+    if not isinstance(params, dict):
+        raise ValueError('a query has to be an object, not ' + json.dumps(params))
+    countries = params.get('country')
+    if query_string and countries is not None:
+        countries = [name for each in countries for name in _split_countries(each)]
+    elif isinstance(countries, str):
+        countries = _split_countries(countries)
+    if countries is not None and not (isinstance(countries, list) and all(isinstance(each, str) for each in countries)):
+        raise ValueError('country has to be a name or a list of names')
+
+    return {'countries': countries,
+            'metric': single('metric', 'confirmed'),
+            'start': single('start'),
+            'end': single('end'),
+            'level': single('level', 'country')}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    '''HTTP/JSON front end of the TimeSeriesStore
+
+       GET  /version
+       GET  /keys?level=country
+       GET  /series?country=Germany,Italy&metric=confirmed&start=2020-03-01&end=2020-06-01&level=country
+            (country may be repeated, e.g. country=Korea,%20South&country=Germany)
+       POST /batch  {"queries": [{"country": [...], "metric": ...}, ...]}
+    '''
+
+    store = None
+
+    def do_GET(self):
+        self.store.reload()
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        if url.path == '/version':
+            self._answer(lambda state: {'version': state['version']}, url.geturl())
+        elif url.path == '/keys':
+            level = params.get('level', ['country'])[0]
+            self._answer(lambda state: {'version': state['version'], 'keys': self.store.keys(level, state)},
+                         url.geturl())
+        elif url.path == '/series':
+            self._answer(lambda state: self.store.query(**_parse_query(params, query_string=True), state=state),
+                         url.geturl())
+        else:
+            self._error(404, 'unknown endpoint ' + url.path)
+
+    def do_POST(self):
+        self.store.reload()
+        url = urlparse(self.path)
+        if url.path != '/batch':
+            self._error(404, 'unknown endpoint ' + url.path)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        try:
+            queries = json.loads(body)['queries']
+        except (ValueError, KeyError, TypeError):
+            queries = None
+        if not isinstance(queries, list) or not all(isinstance(each, dict) for each in queries):
+            self._error(400, 'body has to be {"queries": [{...}, ...]}')
+            return
+
+        # all queries of a batch answer from the same version
+        self._answer(lambda state: {'version': state['version'],
+                                    'results': [self.store.query(**_parse_query(each), state=state) for each in queries]},
+                     url.geturl() + body.decode('utf-8', 'replace'))
+
+    def _answer(self, compute, request_key):
+        ''' Answer a store query from the current data version, map lookup errors to 4xx
+
+            The ETag (data version + request) is compared before the query runs, an
+            unchanged result costs no computation.
+        '''
+        state = self.store.state # one version for the ETag and the payload
+        etag = '"{}-{}"'.format(state['version'], hashlib.sha1(request_key.encode()).hexdigest()[:12])
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        try:
+            payload = compute(state)
+        except KeyError as err:
+            self._error(404, 'unknown series ' + str(err))
+        except ValueError as err:
+            self._error(400, str(err))
+        else:
+            self._respond(payload, etag)
+
+    def _respond(self, payload, etag):
+        ''' Send JSON with ETag and optional gzip'''
+        body = json.dumps(payload, separators=(',', ':')).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code, message):
+        body = json.dumps({'error': message}).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_server(file_path=get_path(FINAL_SET), host='127.0.0.1', port=8051):
+    ''' Build the query server on top of a freshly loaded store'''
+    handler = type('BoundQueryHandler', (QueryHandler,), {'store': TimeSeriesStore(file_path)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+@click.command()
+@click.option('--file-path', default=get_path(FINAL_SET))
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8051, type=int)
+def main(file_path, host, port):
+    """ Serves slices of the processed data set as compressed JSON.
+    """
+    server = create_server(file_path, host, port)
+    print('Serving '+file_path+' (version '+server.RequestHandlerClass.store.version+') on '+host+':'+str(port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,611 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+
+import click
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from src.data.data_access import get_path, get_project_root, ROOT_ENV
+from src.data.data_provider import write_version_marker, DEFER_VERSION_ENV, VERSION_PATH
+
+
+logger=logging.getLogger(__name__)
+
+STATE_PATH=get_path('data/processed/refresh_state.json')
+
+# project view the stages of a run write to, relative to the project root
+STAGING_DIR='data/processed.staging'
+PROCESSED_DIR='data/processed'
+
+# directory of the src package, stages run as python -m src.<module> from here
+CODE_ROOT=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+JH_REPO='https://github.com/CSSEGISandData/COVID-19.git'
+NPGEO_URL='https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/RKI_Landkreisdaten/FeatureServer/0/query'
+
+
+def get_backoff(failures,base,maximum):
+    ''' Seconds to wait after the n-th failure in a row, doubled per failure plus up to 20% jitter'''
+    return min(maximum,base*2**(failures-1))*(1+0.2*random.random())
+
+
+class Upstream():
+    '''Data source polled by the RefreshScheduler. poll() returns a cheap change token,
+       fetch() downloads the data into data/raw once the scheduler starts a run.
+       Args:
+       -------
+       name: key of the source, stages name it in after
+       interval: seconds between two polls
+    '''
+
+    def __init__(self, name, interval=900):
+
+        self.name = name
+        self.interval = interval
+
+    def poll(self):
+        raise NotImplementedError
+
+    def fetch(self):
+        raise NotImplementedError
+
+
+class GitUpstream(Upstream):
+    '''John Hopkins repository, the token is the commit of the remote HEAD'''
+
+    def __init__(self, name='john_hopkins', interval=900, repo=JH_REPO):
+
+        super().__init__(name, interval)
+        self.repo = repo
+
+    def poll(self):
+        result = subprocess.run(['git', 'ls-remote', self.repo, 'HEAD'], capture_output=True, text=True, timeout=60)
+        if result.returncode != 0 or not result.stdout.strip():
+            raise RuntimeError('git ls-remote failed: '+result.stderr.strip())
+        return result.stdout.split()[0]
+
+    def fetch(self):
+        from src.data.get_data import get_john_hopkins
+
+        get_john_hopkins(self.repo) # raises if clone or pull fail
+
+
+class NPGEOUpstream(Upstream):
+    '''RKI district data, the token is the last_update attribute of the feature service'''
+
+    def __init__(self, name='npgeo', interval=900, url=NPGEO_URL):
+
+        super().__init__(name, interval)
+        self.url = url
+
+    def poll(self):
+        import requests
+
+        data = requests.get(self.url, params={'where': '1=1', 'outFields': 'last_update', 'returnGeometry': 'false',
+                                              'resultRecordCount': 1, 'f': 'json'}, timeout=60)
+        data.raise_for_status()
+        return data.json()['features'][0]['attributes']['last_update']
+
+    def fetch(self):
+        from src.data.get_data import get_current_data_germany
+
+        get_current_data_germany()
+
+
+class LocalUpstream(Upstream):
+    '''Directory which is mirrored into the project, e.g. a fake upstream to test the
+       scheduler or a manually downloaded copy of a source. The token hashes path,
+       size and modification time of all files.
+       Args:
+       -------
+       name: key of the source e.g. john_hopkins to replace the GitUpstream
+       source_dir: polled directory
+       target_dir: directory relative to the project root, e.g. data/raw/COVID-19
+    '''
+
+    def __init__(self, name, source_dir, target_dir, interval=60):
+
+        super().__init__(name, interval)
+        self.source_dir = os.path.abspath(source_dir)
+        self.target_dir = target_dir
+
+    def list_files(self):
+        files = []
+        for root, dirs, names in os.walk(self.source_dir):
+            dirs[:] = sorted(each for each in dirs if not each.startswith('.'))
+            files += [os.path.relpath(os.path.join(root, each), self.source_dir) for each in sorted(names)]
+        return files
+
+    def poll(self):
+        digest = hashlib.sha1()
+        for each in self.list_files():
+            stat = os.stat(os.path.join(self.source_dir, each))
+            digest.update('{}:{}:{}\n'.format(each, stat.st_size, stat.st_mtime_ns).encode())
+        return digest.hexdigest()
+
+    def fetch(self):
+        for each in self.list_files():
+            target = get_path(self.target_dir, each)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(os.path.join(self.source_dir, each), target+'.tmp')
+            os.replace(target+'.tmp', target)
+
+
+class Stage():
+    '''Step of the refresh, a module of src run as subprocess (python -m) with the
+       project root passed in $COVID_PROJECT_ROOT, so it does not depend on the working directory.
+       The scheduler passes the root of a staging copy (see create_staging), only the
+       declared outputs are copies there, everything else links to the published files.
+       Args:
+       -------
+       name: key of the stage, later stages name it in after
+       command: module and arguments e.g. ['src.features.build_features', '--us']
+       after: upstreams and stages the stage depends on
+       inputs: files or directories relative to the project root, the stage is
+               skipped if one is missing (e.g. no US data downloaded)
+       outputs: files or directories under data/processed the stage writes
+    '''
+
+    def __init__(self, name, command, after, inputs=(), outputs=()):
+
+        self.name = name
+        self.command = list(command)
+        self.after = list(after)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        for each in self.outputs:
+            if not os.path.normpath(each).startswith(os.path.normpath(PROCESSED_DIR)+os.sep):
+                raise ValueError('output {} of stage {} is not in {}'.format(each, name, PROCESSED_DIR))
+
+    def run(self, env):
+        ''' Run the stage
+
+            Returns:
+            ----------
+            status: str
+                'done' or 'skipped'
+        '''
+        root = env.get(ROOT_ENV) or get_project_root()
+        if not all(os.path.exists(os.path.join(root, each)) for each in self.inputs):
+            return 'skipped'
+        result = subprocess.run([sys.executable, '-m']+self.command, cwd=CODE_ROOT, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError('stage {} failed:\n{}'.format(self.name, result.stderr[-2000:]))
+        return 'done'
+
+
+# in dependency order, every stage only depends on upstreams and stages above it
+STAGES=[Stage('relational', ['src.data.process_JH_data'], after=['john_hopkins'],
+              outputs=['data/processed/COVID_relational_confirmed.csv',
+                       'data/processed/COVID_relational_confirmed_US.csv',
+                       'data/processed/snapshots/COVID_relational_confirmed']),
+        Stage('features', ['src.features.build_features'], after=['relational'],
+              outputs=['data/processed/COVID_final_set.csv', 'data/processed/COVID_correction_log.csv',
+                       'data/processed/COVID_onset_index.csv', 'data/processed/snapshots/COVID_final_set']),
+        Stage('features_us', ['src.features.build_features', '--us'], after=['relational'],
+              inputs=['data/processed/COVID_relational_confirmed_US.csv'],
+              outputs=['data/processed/COVID_final_set_US.csv', 'data/processed/COVID_correction_log_US.csv']),
+        Stage('features_germany', ['src.features.build_features', '--germany'], after=['npgeo'],
+              inputs=['data/raw/NPGEO/districts'],
+              outputs=['data/processed/COVID_final_set_GER.csv', 'data/processed/COVID_final_set_GER.json',
+                       'data/processed/COVID_correction_log_GER.csv'])]
+
+
+def get_affected_stages(stages,changed):
+    ''' Stages downstream of the changed upstreams
+
+        Parameters:
+        ----------
+        stages: list of Stage
+            in dependency order
+        changed: list of str
+            names of the changed upstreams
+
+        Returns:
+        ----------
+        affected: list of Stage
+    '''
+    affected=set(changed)
+    result=[]
+    for stage in stages:
+        if affected.intersection(stage.after):
+            affected.add(stage.name)
+            result.append(stage)
+    return result
+
+
+def run_stages(stages,env,max_parallel=2):
+    ''' Run stages as soon as the stages they depend on are done, at most max_parallel at once
+
+        Stages depending on a failed stage are not started, the ones already running finish.
+
+        Returns:
+        ----------
+        results: dict name -> (status, seconds)
+            status 'done', 'skipped', 'failed' or 'not started'
+
+        Raises:
+        ----------
+        RuntimeError: if a stage failed, results are in the args
+    '''
+    names={stage.name for stage in stages}
+    results={}
+    errors=[]
+    waiting=list(stages)
+    running={}
+
+    def start(stage):
+        started=time.perf_counter()
+        return stage.run(env),time.perf_counter()-started
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        while waiting or running:
+            for stage in list(waiting):
+                before=[each for each in stage.after if each in names]
+                if any(results.get(each,('',))[0] in ('failed','not started') for each in before):
+                    results[stage.name]=('not started',0.0)
+                    waiting.remove(stage)
+                elif all(each in results for each in before) and len(running)<max_parallel:
+                    running[pool.submit(start,stage)]=stage
+                    waiting.remove(stage)
+            if not running:
+                continue
+            done,_=wait(running,return_when=FIRST_COMPLETED)
+            for future in done:
+                stage=running.pop(future)
+                try:
+                    results[stage.name]=future.result()
+                except Exception as err:
+                    results[stage.name]=('failed',0.0)
+                    errors.append(err)
+
+    if errors:
+        raise RuntimeError('; '.join(str(each) for each in errors),results)
+    return results
+
+
+def check_symlinks(directory):
+    ''' Raise RuntimeError if no symbolic links can be created in directory (e.g. windows
+        without developer mode), the staging copy of a run links to the project'''
+    target=tempfile.mkdtemp(prefix='.symlink-check-',dir=directory)
+    try:
+        open(os.path.join(target,'file'),'w').close()
+        os.symlink(os.path.join(target,'file'),os.path.join(target,'link'))
+    except (OSError,NotImplementedError) as err:
+        raise RuntimeError('the refresh stages run in a staging copy of the project which links to the '
+                           'published files, symbolic links are not available in '+directory+': '+str(err))
+    finally:
+        shutil.rmtree(target,ignore_errors=True)
+
+
+def _get_signature(file_path):
+    stat=os.stat(file_path)
+    return stat.st_ino,stat.st_size,stat.st_mtime_ns
+
+
+def _mirror(source,target,outputs,copied,relative=''):
+    ''' Directory of links to the entries of source, the outputs are copied instead'''
+    os.makedirs(target)
+    for each in os.listdir(source):
+        if each.endswith('.tmp'):
+            continue
+        nested={output.split('/',1)[1] for output in outputs if output.startswith(each+'/')}
+        source_path,target_path=os.path.join(source,each),os.path.join(target,each)
+        if each in outputs:
+            if os.path.isdir(source_path):
+                shutil.copytree(source_path,target_path)
+                files=[os.path.join(dirpath,name) for dirpath,dirs,names in os.walk(target_path) for name in names]
+            else:
+                shutil.copy2(source_path,target_path)
+                files=[target_path]
+            # publish_staging moves the copies the stages changed
+            for file_path in files:
+                copied[os.path.normpath(os.path.join(relative,os.path.relpath(file_path,target)))]=_get_signature(file_path)
+        elif nested and os.path.isdir(source_path):
+            _mirror(source_path,target_path,nested,copied,os.path.join(relative,each))
+        else:
+            os.symlink(source_path,target_path,target_is_directory=os.path.isdir(source_path))
+
+
+def create_staging(root,staging_root,outputs):
+    ''' Project view for the stages of one run, everything links to the project except
+        the declared outputs in data/processed, which are copies. A stage can neither
+        replace nor rewrite (open in place, append) a published output.
+
+        Parameters:
+        ----------
+        root: str
+            project root
+        staging_root: str
+            directory of the view, replaced
+        outputs: list of str
+            files or directories under data/processed relative to the project root
+
+        Returns:
+        ----------
+        copied: dict
+            path relative to data/processed -> signature of the copy
+    '''
+    shutil.rmtree(staging_root,ignore_errors=True)
+    os.makedirs(os.path.join(staging_root,'data'))
+    for each in os.listdir(root):
+        if each!='data':
+            os.symlink(os.path.join(root,each),os.path.join(staging_root,each),
+                       target_is_directory=os.path.isdir(os.path.join(root,each)))
+    skipped={os.path.basename(PROCESSED_DIR),os.path.relpath(staging_root,os.path.join(root,'data'))}
+    for each in os.listdir(os.path.join(root,'data')):
+        if each not in skipped:
+            os.symlink(os.path.join(root,'data',each),os.path.join(staging_root,'data',each),
+                       target_is_directory=os.path.isdir(os.path.join(root,'data',each)))
+
+    relative_outputs={os.path.relpath(each,PROCESSED_DIR).replace(os.sep,'/') for each in outputs}
+    copied={}
+    os.makedirs(os.path.join(root,PROCESSED_DIR),exist_ok=True)
+    _mirror(os.path.join(root,PROCESSED_DIR),os.path.join(staging_root,PROCESSED_DIR),relative_outputs,copied)
+    return copied
+
+
+def publish_staging(root,staging_root,copied):
+    ''' Move the files the stages wrote into data/processed (os.replace per file,
+        indexes and manifests last) and remove the copied files they deleted
+
+        Returns:
+        ----------
+        published: list of str
+            paths relative to data/processed
+    '''
+    processed=os.path.join(root,PROCESSED_DIR)
+    staged=os.path.join(staging_root,PROCESSED_DIR)
+    published=[]
+    present=set()
+    for dirpath,dirs,names in os.walk(staged): # links to the published entries are not followed
+        for name in names:
+            file_path=os.path.join(dirpath,name)
+            if name.endswith('.tmp') or os.path.islink(file_path):
+                continue
+            relative=os.path.normpath(os.path.relpath(file_path,staged))
+            present.add(relative)
+            if copied.get(relative)!=_get_signature(file_path):
+                published.append(relative)
+    removed=[each for each in copied if each not in present]
+
+    for relative in sorted(published,key=lambda each:(each.endswith('.json'),each)):
+        os.makedirs(os.path.dirname(os.path.join(processed,relative)),exist_ok=True)
+        os.replace(os.path.join(staged,relative),os.path.join(processed,relative))
+    for relative in removed:
+        target=os.path.join(processed,relative)
+        if os.path.exists(target):
+            os.remove(target)
+        directory=os.path.dirname(target)
+        while directory!=processed and not os.listdir(directory):
+            os.rmdir(directory)
+            directory=os.path.dirname(directory)
+    return published
+
+
+def load_state(state_path=STATE_PATH):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'tokens':{},'version':None,'stages':{}}
+
+
+def save_state(state,state_path=STATE_PATH):
+    with open(state_path+'.tmp','w') as f:
+        json.dump(state,f,indent=1)
+    os.replace(state_path+'.tmp',state_path)
+
+
+class RefreshScheduler():
+    '''Polls the upstream sources and refreshes the processed data when they changed.
+       Changes are collected until no source changed for quiet_period seconds (at most
+       max_delay after the first one), then the changed sources are fetched once and only
+       their downstream stages run. The stages write into a staging view of the project
+       (create_staging, their declared outputs are copies), only after all of them
+       succeeded their outputs replace the published files and one
+       version marker is written, running dashboards swap to it (see
+       data_provider.DataProvider). A failed run leaves the published data untouched.
+       Failed polls and runs are retried with exponential
+       backoff. The processed tokens are kept in the state file, a restart does not
+       refresh unchanged sources again.
+       Args:
+       -------
+       upstreams: list of Upstream
+       stages: list of Stage in dependency order
+       quiet_period, max_delay: seconds, see above
+       max_parallel: stages running at the same time
+       backoff, max_backoff: seconds to wait after the first failure and at most
+       state_path, marker_path: state file and version marker
+       clock: time source, replaced in tests
+    '''
+
+    def __init__(self, upstreams, stages=STAGES, quiet_period=120, max_delay=1800, max_parallel=2, backoff=60,
+                 max_backoff=3600, state_path=STATE_PATH, marker_path=VERSION_PATH, clock=time.monotonic):
+
+        check_symlinks(get_path('data'))
+        self.upstreams = {each.name: each for each in upstreams}
+        known = set(self.upstreams)
+        for stage in stages:
+            if not set(stage.after) <= known:
+                raise ValueError('stage {} depends on unknown {}'.format(stage.name, sorted(set(stage.after)-known)))
+            known.add(stage.name)
+        self.stages = stages
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self.max_parallel = max_parallel
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.state_path = state_path
+        self.marker_path = marker_path
+        self.clock = clock
+
+        self.state = load_state(state_path)
+        self.pending = {}           # upstream -> token not yet refreshed
+        self.first_change = None
+        self.last_change = None
+        self.next_poll = {name: 0 for name in self.upstreams}
+        self.poll_failures = {name: 0 for name in self.upstreams}
+        self.run_failures = 0
+        self.next_run = 0
+        self._stop = threading.Event()
+
+    def poll(self):
+        ''' Poll all upstreams which are due
+
+            Returns:
+            ----------
+            changed: list of str
+                upstreams with a new token since the last poll
+        '''
+        now = self.clock()
+        changed = []
+        for name, upstream in self.upstreams.items():
+            if now < self.next_poll[name]:
+                continue
+            try:
+                token = upstream.poll()
+            except Exception as err: # source not reachable, keep the last state
+                self.poll_failures[name] += 1
+                self.next_poll[name] = now+get_backoff(self.poll_failures[name], self.backoff, self.max_backoff)
+                logger.warning('poll of %s failed: %r', name, err)
+                continue
+            self.poll_failures[name] = 0
+            self.next_poll[name] = now+upstream.interval
+
+            if token != self.pending.get(name, self.state['tokens'].get(name)):
+                self.pending[name] = token
+                self.first_change = self.first_change or now
+                self.last_change = now
+                changed.append(name)
+        return changed
+
+    def is_due(self):
+        ''' True if changes are pending, quiet for quiet_period (or waiting for max_delay) and not in backoff'''
+        if not self.pending:
+            return False
+        now = self.clock()
+        return now >= self.next_run and (now-self.last_change >= self.quiet_period or
+                                         now-self.first_change >= self.max_delay)
+
+    def get_stage_env(self, root):
+        env = dict(os.environ)
+        env[ROOT_ENV] = root
+        env[DEFER_VERSION_ENV] = '1'
+        env['PYTHONPATH'] = os.pathsep.join([CODE_ROOT]+[each for each in [env.get('PYTHONPATH')] if each])
+        return env
+
+    def run(self):
+        ''' Fetch the pending upstreams, run their stages and publish the new version
+
+            Returns:
+            ----------
+            version: str
+                None if the run failed, it is retried after the backoff
+        '''
+        changed = dict(self.pending)
+        stages = get_affected_stages(self.stages, list(changed))
+        logger.info('refreshing %s -> %s', ', '.join(changed), ', '.join(each.name for each in stages) or 'no stages')
+        root = get_project_root()
+        staging_root = os.path.join(root, STAGING_DIR)
+        try:
+            for name in changed:
+                self.upstreams[name].fetch()
+            copied = create_staging(root, staging_root, [output for each in stages for output in each.outputs])
+            results = run_stages(stages, self.get_stage_env(staging_root), self.max_parallel)
+            published = publish_staging(root, staging_root, copied)
+        except Exception as err:
+            self.run_failures += 1
+            delay = get_backoff(self.run_failures, self.backoff, self.max_backoff)
+            self.next_run = self.clock()+delay
+            logger.error('refresh failed, retry in %.0f s: %s', delay, err.args[0] if err.args else repr(err))
+            return None
+        finally:
+            shutil.rmtree(staging_root, ignore_errors=True)
+
+        version = write_version_marker(self.marker_path)
+        for name, token in changed.items():
+            self.state['tokens'][name] = token
+            if self.pending.get(name) == token:
+                del self.pending[name]
+        self.state['version'] = version
+        self.state['stages'].update({name: {'status': status, 'seconds': round(seconds, 1), 'version': version}
+                                     for name, (status, seconds) in results.items()})
+        save_state(self.state, self.state_path)
+        self.run_failures = 0
+        self.first_change = self.last_change = None
+        logger.info('published version %s (%d files)', version, len(published))
+        return version
+
+    def step(self):
+        ''' One poll and, if due, one run
+
+            Returns:
+            ----------
+            version: str or None
+        '''
+        self.poll()
+        if self.is_due():
+            return self.run()
+        return None
+
+    def serve_forever(self, tick=5):
+        ''' Poll and refresh until stop() is called'''
+        while True:
+            try:
+                self.step()
+            except Exception as err: # keep the daemon alive, the next step retries
+                logger.exception('refresh step failed')
+            if self._stop.wait(tick):
+                return
+
+    def stop(self):
+        self._stop.set()
+
+
+@click.command()
+@click.option('--interval', default=900, type=int, help='seconds between two polls of a source')
+@click.option('--quiet-period', default=120, type=int, help='seconds without change before a refresh')
+@click.option('--max-delay', default=1800, type=int, help='seconds after the first change a refresh starts at the latest')
+@click.option('--max-parallel', default=2, type=int, help='stages running at the same time')
+@click.option('--local', 'local_dir', default=None, type=click.Path(exists=True, file_okay=False),
+              help='poll a local copy of the John Hopkins repository instead of github, e.g. a fake upstream')
+@click.option('--no-germany', is_flag=True, help='do not poll the RKI district data')
+@click.option('--once', is_flag=True, help='poll once and refresh changed sources without waiting')
+def main(interval, quiet_period, max_delay, max_parallel, local_dir, no_germany, once):
+    ''' Refresh the processed data whenever the upstream sources change'''
+    if local_dir:
+        upstreams=[LocalUpstream('john_hopkins', local_dir, 'data/raw/COVID-19', interval=interval)]
+    else:
+        upstreams=[GitUpstream(interval=interval)]
+    if not no_germany:
+        upstreams.append(NPGEOUpstream(interval=interval))
+    stages=[each for each in STAGES if not (no_germany and 'npgeo' in each.after)]
+
+    scheduler=RefreshScheduler(upstreams, stages, quiet_period=quiet_period, max_delay=max_delay,
+                               max_parallel=max_parallel)
+    if once:
+        scheduler.poll()
+        if scheduler.pending:
+            scheduler.run()
+        else:
+            logger.info('all sources are up to date')
+        return
+    scheduler.serve_forever()
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,294 @@
+import os
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from src.data.data_access import get_path
+
+
+SNAPSHOT_DIR=get_path('data/processed/snapshots')
+
+
+def get_series_keys(df_input,keys=('state','country')):
+    ''' String key per row e.g. 'no|Germany' '''
+    result=df_input[keys[0]].astype(str)
+    for each in keys[1:]:
+        result=result+'|'+df_input[each].astype(str)
+    return result.to_numpy()
+
+
+class SnapshotStore():
+    '''Append-only, time-travel store of the versions of one processed data set.
+       A version is kept as a compact delta against its predecessor: appended series,
+       appended dates and the changed cells only. Every full_every versions a full
+       base is written to keep the reconstruction chain short. Bases and the head (the
+       dense arrays of the latest version, which append compares against) are stored
+       uncompressed and memory-mapped, so a reader only pages in the rows it selects.
+       Args:
+       -------
+       name: data set name e.g. 'COVID_final_set'
+       root: snapshot directory
+       keys: columns identifying a series
+       full_every: number of versions between two full bases
+
+       Files:
+       -------
+       <name>/index.json:      versions with date, kind (base/delta) and file, head directory
+       <name>/v000001/:        base (keys.npy, dates.npy, one column_<name>.npy per column)
+       <name>/v000002.npz:     delta (new_keys, new_dates, rows/cols/values per column)
+       <name>/head_v000002/:   latest version in the layout of a base (a base is its own head)
+    '''
+
+    def __init__(self, name, root=SNAPSHOT_DIR, keys=('state','country'), full_every=30):
+
+        self.name = name
+        self.path = os.path.join(root, name)
+        self.keys = list(keys)
+        self.full_every = full_every
+
+    def load_index(self):
+        try:
+            with open(os.path.join(self.path, 'index.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'versions': []}
+
+    def _write_index(self, index):
+        with open(os.path.join(self.path, 'index.json.tmp'), 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(os.path.join(self.path, 'index.json.tmp'), os.path.join(self.path, 'index.json'))
+
+    def _save_arrays(self, name, keys, dates, arrays):
+        ''' Write a base or head directory, renamed into place when complete
+
+            Returns:
+            ----------
+            size: int
+                bytes written
+        '''
+        target = os.path.join(self.path, name)
+        tmp_path = target+'.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'keys.npy'), np.array(keys, dtype=str))
+        np.save(os.path.join(tmp_path, 'dates.npy'), np.array(dates, dtype=str))
+        for column, values in arrays.items():
+            np.save(os.path.join(tmp_path, 'column_'+column+'.npy'), values)
+        size = sum(os.path.getsize(os.path.join(tmp_path, each)) for each in os.listdir(tmp_path))
+        os.replace(tmp_path, target)
+        return size
+
+    def _load_arrays(self, name):
+        ''' Keys, dates and memory-mapped dense columns of a base or head directory
+            (bases of older stores are compressed .npz files)
+
+            Returns:
+            ----------
+            keys: list of str
+            dates: list of str
+            arrays: dict column -> np.array (series x dates)
+        '''
+        path = os.path.join(self.path, name)
+        if not os.path.isdir(path):
+            files = np.load(path+'.npz')
+            return list(files['keys']), list(files['dates']), \
+                {each[len('column_'):]: files[each] for each in files.files if each.startswith('column_')}
+
+        arrays = {each[len('column_'):-len('.npy')]: np.load(os.path.join(path, each), mmap_mode='r')
+                  for each in os.listdir(path) if each.startswith('column_')}
+        return list(np.load(os.path.join(path, 'keys.npy'))), list(np.load(os.path.join(path, 'dates.npy'))), arrays
+
+    def _get_head(self, index, version):
+        ''' Directory holding the dense arrays of a version, None if only base and deltas do'''
+        head = index.get('head')
+        return head if head in (version, 'head_'+version) else None
+
+    def append(self, df_input, snapshot_date=None, value_columns=None):
+        ''' Store a refresh of the data set as new version
+
+            Parameters:
+            ----------
+            df_input: pd.DataFrame
+                relational data set with date, key and value columns
+            snapshot_date: str
+                day of the refresh, default today
+            value_columns: list of str
+                default all numeric columns
+
+            Returns:
+            ----------
+            version: str or None if nothing changed since the last version
+        '''
+        if value_columns is None:
+            value_columns = [each for each in df_input.columns
+                             if each not in self.keys and each != 'date' and pd.api.types.is_numeric_dtype(df_input[each])]
+        snapshot_date = str(pd.Timestamp(snapshot_date or pd.Timestamp.now()).date())
+
+        index = self.load_index()
+        os.makedirs(self.path, exist_ok=True)
+
+        if index['versions']:
+            # latest version from the head, stores without head replay base and deltas once
+            head = self._get_head(index, index['versions'][-1]['version'])
+            if head is None:
+                previous_keys, previous_dates, previous = self._reconstruct(index, len(index['versions'])-1)
+            else:
+                previous_keys, previous_dates, previous = self._load_arrays(head)
+        else:
+            previous_keys, previous_dates, previous = [], [], {}
+
+        # global order of series and dates only ever grows
+        series = get_series_keys(df_input, self.keys)
+        dates = df_input['date'].astype(str).str[:10].to_numpy()
+        key_pos = {key: pos for pos, key in enumerate(previous_keys)}
+        new_keys = [key for key in pd.unique(series) if key not in key_pos]
+        key_pos.update({key: len(previous_keys)+pos for pos, key in enumerate(new_keys)})
+        date_pos = {date: pos for pos, date in enumerate(previous_dates)}
+        new_dates = [date for date in sorted(pd.unique(dates)) if date not in date_pos]
+        date_pos.update({date: len(previous_dates)+pos for pos, date in enumerate(new_dates)})
+
+        rows = np.array([key_pos[each] for each in series])
+        cols = np.array([date_pos[each] for each in dates])
+        shape = (len(key_pos), len(date_pos))
+
+        current = {}
+        for column in value_columns:
+            current[column] = np.full(shape, np.nan)
+            current[column][rows, cols] = df_input[column].to_numpy(dtype=np.float64)
+
+        n_version = len(index['versions'])+1
+        version = 'v{:06d}'.format(n_version)
+        file_path = os.path.join(self.path, version+'.npz')
+
+        full = not index['versions'] or (n_version-1) % self.full_every == 0 or set(value_columns) != set(previous)
+        if full:
+            size = self._save_arrays(version, list(key_pos), list(date_pos), current)
+            n_changed = int(sum(np.isfinite(each).sum() for each in current.values()))
+            head = version
+        else:
+            arrays = {'new_keys': np.array(new_keys, dtype=str), 'new_dates': np.array(new_dates, dtype=str)}
+            n_changed = 0
+            for column in value_columns:
+                before = np.full(shape, np.nan)
+                before[:previous[column].shape[0], :previous[column].shape[1]] = previous[column]
+                after = current[column]
+                changed = ~((before == after) | (np.isnan(before) & np.isnan(after)))
+                changed_rows, changed_cols = np.nonzero(changed)
+                arrays['rows_'+column] = changed_rows.astype(np.int32)
+                arrays['cols_'+column] = changed_cols.astype(np.int32)
+                arrays['values_'+column] = after[changed_rows, changed_cols]
+                n_changed += len(changed_rows)
+            if n_changed == 0 and not new_keys and not new_dates:
+                return None
+            np.savez_compressed(file_path, **arrays)
+            size = os.path.getsize(file_path)
+            head = 'head_'+version
+            self._save_arrays(head, list(key_pos), list(date_pos), current)
+
+        index['versions'].append({'version': version, 'date': snapshot_date,
+                                  'kind': 'base' if full else 'delta',
+                                  'columns': value_columns, 'n_cells': n_changed,
+                                  'bytes': size})
+        previous_head, index['head'] = index.get('head'), head
+        self._write_index(index)
+        if previous_head is not None and previous_head.startswith('head_'):
+            shutil.rmtree(os.path.join(self.path, previous_head), ignore_errors=True)
+        return version
+
+    def _reconstruct(self, index, position, selected=None):
+        ''' Apply base and deltas up to a version position
+
+            Parameters:
+            ----------
+            selected: callable
+                gets the list of all series keys of the version and returns the
+                positions to keep, only those rows are materialized
+
+            Returns:
+            ----------
+            keys: list of str
+            dates: list of str
+            arrays: dict column -> np.array (kept series x dates)
+        '''
+        versions = index['versions'][:position+1]
+        head = self._get_head(index, versions[-1]['version'])
+        if head is None:
+            start = max(pos for pos, each in enumerate(versions) if each['kind'] == 'base')
+            keys, dates, base_arrays = self._load_arrays(versions[start]['version'])
+            deltas = [np.load(os.path.join(self.path, each['version']+'.npz')) for each in versions[start+1:]]
+        else:
+            keys, dates, base_arrays = self._load_arrays(head)
+            deltas = []
+
+        # first pass, series and dates of the version (small arrays only)
+        for each in deltas:
+            keys += list(each['new_keys'])
+            dates += list(each['new_dates'])
+
+        rows = np.arange(len(keys)) if selected is None else np.asarray(selected(keys), dtype=np.int64)
+        lookup = np.full(len(keys), -1)
+        lookup[rows] = np.arange(len(rows))
+
+        columns = versions[-1]['columns']
+        arrays = {}
+        for column in columns:
+            base = base_arrays[column]
+            result = np.full((len(rows), len(dates)), np.nan)
+            base_rows = rows[rows < base.shape[0]]
+            result[lookup[base_rows], :base.shape[1]] = base[base_rows] # reads the selected rows only
+            for each in deltas:
+                target = lookup[each['rows_'+column]]
+                keep = target >= 0
+                result[target[keep], each['cols_'+column][keep]] = each['values_'+column][keep]
+            arrays[column] = result
+
+        return [keys[each] for each in rows], dates, arrays
+
+    def read_as_of(self, date, countries=None):
+        ''' Data set as it was published on a given day
+
+            Parameters:
+            ----------
+            date: str
+                the last version stored on or before this day is returned
+            countries: list of str
+                only these countries are reconstructed
+
+            Returns:
+            ----------
+            df_output: pd.DataFrame
+                relational data set (date, keys, value columns)
+        '''
+        index = self.load_index()
+        positions = [pos for pos, each in enumerate(index['versions']) if each['date'] <= str(pd.Timestamp(date).date())]
+        if not positions:
+            raise KeyError('no snapshot of '+self.name+' on or before '+str(date))
+
+        selected = None
+        if countries is not None:
+            country_pos = self.keys.index('country')
+            countries = set(countries)
+            selected = lambda keys: [pos for pos, key in enumerate(keys) if key.split('|')[country_pos] in countries]
+
+        keys, dates, arrays = self._reconstruct(index, positions[-1], selected)
+
+        df_output = pd.DataFrame({'date': np.repeat(np.array(dates, dtype='datetime64[ns]')[None, :], len(keys), axis=0).ravel()})
+        key_parts = np.array([key.split('|') for key in keys], dtype=object).reshape(len(keys), len(self.keys))
+        for pos, each in enumerate(self.keys):
+            df_output[each] = np.repeat(key_parts[:, pos], len(dates))
+        for column, values in arrays.items():
+            df_output[column] = values.ravel()
+
+        df_output = df_output[df_output[list(arrays)].notna().any(axis=1)]
+        return df_output.sort_values(['date']+self.keys[::-1]).reset_index(drop=True)
+
+    def summary(self):
+        ''' Versions with kind and size as data frame'''
+        return pd.DataFrame(self.load_index()['versions'])
+
+
+if __name__ == '__main__':
+    store=SnapshotStore('COVID_final_set')
+    print(store.summary().tail())
@@ -1,9 +1,34 @@
+import os
+import sys
+import json
+
 import numpy as np
-from sklearn import linear_model
-reg = linear_model.LinearRegression(fit_intercept=True)
 import pandas as pd
 
-from scipy import signal
+from src.data.data_access import get_path, write_csv
+
+try:
+    import resource
+except ImportError: # not available on windows
+    resource = None
+
+# keys, counts and features of the memory-budget (compact) representation
+COMPACT_KEYS=['state','country']
+COMPACT_COUNT_DTYPE='int32'
+COMPACT_FEATURE_DTYPE='float32'
+COMPACT_DAY_DTYPE='int16'
+
+# sklearn is only imported when the regression is used for the first time
+reg=None
+
+
+def get_regression():
+    ''' Shared linear regression model, created on first use'''
+    global reg
+    if reg is None:
+        from sklearn import linear_model
+        reg=linear_model.LinearRegression(fit_intercept=True)
+    return reg
 
 ## Data Filtering
 def savgol_filter(df_input,column='confirmed',window=5):
@@ -22,6 +47,8 @@ def savgol_filter(df_input,column='confirmed',window=5):
             the index of the df_input has to be preserved in result
     '''
 
+    from scipy import signal
+
     degree=1
     df_result=df_input
 
@@ -51,6 +78,7 @@ def get_doubling_time_via_regression(in_array):
     X = np.arange(-1,2).reshape(-1, 1)
 
     assert len(in_array)==3
+    reg=get_regression()
     reg.fit(X,y)
     intercept=reg.intercept_
     slope=reg.coef_
@@ -139,23 +167,455 @@ def calc_doubling_rate(df_input,filter_on='confirmed'):
     return df_output
 
 
+## Memory-budget mode
+def get_peak_rss_mb():
+    ''' Peak resident set size of the current process
+
+        Returns:
+        ----------
+        peak_rss: float
+            in MB, NaN if the platform does not report it
+    '''
+    if resource is None:
+        return np.nan
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # kB on linux
+
+
+def read_compact_csv(data_path=get_path('data/processed/COVID_relational_confirmed.csv')):
+    ''' Read the relational data set directly into the compact representation
+
+        Parameters:
+        ----------
+        data_path: str
+
+        Returns:
+        ----------
+        df_compact: pd.DataFrame
+            columns state, country (categorical), day (int16 offset to df.attrs['date_origin']),
+            confirmed (int32)
+    '''
+    df_input=pd.read_csv(data_path,sep=';',
+                         dtype={'state':'category','country':'category','confirmed':'float64'},
+                         parse_dates=['date'])
+    return to_compact_frame(df_input)
+
+
+def to_compact_frame(df_input,count_columns=('confirmed',)):
+    ''' Convert a relational data frame into the compact representation (in place where possible)
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+            with columns state, country, date and the count columns
+        count_columns: tuple of str
+            cumulative counts, stored as int32
+
+        Returns:
+        ----------
+        df_output: pd.DataFrame
+            sorted by date, date replaced by an int16 day offset
+    '''
+    for each in COMPACT_KEYS:
+        if df_input[each].dtype.name!='category':
+            df_input[each]=df_input[each].astype('category')
+    for each in count_columns:
+        df_input[each]=df_input[each].fillna(0).astype(COMPACT_COUNT_DTYPE)
+
+    date_origin=df_input['date'].min()
+    df_input['day']=((df_input['date']-date_origin).dt.days).astype(COMPACT_DAY_DTYPE)
+    df_input.drop(columns=['date'],inplace=True)
+    df_input.sort_values('day',inplace=True,kind='stable')
+    df_input.reset_index(drop=True,inplace=True)
+    df_input.attrs['date_origin']=date_origin
+
+    return df_input
+
+
+def from_compact_frame(df_input):
+    ''' Restore the date column of a compact frame (for writing the processed data set)'''
+    df_output=df_input.drop(columns=['day'])
+    df_output.insert(0,'date',df_input.attrs['date_origin']+pd.to_timedelta(df_input['day'],unit='D'))
+    return df_output
+
+
+def calc_filtered_data_compact(df_input,filter_on='confirmed',window=5):
+    ''' Savgol filter on a compact frame, the result column is added in place as float32,
+        the filter itself runs in float64 (float32 spacing is 8 at 1e8 cases)
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+            compact frame, sorted by day
+        filter_on: str
+        window: int
+
+        Returns:
+        ----------
+        df_input: pd.DataFrame
+    '''
+    from scipy import signal
+
+    def savgol_array(series):
+        return signal.savgol_filter(series.to_numpy(dtype=np.float64),window,1)
+
+    df_input[filter_on+'_filtered']=df_input.groupby(COMPACT_KEYS,observed=True,sort=False)[filter_on] \
+                                            .transform(savgol_array) \
+                                            .astype(COMPACT_FEATURE_DTYPE)
+    return df_input
+
+
+def calc_doubling_rate_compact(df_input,filter_on='confirmed'):
+    ''' Doubling rate on a compact frame, the result column is added in place as float32,
+        intercept and slope are computed in float64 and only the result is cast
+
+        The 3 day regression of get_doubling_time_via_regression has a closed form
+        for X=[-1,0,1]: intercept=mean(y), slope=(y[2]-y[0])/2, so no model is fitted per window.
+        The int32/float32 values are sorted by series and day once, a window is valid
+        where its first and last row belong to the same series (no shifted float64 copies).
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+            compact frame, sorted by day
+        filter_on: str
+
+        Returns:
+        ----------
+        df_input: pd.DataFrame
+    '''
+    # series id from the category codes, -1 for a missing key (not part of any series)
+    series=np.zeros(len(df_input),dtype=np.int32)
+    missing=np.zeros(len(df_input),dtype=bool)
+    for each in COMPACT_KEYS:
+        codes=df_input[each].cat.codes.to_numpy()
+        series*=len(df_input[each].cat.categories)
+        series+=codes
+        missing|=codes<0
+    series[missing]=-1
+
+    order=np.lexsort((df_input['day'].to_numpy(),series))
+    y=df_input[filter_on].to_numpy()[order]
+    series=series[order]
+    same_series=(series[2:]==series[:-2])&(series[2:]>=0)
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        intercept=np.add(y[:-2],y[1:-1],dtype=np.float64)
+        intercept+=y[2:]
+        intercept/=3
+        slope=np.subtract(y[2:],y[:-2],dtype=np.float64)
+        slope/=2
+        intercept/=slope
+
+    doubling_rate=np.full(len(y),np.nan,dtype=COMPACT_FEATURE_DTYPE)
+    doubling_rate[2:][same_series]=intercept[same_series]
+    result=np.empty_like(doubling_rate)
+    result[order]=doubling_rate
+    df_input[filter_on+'_DR']=result
+
+    return df_input
+
+
+def run_compact_pipeline(data_path=get_path('data/processed/COVID_relational_confirmed.csv'),repair_strategy='redistribute'):
+    ''' Full feature pipeline in memory-budget mode, prints the peak RSS after each stage
+
+        Returns:
+        ----------
+        df_compact: pd.DataFrame
+        df_correction_log: pd.DataFrame
+    '''
+    from src.features.repair_counts import repair_cumulative_counts
+    from src.features.rt_estimation import calc_Rt, calc_country_Rt
+
+    df_compact=read_compact_csv(data_path)
+    print('compact read:      peak RSS {:.1f} MB'.format(get_peak_rss_mb()))
+    df_compact,df_correction_log=repair_cumulative_counts(df_compact,strategy=repair_strategy,time_column='day')
+    print('repaired:          peak RSS {:.1f} MB'.format(get_peak_rss_mb()))
+    calc_filtered_data_compact(df_compact)
+    print('filtered:          peak RSS {:.1f} MB'.format(get_peak_rss_mb()))
+    calc_doubling_rate_compact(df_compact)
+    calc_doubling_rate_compact(df_compact,'confirmed_filtered')
+    calc_Rt(df_compact,time_column='day',dtype=COMPACT_FEATURE_DTYPE)
+    calc_country_Rt(df_compact,time_column='day',dtype=COMPACT_FEATURE_DTYPE)
+    print('doubling rate:     peak RSS {:.1f} MB'.format(get_peak_rss_mb()))
+
+    df_compact.loc[df_compact['confirmed']<=100,'confirmed_filtered_DR']=np.nan
+    print('frame memory:      {:.1f} MB'.format(df_compact.memory_usage(deep=True).sum()/1024**2))
+    return df_compact,df_correction_log
+
+
+## Batched engine on the dense layout (all series at once)
+def calc_dense_doubling_rate(Y):
+    ''' Closed form of the 3 day regression doubling rate for a dense array
+
+        Parameters:
+        ----------
+        Y: np.array (series x days)
+
+        Returns:
+        ----------
+        DR: np.array (series x days), the first two days are NaN
+    '''
+    DR=np.full(Y.shape,np.nan,dtype=Y.dtype)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        DR[:,2:]=((Y[:,:-2]+Y[:,1:-1]+Y[:,2:])/3)/((Y[:,2:]-Y[:,:-2])/2)
+    return DR
+
+
+def calc_dense_features(Y,window=5,filter_on='confirmed'):
+    ''' Savgol filter and doubling rates for a dense array of cumulative counts
+
+        Parameters:
+        ----------
+        Y: np.array (series x days)
+        window: int
+        filter_on: str
+
+        Returns:
+        ----------
+        features: dict column name -> np.array (series x days)
+    '''
+    from scipy import signal
+
+    Y_filtered=signal.savgol_filter(Y,window,1,axis=1)
+    return {filter_on+'_filtered':Y_filtered,
+            filter_on+'_DR':calc_dense_doubling_rate(Y),
+            filter_on+'_filtered_DR':calc_dense_doubling_rate(Y_filtered)}
+
+
+def calc_shard_features(df_shard,keys,filter_on='confirmed',time_column='date',dtype=None,
+                        repair_strategy=None,rt=False):
+    ''' Count repair, filter, doubling rates and Rt of one shard, the dense layout is built in the worker
+
+        Parameters:
+        ----------
+        df_shard: pd.DataFrame
+            keys, time column and filter_on of complete series
+        keys: list of str
+        filter_on: str
+        time_column: str
+        dtype: str
+            dtype of the results, the computation is done in float64
+        repair_strategy: str
+            repair the counts first (see repair_counts.py), None keeps them
+        rt: bool
+            add <filter_on>_Rt with its credible interval
+
+        Returns:
+        ----------
+        features: dict column name -> np.array aligned with the rows of df_shard,
+            with the repaired counts as filter_on
+        df_log: pd.DataFrame or None, correction log of the shard
+    '''
+    from src.features.dense_layout import DenseLayout, fill_cumulative
+
+    features={}
+    df_log=None
+    if repair_strategy is not None:
+        from src.features.repair_counts import repair_cumulative_counts
+
+        df_shard,df_log=repair_cumulative_counts(df_shard.copy(),filter_on,repair_strategy,
+                                                 keys=keys,time_column=time_column)
+        features[filter_on]=df_shard[filter_on].to_numpy()
+
+    layout=DenseLayout(df_shard,keys,time_column)
+    Y=fill_cumulative(layout.to_dense(df_shard,filter_on))
+    results=calc_dense_features(Y,filter_on=filter_on)
+    if rt:
+        from src.features.rt_estimation import calc_dense_Rt
+
+        results.update(zip([filter_on+'_Rt',filter_on+'_Rt_lower',filter_on+'_Rt_upper'],calc_dense_Rt(Y)))
+    for column,values in results.items():
+        result=values[layout.row_codes,layout.col_codes]
+        features[column]=result if dtype is None else result.astype(dtype)
+    return features,df_log
+
+
+def calc_features_sharded(df_input,keys=('state','country','county'),filter_on='confirmed',
+                          time_column='date',shard_size=500,n_workers=None,dtype=None,
+                          repair_strategy=None,rt=False):
+    ''' Count repair, filter, doubling rates and Rt for many series, sharded over a process pool
+
+        The relational rows are split by series into blocks of shard_size series, every
+        worker repairs the counts and builds the dense layout of its block only, so
+        neither the parent nor a worker holds more than shard_size x days of dense values.
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+            relational data set, result columns are added in place
+        keys: tuple of str
+            columns identifying a series
+        filter_on: str
+        time_column: str
+        shard_size: int
+            number of series per shard
+        n_workers: int
+            process pool size, 1 computes in the calling process
+        dtype: str
+            dtype of the result columns e.g. 'float32', default float64
+        repair_strategy: str
+            repair filter_on in place before the features, None keeps the counts
+        rt: bool
+            add the Rt columns (rt_estimation.calc_Rt)
+
+        Returns:
+        ----------
+        df_input: pd.DataFrame
+        df_correction_log: pd.DataFrame or None without repair
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+
+    keys=list(keys)
+    codes=df_input.groupby(keys,sort=True,observed=True).ngroup().to_numpy()
+    order=np.argsort(codes,kind='stable')
+    bounds=np.searchsorted(codes[order],np.arange(0,codes.max()+1,shard_size))
+    positions=np.split(order,bounds[1:])
+    columns=keys+[time_column,filter_on]
+    shards=[df_input[columns].iloc[each] for each in positions]
+
+    if n_workers==1 or len(shards)==1:
+        results=[calc_shard_features(each,keys,filter_on,time_column,dtype,repair_strategy,rt) for each in shards]
+    else:
+        n=len(shards)
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results=list(pool.map(calc_shard_features,shards,[keys]*n,[filter_on]*n,[time_column]*n,[dtype]*n,
+                                  [repair_strategy]*n,[rt]*n))
+
+    for column in results[0][0]:
+        values=np.empty(len(df_input),dtype=results[0][0][column].dtype)
+        for rows,(each,_) in zip(positions,results):
+            values[rows]=each[column]
+        df_input[column]=values
+
+    df_correction_log=None
+    if repair_strategy is not None:
+        df_correction_log=pd.concat([df_log for _,df_log in results],ignore_index=True)
+    return df_input,df_correction_log
+
+
+def run_county_pipeline(data_path=get_path('data/processed/COVID_relational_confirmed_US.csv'),n_workers=None):
+    ''' Feature pipeline for the US county data set (extra level county)
+
+        Repair, features and Rt run per shard of counties (see calc_features_sharded).
+
+        Returns:
+        ----------
+        df_county: pd.DataFrame
+        df_correction_log: pd.DataFrame
+    '''
+    keys=('state','country','county')
+    df_county=pd.read_csv(data_path,sep=';',parse_dates=['date'],
+                          dtype={'state':'category','country':'category','county':'category',
+                                 'fips':'int64','confirmed':'int32'})
+    df_county,df_correction_log=calc_features_sharded(df_county,keys=keys,n_workers=n_workers,
+                                                      dtype=COMPACT_FEATURE_DTYPE,
+                                                      repair_strategy='redistribute',rt=True)
+
+    df_county.loc[df_county['confirmed']<=100,'confirmed_filtered_DR']=np.nan
+    print('county series: '+str(df_county.groupby(list(keys),observed=True).ngroups)+
+          ', peak RSS {:.1f} MB'.format(get_peak_rss_mb()))
+    return df_county,df_correction_log
+
+
+def run_district_pipeline(store_dir=get_path('data/raw/NPGEO/districts'),
+                          output_path=get_path('data/processed/COVID_final_set_GER.csv'),n_workers=1):
+    ''' Feature pipeline for the German districts (NPGEO daily snapshots)
+
+        The partitions a result was built from are recorded next to it, a rerun
+        without new or changed snapshots returns without reading the store.
+
+        Returns:
+        ----------
+        df_district: pd.DataFrame or None if the result is up to date
+        df_correction_log: pd.DataFrame or None
+    '''
+    from src.data.npgeo_store import list_partitions, load_district_data
+
+    manifest_path=os.path.splitext(output_path)[0]+'.json'
+    partitions={date:[os.path.getsize(path),os.stat(path).st_mtime_ns]
+                for date,path in list_partitions(store_dir).items()}
+    if os.path.exists(manifest_path) and os.path.exists(output_path):
+        with open(manifest_path) as f:
+            if json.load(f)['partitions']==partitions:
+                return None,None
+
+    keys=('state','country','county')
+    df_district=load_district_data(store_dir)
+    df_district,df_correction_log=calc_features_sharded(df_district,keys=keys,n_workers=n_workers,
+                                                        dtype=COMPACT_FEATURE_DTYPE,
+                                                        repair_strategy='redistribute',rt=True)
+    df_district.loc[df_district['confirmed']<=100,'confirmed_filtered_DR']=np.nan
+
+    write_csv(df_district,output_path,sep=';',index=False)
+    with open(manifest_path+'.tmp','w') as f:
+        json.dump({'partitions':partitions},f)
+    os.replace(manifest_path+'.tmp',manifest_path)
+    return df_district,df_correction_log
+
+
 if __name__ == '__main__':
+    from src.features.repair_counts import repair_cumulative_counts
+    from src.features.rt_estimation import calc_Rt, calc_country_Rt
+    from src.data.snapshot_store import SnapshotStore
+    from src.data.data_provider import write_version_marker
+    from src.features.onset_index import save_onset_index
+
+    if '--us' in sys.argv:
+        pd_result_county,pd_correction_log=run_county_pipeline()
+        write_csv(pd_correction_log,get_path('data/processed/COVID_correction_log_US.csv'),sep=';',index=False)
+        write_csv(pd_result_county,get_path('data/processed/COVID_final_set_US.csv'),sep=';',index=False)
+        write_version_marker()
+        sys.exit(0)
+
+    if '--germany' in sys.argv:
+        pd_result_district,pd_correction_log=run_district_pipeline()
+        if pd_result_district is None:
+            print('district features are up to date')
+        else:
+            write_csv(pd_correction_log,get_path('data/processed/COVID_correction_log_GER.csv'),sep=';',index=False)
+            print('district series: '+str(pd_result_district['county'].nunique())+
+                  ', days: '+str(pd_result_district['date'].nunique()))
+            write_version_marker()
+        sys.exit(0)
+
+    if '--compact' in sys.argv:
+        pd_result_compact,pd_correction_log=run_compact_pipeline()
+        write_csv(pd_correction_log,get_path('data/processed/COVID_correction_log.csv'),sep=';',index=False)
+        pd_result_larg=from_compact_frame(pd_result_compact)
+        write_csv(pd_result_larg,get_path('data/processed/COVID_final_set.csv'),sep=';',index=False)
+        save_onset_index(pd_result_larg)
+        SnapshotStore('COVID_final_set').append(pd_result_larg)
+        write_version_marker()
+        print('peak RSS: {:.1f} MB'.format(get_peak_rss_mb()))
+        sys.exit(0)
+
     test_data_reg=np.array([2,4,6])
     result=get_doubling_time_via_regression(test_data_reg)
     print('the test slope is: '+str(result))
 
-    pd_JH_data=pd.read_csv('data/processed/COVID_relational_confirmed.csv',sep=';',parse_dates=[0])
+    pd_JH_data=pd.read_csv(get_path('data/processed/COVID_relational_confirmed.csv'),sep=';',parse_dates=[0])
     pd_JH_data=pd_JH_data.sort_values('date',ascending=True).copy()
 
+    # decreasing cumulative counts (corrections) are repaired before any feature
+    pd_JH_data,pd_correction_log=repair_cumulative_counts(pd_JH_data,strategy='redistribute')
+    write_csv(pd_correction_log,get_path('data/processed/COVID_correction_log.csv'),sep=';',index=False)
+    print('repaired series: '+str(len(pd_correction_log)))
+
     #test_structure=pd_JH_data[((pd_JH_data['country']=='US')|
     #                  (pd_JH_data['country']=='Germany'))]
 
     pd_result_larg=calc_filtered_data(pd_JH_data)
     pd_result_larg=calc_doubling_rate(pd_result_larg)
     pd_result_larg=calc_doubling_rate(pd_result_larg,'confirmed_filtered')
+    pd_result_larg=calc_Rt(pd_result_larg)
+    pd_result_larg=calc_country_Rt(pd_result_larg)
 
 
     mask=pd_result_larg['confirmed']>100
     pd_result_larg['confirmed_filtered_DR']=pd_result_larg['confirmed_filtered_DR'].where(mask, other=np.NaN)
-    pd_result_larg.to_csv('data/processed/COVID_final_set.csv',sep=';',index=False)
+    write_csv(pd_result_larg,get_path('data/processed/COVID_final_set.csv'),sep=';',index=False)
+    save_onset_index(pd_result_larg)
+    SnapshotStore('COVID_final_set').append(pd_result_larg)
+    # running dashboards reload the data set in the background
+    write_version_marker()
     print(pd_result_larg[pd_result_larg['country']=='Germany'].tail())
\ No newline at end of file
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+
+class DenseLayout():
+    '''Mapping between the relational data set (one row per series and day) and a
+       dense array (series x days), so kernels can run over all series at once.
+       Values are scattered/gathered with integer codes, no merges and no copies
+       of the relational frame.
+       Args:
+       -------
+       df_input: relational pd.DataFrame
+       keys: columns identifying a series
+       time_column: 'date' or the int16 'day' of the compact representation
+
+       The time axis is a continuous daily range from the first to the last day, days
+       without any row (e.g. a missing snapshot) are NaN columns, see fill_cumulative.
+    '''
+
+    def __init__(self, df_input, keys=('state','country'), time_column='date'):
+
+        self.keys = list(keys)
+        self.time_column = time_column
+
+        grouped = df_input.groupby(self.keys, sort=True, observed=True)
+        self.row_codes = grouped.ngroup().to_numpy()
+        self.index = pd.DataFrame(list(grouped.groups.keys()), columns=self.keys) if len(self.keys) > 1 \
+            else pd.DataFrame({self.keys[0]: list(grouped.groups.keys())})
+
+        self.col_codes, self.times = get_daily_codes(df_input[time_column])
+        self.shape = (len(self.index), len(self.times))
+
+    def to_dense(self, df_input, column, fill=np.nan):
+        ''' Scatter one column into a dense array
+
+            Returns:
+            ----------
+            values: np.array (series x days), float64
+        '''
+        values = np.full(self.shape, fill, dtype=np.float64)
+        values[self.row_codes, self.col_codes] = df_input[column].to_numpy(dtype=np.float64)
+        return values
+
+    def assign(self, df_input, column, values, dtype=None):
+        ''' Gather a dense array back into a (new or existing) column, in place'''
+        result = values[self.row_codes, self.col_codes]
+        df_input[column] = result if dtype is None else result.astype(dtype)
+        return df_input
+
+    def series_names(self):
+        ''' Series keys as strings, country first e.g. 'Germany|no' for state and country
+            (the convention of series_matrix and the query service)'''
+        order = sorted(range(len(self.keys)), key=lambda pos: self.keys[pos] != 'country')
+        return ['|'.join(str(row[pos]) for pos in order) for row in self.index.itertuples(index=False)]
+
+
+def get_daily_codes(times):
+    ''' Column codes of a continuous daily time axis
+
+        Parameters:
+        ----------
+        times: pd.Series
+            datetime64 dates or integer day numbers, other types are factorized
+            (only the days present)
+
+        Returns:
+        ----------
+        codes: np.array
+        axis: pd.DatetimeIndex or np.array
+    '''
+    if pd.api.types.is_datetime64_any_dtype(times):
+        days = times.dt.floor('D')
+        axis = pd.date_range(days.min(), days.max(), freq='D')
+        return ((days-axis[0])//pd.Timedelta(days=1)).to_numpy(dtype=np.int64), axis
+    if pd.api.types.is_integer_dtype(times):
+        first = int(times.min())
+        axis = np.arange(first, int(times.max())+1).astype(times.dtype)
+        return times.to_numpy(dtype=np.int64)-first, axis
+    return pd.factorize(times, sort=True)
+
+
+def fill_cumulative(values):
+    ''' Forward fill missing days of cumulative series, leading gaps become 0'''
+    mask = np.isnan(values)
+    if not mask.any():
+        return values
+    idx = np.where(~mask, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    filled = values[np.arange(values.shape[0])[:, None], idx]
+    return np.where(np.isnan(filled), 0, filled)
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+from src.data.data_access import get_path, write_csv, load_population, ONSET_INDEX
+from src.features.series_matrix import get_similarity_series
+
+
+# (kind, value): absolute confirmed cases or percent of the population
+ONSET_THRESHOLDS=[('cases',100),('cases',1000),('cases',10000),
+                  ('percent',0.001),('percent',0.01),('percent',0.1)]
+
+
+def get_threshold_name(kind,value):
+    ''' Column of a threshold in the onset index e.g. cases_100 or percent_0.01'''
+    return kind+'_'+('{:g}'.format(value))
+
+
+def get_threshold_label(name):
+    ''' Axis label of a threshold column e.g. 'Days since 100 cases' '''
+    kind,value=name.split('_',1)
+    if kind=='cases':
+        return 'Days since {:,} cases'.format(int(float(value)))
+    return 'Days since '+value+'% of population infected'
+
+
+def compute_onset_index(Y,thresholds=ONSET_THRESHOLDS,population=None):
+    ''' First day every series reaches every threshold, one pass for all of them
+
+        Parameters:
+        ----------
+        Y: np.array (series x dates)
+            confirmed cases
+        thresholds: list of (kind, value)
+        population: np.array (series,)
+            NaN for unknown, percent thresholds are never reached without population
+
+        Returns:
+        ----------
+        onset: np.array (series x thresholds) int
+            position in the date axis, -1 if the threshold is not reached
+    '''
+    if population is None:
+        population=np.full(Y.shape[0],np.nan)
+    limits=np.column_stack([np.full(Y.shape[0],float(value)) if kind=='cases' else population*value/100
+                            for kind,value in thresholds])
+
+    reached=Y[:,None,:]>=limits[:,:,None] # NaN limits compare False
+    return np.where(reached.any(axis=2),reached.argmax(axis=2),-1)
+
+
+def build_onset_index(df_input,population=None,thresholds=ONSET_THRESHOLDS):
+    ''' Onset dates of all countries (states summed up) and states
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+            relational data set with date, state, country and confirmed
+        population: pd.Series (index country)
+            optional, needed for the percent thresholds
+
+        Returns:
+        ----------
+        df_onset: pd.DataFrame
+            index key ('country' or 'country|state'), one date column per threshold (NaT if not reached)
+    '''
+    series_keys,dates,Y=get_similarity_series(df_input)
+    country_population=None
+    if population is not None:
+        country_population=population.reindex([each.split('|')[0] for each in series_keys]).to_numpy(dtype=float)
+        country_population[['|' in each for each in series_keys]]=np.nan # no population of states
+
+    onset=compute_onset_index(Y,thresholds,country_population)
+    onset_dates=np.where(onset>=0,dates.to_numpy()[np.clip(onset,0,None)],np.datetime64('NaT'))
+    return pd.DataFrame(onset_dates,index=pd.Index(series_keys,name='key'),
+                        columns=[get_threshold_name(*each) for each in thresholds])
+
+
+def save_onset_index(df_input,output_path=None,population=None):
+    ''' Build the onset index of the final data set and store it next to it,
+        default population is world_population.csv if it exists
+
+        Returns:
+        ----------
+        df_onset: pd.DataFrame
+    '''
+    if population is None:
+        try:
+            population=load_population()
+        except FileNotFoundError:
+            pass
+    df_onset=build_onset_index(df_input,population)
+    write_csv(df_onset,output_path or get_path(ONSET_INDEX),sep=';',date_format='%Y-%m-%d')
+    return df_onset
+
+
+def get_onset_positions(df_onset,series_keys,dates,name):
+    ''' Onset of a threshold as positions in a date axis, -1 if unknown or not reached'''
+    onset=pd.DatetimeIndex(df_onset[name].reindex(series_keys))
+    return pd.DatetimeIndex(dates).get_indexer(onset)
+
+
+if __name__ == '__main__':
+    from src.data.data_access import load_final_set
+
+    df_onset=save_onset_index(load_final_set())
+    print(df_onset.head(10))
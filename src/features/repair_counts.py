@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from src.features.dense_layout import DenseLayout, fill_cumulative
+from src.data.data_access import get_path
+
+
+REPAIR_STRATEGIES = ['redistribute', 'carry_forward', 'backdate']
+
+
+def repair_carry_forward(Y):
+    ''' Keep the highest count reached so far, later decreases are ignored'''
+    return np.maximum.accumulate(Y, axis=1)
+
+
+def repair_backdate(Y):
+    ''' Trust the correction, earlier counts are lowered to the corrected level'''
+    return np.minimum.accumulate(Y[:, ::-1], axis=1)[:, ::-1]
+
+
+def repair_redistribute(Y, window=7):
+    ''' Spread every decrease over the daily increments of the preceding window days
+
+        The negative increment of day t is split evenly over the days t-window+1..t
+        (fewer at the start of a series), so the last count of every series is kept.
+        Decreases larger than the preceding increments are finally backdated.
+
+        Parameters:
+        ----------
+        Y: np.array (series x days)
+            cumulative counts
+        window: int
+
+        Returns:
+        ----------
+        Y_repaired: np.array (series x days)
+    '''
+    T = Y.shape[1]
+    increments = np.diff(Y, axis=1, prepend=0)
+    negative = np.minimum(increments, 0)
+
+    # share of the decrease of day t per receiving day, cumulated for a sliding window sum
+    share = negative/np.minimum(window, np.arange(1, T+1))
+    cumulated = np.cumsum(share, axis=1)
+    upper = cumulated[:, np.minimum(np.arange(T)+window-1, T-1)]
+    lower = np.concatenate([np.zeros((Y.shape[0], 1)), cumulated[:, :-1]], axis=1)
+    spread = upper-lower
+
+    repaired = np.cumsum(np.maximum(increments, 0)+spread, axis=1)
+    return np.round(repair_backdate(repaired))
+
+
+def repair_cumulative_counts(df_input, column='confirmed', strategy='redistribute', window=7,
+                             keys=('state','country'), time_column='date'):
+    ''' Repair decreases of cumulative counts for all series in one vectorized pass
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+            relational data set, the column is repaired in place
+        column: str
+        strategy: str
+            'redistribute', 'carry_forward' or 'backdate'
+        window: int
+            days a decrease is spread over (redistribute only)
+        keys: tuple of str
+        time_column: str
+            'date' or 'day' for the compact representation
+
+        Returns:
+        ----------
+        df_input: pd.DataFrame
+        df_log: pd.DataFrame
+            per series correction log (only series with at least one decrease)
+    '''
+    if strategy not in REPAIR_STRATEGIES:
+        raise ValueError('unknown repair strategy: '+str(strategy))
+
+    layout = DenseLayout(df_input, keys, time_column)
+    Y = fill_cumulative(layout.to_dense(df_input, column))
+
+    if strategy == 'redistribute':
+        Y_repaired = repair_redistribute(Y, window)
+    elif strategy == 'carry_forward':
+        Y_repaired = repair_carry_forward(Y)
+    else:
+        Y_repaired = repair_backdate(Y)
+
+    increments = np.diff(Y, axis=1)
+    decreases = increments < 0
+    changed = Y_repaired != Y
+
+    df_log = layout.index.copy()
+    df_log['strategy'] = strategy
+    df_log['n_decreases'] = decreases.sum(axis=1)
+    df_log['total_decrease'] = -np.where(decreases, increments, 0).sum(axis=1)
+    df_log['max_decrease'] = -np.where(decreases, increments, 0).min(axis=1)
+    df_log['n_changed_days'] = changed.sum(axis=1)
+    df_log['max_abs_change'] = np.abs(Y_repaired-Y).max(axis=1)
+    first_change = np.where(changed.any(axis=1), changed.argmax(axis=1), 0)
+    df_log['first_changed_'+time_column] = np.asarray(layout.times)[first_change]
+    df_log = df_log[df_log['n_decreases'] > 0].reset_index(drop=True)
+
+    layout.assign(df_input, column, Y_repaired, dtype=df_input[column].dtype)
+    return df_input, df_log
+
+
+if __name__ == '__main__':
+    pd_JH_data=pd.read_csv(get_path('data/processed/COVID_relational_confirmed.csv'),sep=';',parse_dates=[0])
+    for strategy in REPAIR_STRATEGIES:
+        pd_repaired, pd_log = repair_cumulative_counts(pd_JH_data.copy(), strategy=strategy)
+        print(strategy+': '+str(len(pd_log))+' series repaired, '+str(pd_log['n_changed_days'].sum())+' values changed')
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+from src.features.dense_layout import DenseLayout, fill_cumulative
+from src.data.data_access import get_path
+
+
+def get_serial_interval(mean=4.7, std=2.9, max_days=21):
+    ''' Discretized gamma distribution of the serial interval
+
+        Parameters:
+        ----------
+        mean, std: float
+            in days, default values from Nishiura et al. 2020
+        max_days: int
+            truncation of the distribution
+
+        Returns:
+        ----------
+        w: np.array (max_days+1,)
+            w[0]=0, w[s] probability of an interval of s days, sums up to 1
+    '''
+    from scipy import stats
+
+    shape = (mean/std)**2
+    scale = std**2/mean
+    cdf = stats.gamma.cdf(np.arange(max_days+1), shape, scale=scale)
+    w = np.diff(cdf, prepend=0)
+    w[0] = 0
+    return w/w.sum()
+
+
+def calc_dense_Rt(Y, serial_interval=None, window=7, prior_shape=1, prior_scale=5,
+                  credible_interval=0.95, min_pressure=10):
+    ''' Effective reproduction number for all series (Cori et al. 2013)
+
+        The infection pressure Lambda_t = sum_s w_s I_(t-s) is a convolution of the daily
+        incidence with the serial interval, sums over the sliding window are cumsum
+        differences. With a gamma prior the posterior of R over the window ending at t is
+        Gamma(prior_shape + sum I, 1/(1/prior_scale + sum Lambda)).
+
+        Parameters:
+        ----------
+        Y: np.array (series x days)
+            cumulative counts
+        serial_interval: np.array
+            see get_serial_interval
+        window: int
+            days R is assumed constant
+        prior_shape, prior_scale: float
+        credible_interval: float
+        min_pressure: float
+            windows with less infection pressure are NaN
+
+        Returns:
+        ----------
+        Rt_mean, Rt_lower, Rt_upper: np.array (series x days)
+    '''
+    from scipy import signal, stats
+
+    if serial_interval is None:
+        serial_interval = get_serial_interval()
+
+    T = Y.shape[1]
+    # the first count of a series starting mid-epidemic is not the incidence of one day
+    incidence = np.maximum(np.diff(Y, axis=1, prepend=Y[:, :1]), 0)
+    pressure = signal.fftconvolve(incidence, serial_interval[None, :], axes=1)[:, :T]
+    pressure = np.maximum(pressure, 0) # fft round off
+
+    def window_sum(values):
+        cumulated = np.cumsum(values, axis=1)
+        result = cumulated.copy()
+        result[:, window:] -= cumulated[:, :-window]
+        return result
+
+    shape = prior_shape+window_sum(incidence)
+    pressure_sum = window_sum(pressure)
+    scale = 1/(1/prior_scale+pressure_sum)
+
+    valid = pressure_sum >= min_pressure
+    valid[:, :window] = False
+    valid[Y[:, 0] > 0, :len(serial_interval)] = False # infection pressure of earlier cases unknown
+    tail = (1-credible_interval)/2
+
+    Rt_mean = np.where(valid, shape*scale, np.nan)
+    Rt_lower = np.where(valid, stats.gamma.ppf(tail, shape, scale=scale), np.nan)
+    Rt_upper = np.where(valid, stats.gamma.ppf(1-tail, shape, scale=scale), np.nan)
+    return Rt_mean, Rt_lower, Rt_upper
+
+
+def calc_Rt(df_input, filter_on='confirmed', keys=('state','country'), time_column='date',
+            dtype=None, **kwargs):
+    ''' Rt with credible interval as new columns of the relational data set (in place)
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+        filter_on: str
+            cumulative count column
+        keys: tuple of str
+        time_column: str
+        dtype: str
+            e.g. 'float32' for the compact representation
+        kwargs:
+            passed to calc_dense_Rt
+
+        Returns:
+        ----------
+        df_output: pd.DataFrame
+            with columns <filter_on>_Rt, <filter_on>_Rt_lower, <filter_on>_Rt_upper
+    '''
+    layout = DenseLayout(df_input, keys, time_column)
+    Y = fill_cumulative(layout.to_dense(df_input, filter_on))
+    Rt_mean, Rt_lower, Rt_upper = calc_dense_Rt(Y, **kwargs)
+
+    layout.assign(df_input, filter_on+'_Rt', Rt_mean, dtype=dtype)
+    layout.assign(df_input, filter_on+'_Rt_lower', Rt_lower, dtype=dtype)
+    layout.assign(df_input, filter_on+'_Rt_upper', Rt_upper, dtype=dtype)
+    return df_input
+
+
+def calc_country_Rt(df_input, filter_on='confirmed', keys=('state','country'), time_column='date',
+                    dtype=None, **kwargs):
+    ''' Rt of the whole country as new columns of the relational data set (in place)
+
+        The cumulative counts of all states of a country are summed up before the
+        estimation, every state row carries the value of its country. Averaging the Rt of
+        the states would weight a state with a handful of cases like the largest one.
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+        filter_on: str
+            cumulative count column
+        keys: tuple of str
+            series keys, one of them is 'country'
+        time_column: str
+        dtype: str
+        kwargs:
+            passed to calc_dense_Rt
+
+        Returns:
+        ----------
+        df_output: pd.DataFrame
+            with columns <filter_on>_country_Rt, <filter_on>_country_Rt_lower, <filter_on>_country_Rt_upper
+    '''
+    layout = DenseLayout(df_input, keys, time_column)
+    Y = fill_cumulative(layout.to_dense(df_input, filter_on))
+    country_codes, countries = pd.factorize(layout.index['country'])
+    Y_country = np.zeros((len(countries), Y.shape[1]))
+    np.add.at(Y_country, country_codes, Y)
+
+    for column, values in zip(['_country_Rt', '_country_Rt_lower', '_country_Rt_upper'],
+                              calc_dense_Rt(Y_country, **kwargs)):
+        # country rows to series rows, then gathered into the relational rows
+        layout.assign(df_input, filter_on+column, values[country_codes], dtype=dtype)
+    return df_input
+
+
+if __name__ == '__main__':
+    pd_JH_data=pd.read_csv(get_path('data/processed/COVID_relational_confirmed.csv'),sep=';',parse_dates=[0])
+    pd_JH_data=calc_Rt(pd_JH_data)
+    print(pd_JH_data[pd_JH_data['country']=='Germany'].tail())
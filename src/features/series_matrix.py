@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+
+def get_series_matrix(df_input,keys=('country',),column='confirmed'):
+    ''' Stack all series of the relational data set into one dense array
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+            relational data set with date, state, country and the value column
+        keys: tuple of str
+            aggregation level of the series, values are summed within a key
+        column: str
+
+        Returns:
+        ----------
+        series_keys: list of str
+        dates: pd.DatetimeIndex
+        Y: np.array (series x dates)
+    '''
+    df_wide=df_input.groupby(list(keys)+['date'])[column].sum().unstack('date')
+    df_wide=df_wide.reindex(columns=pd.DatetimeIndex(sorted(df_wide.columns)))
+    df_wide=df_wide.ffill(axis=1).fillna(0)
+
+    series_keys=['|'.join(each[::-1]) if isinstance(each,tuple) else each for each in df_wide.index]
+    return series_keys,df_wide.columns,df_wide.to_numpy(dtype=np.float64)
+
+
+def get_similarity_keys(df_input):
+    ''' Keys of get_similarity_series in the same order, without building the series
+
+        Returns:
+        ----------
+        series_keys: list of str
+    '''
+    country_keys=sorted(df_input['country'].unique())
+    df_states=df_input.loc[df_input['state']!='no',['state','country']].drop_duplicates()
+    state_keys=[country+'|'+state for state,country in sorted(df_states.itertuples(index=False))]
+    return country_keys+state_keys
+
+
+def get_similarity_series(df_input):
+    ''' Confirmed cases of all countries (states summed up) and of all states
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+            relational data set with date, state, country and confirmed
+
+        Returns:
+        ----------
+        series_keys: list of str
+            'country' or 'country|state'
+        dates: pd.DatetimeIndex
+        Y: np.array (series x dates)
+    '''
+    df_input=df_input[['date','state','country','confirmed']]
+    df_input=df_input.assign(date=pd.to_datetime(df_input['date']))
+    country_keys,dates,Y_country=get_series_matrix(df_input)
+
+    df_states=df_input[df_input['state']!='no']
+    if df_states.empty:
+        return country_keys,dates,Y_country
+    state_keys,state_dates,Y_state=get_series_matrix(df_states,keys=('state','country'))
+    Y_state=pd.DataFrame(Y_state,columns=state_dates).reindex(columns=dates).ffill(axis=1).fillna(0).to_numpy()
+    return country_keys+state_keys,dates,np.vstack([Y_country,Y_state])
@@ -1,9 +1,15 @@
+import time
+
 import pandas as pd
 import numpy as np
 
 from scipy import optimize
 from scipy.integrate import odeint
 
+from src.data.data_access import get_path, get_data_version, load_population, FINAL_SET
+
+FIT_METHODS = ['curve_fit', 'sensitivity']
+
 class SIR_Model():
     '''This class is programmed for SIR model of epidemiology
        Args:
@@ -20,6 +26,7 @@ class SIR_Model():
         self.country = country
         self.population = population
         self.percentage = percentage
+        self.n_solves = 0 # ODE solves of the last fit
         
         self._get_SIR_initials()
         
@@ -91,32 +98,105 @@ class SIR_Model():
         ''' Helper function for the integration
         '''
         self._get_SIR_initials()
+        self.n_solves += 1
         return odeint(self.calculate_SIR, (self.S0, self.I0, self.R0), self.t, args=(beta, gamma))[:,1]
-    
-    def fitted_curve(self, printout=True):
+
+    def calculate_SIR_sensitivity(self, state, t, beta, gamma):
+        ''' SIR model extended by the forward sensitivities of S and I
+            with respect to beta (S_b, I_b) and gamma (S_g, I_g)
+
+            d/dt dX/dp = df/dX * dX/dp + df/dp, all sensitivities start at 0
+        '''
+        S, I, S_b, I_b, S_g, I_g = state
+        infection = beta*S*I/self.N0
+        d_infection_b = S*I/self.N0 + beta*(S_b*I+S*I_b)/self.N0
+        d_infection_g = beta*(S_g*I+S*I_g)/self.N0
+
+        return (-infection, infection-gamma*I,
+                -d_infection_b, d_infection_b-gamma*I_b,
+                -d_infection_g, d_infection_g-I-gamma*I_g)
+
+    def solve_sensitivity(self, beta, gamma):
+        ''' Infected curve and its derivatives with respect to beta and gamma in one solve
+
+            Returns:
+            ----------
+            I, dI_dbeta, dI_dgamma: np.array
+        '''
+        self.n_solves += 1
+        result = odeint(self.calculate_SIR_sensitivity, (self.S0, self.I0, 0, 0, 0, 0), self.t, args=(beta, gamma))
+        return result[:, 1], result[:, 3], result[:, 5]
+
+    def _fit_sensitivity(self, log_space=False, p0=(1, 1)):
+        ''' Least squares fit with the analytic Jacobian from the sensitivity equations
+        '''
+        cache = {}
+
+        def solve(params):
+            key = tuple(params)
+            if key not in cache: # residuals and Jacobian of a step share one solve
+                cache.clear()
+                cache[key] = self.solve_sensitivity(*params)
+            return cache[key]
+
+        def residuals(params):
+            I = solve(params)[0]
+            if log_space:
+                return np.log(np.maximum(I, 1e-9))-np.log(self.ydata)
+            return I-self.ydata
+
+        def jacobian(params):
+            I, dI_dbeta, dI_dgamma = solve(params)
+            J = np.column_stack([dI_dbeta, dI_dgamma])
+            if log_space:
+                J = J/np.maximum(I, 1e-9)[:, None]
+            return J
+
+        result = optimize.least_squares(residuals, p0, jac=jacobian, bounds=(0, np.inf), method='trf')
+        if not result.success:
+            raise RuntimeError('SIR fit did not converge: '+result.message)
+
+        # covariance like curve_fit, from the Jacobian at the optimum
+        dof = max(len(self.ydata)-2, 1)
+        self.pcov = np.linalg.pinv(result.jac.T @ result.jac)*np.sum(result.fun**2)/dof
+        return result.x
+
+    def fitted_curve(self, printout=True, method='curve_fit', log_space=False, p0=None):
         '''Fitting of curve by using optimize.curve_fit form scipy libaray.
+           Args:
+           ----
+           method: 'curve_fit' (finite difference Jacobian) or 'sensitivity'
+                   (least_squares with the Jacobian of the sensitivity equations)
+           log_space: fit log(I) instead of I (sensitivity only), all days weigh the same
+           p0: start values of beta and gamma, e.g. the fit of an overlapping period
         '''
-        self.popt, self.pcov = optimize.curve_fit(self.fit_odeint, self.t, self.ydata)
+        if method not in FIT_METHODS:
+            raise ValueError('unknown fit method: '+str(method))
+        self.n_solves = 0
+        if method == 'sensitivity':
+            self._get_SIR_initials()
+            self.popt = self._fit_sensitivity(log_space, p0=(1, 1) if p0 is None else p0)
+        else:
+            self.popt, self.pcov = optimize.curve_fit(self.fit_odeint, self.t, self.ydata, p0=p0)
         self.perr = np.sqrt(np.diag(self.pcov))
         if printout:
             print('standard deviation errors : ',str(self.perr), ' start infect:',self.ydata[0])
             print("Optimal parameters: beta =", self.popt[0], " and gamma = ", self.popt[1])
+            print('ODE solves : ', self.n_solves)
         
         self.fitted = self.fit_odeint(self.t, *self.popt)
         # get the final fitted curve
         return self.fitted
     
-def get_optimum_beta_gamma(df, country, susceptable_perc=5, period='default'):
-    
-    # get world population
-    # plausiblization for dashboard
-    try:
-        df_population = pd.read_csv('../data/processed/world_population.csv',sep=';', index_col=0)
-        population = df_population.T[country].values[0]
-    except:
-        df_population = pd.read_csv('data/processed/world_population.csv',sep=';', index_col=0)
-        population = df_population.T[country].values[0]
-    
+def get_periods(df, period='default'):
+    ''' Fit periods of get_optimum_beta_gamma
+
+        Returns:
+        ----------
+        periods: list of [start, end] rows of df
+        time_period, names: list of str
+            labels of the summary table
+    '''
     if period != 'default':
         # set periods
         periods = []
@@ -128,7 +208,7 @@ def get_optimum_beta_gamma(df, country, susceptable_perc=5, period='default'):
         periods.append([np.arange(70,len(df)-1,period)[-1],len(df)-1])
         
         names = ['Period '+ str(n) for n in range(len(periods))]
-        time_period = [str(df_confirmed.date[p[0]])[:10]+' to '+str(df_confirmed.date[p[1]])[:10] for p in periods]
+        time_period = [str(df.date[p[0]])[:10]+' to '+str(df.date[p[1]])[:10] for p in periods]
         
     else:
         # rather than using fixed periods, we will use following periods for better approximation
@@ -146,16 +226,34 @@ def get_optimum_beta_gamma(df, country, susceptable_perc=5, period='default'):
                  'Constant spread         ', 
                  'Second wave             ']
     
+    return periods, time_period, names
+
+
+def get_optimum_beta_gamma(df, country, susceptable_perc=5, period='default', method='curve_fit', log_space=False):
+    ''' SIR fits of all periods of one country
+
+        method and log_space are passed to SIR_Model.fitted_curve ('sensitivity' is the
+        faster opt-in), the number of ODE solves of all periods is in the attribute
+        n_solves of the summary.
+    '''
+    
+    # get world population (parsed once per file version)
+    population = load_population()[country]
+    
+    periods, time_period, names = get_periods(df, period)
+    
     # fit curve
     fit_line = np.array([])
     dyn_beta = []
     dyn_gamma = []
     dyn_R0 = []
     summary = []
+    n_solves = 0
     for n, element in enumerate(periods):
         try:
             OBJ_SIR = SIR_Model(df[element[0]:element[1]], country= country, population = population, percentage=susceptable_perc)
-            fit_line = np.concatenate([fit_line, OBJ_SIR.fitted_curve(printout=False)])
+            fit_line = np.concatenate([fit_line, OBJ_SIR.fitted_curve(printout=False, method=method, log_space=log_space)])
+            n_solves += OBJ_SIR.n_solves
             dyn_beta.append(OBJ_SIR.popt[0])
             dyn_gamma.append(OBJ_SIR.popt[1])
             dyn_R0.append(OBJ_SIR.popt[0]/OBJ_SIR.popt[1])
@@ -173,9 +271,91 @@ def get_optimum_beta_gamma(df, country, susceptable_perc=5, period='default'):
     
     # get strating point
     idx = SIR_Model(df, country= country, population = population).idx_I0
-    
+
+    summary = pd.DataFrame(summary)
+    summary.attrs['n_solves'] = n_solves
+    return fit_line, idx, summary
+
+def get_SIR_table_name(susceptable_perc=5, period='default'):
+    '''Name of the model store table holding the fits of one dashboard setting'''
+    return 'SIR_'+str(susceptable_perc)+'_'+str(period)
+
+
+def publish_SIR_fits(df, countries=None, susceptable_perc=5, period='default', store_dir=None, data_version=None):
+    '''Fit all countries and publish parameters and fitted curves to the model store.
+       Args:
+       -------
+       df: pd.DataFrame of confirmed cases per country (wide format)
+       countries: list of countries, default all columns of df
+       store_dir: directory of the ModelStore, default models/store
+       data_version: version of the data set df was read from (data_access.get_data_version),
+                     default the current COVID_final_set.csv; the dashboard ignores
+                     tables of other versions
+
+       Returns:
+       -------
+       version: published store version
+    '''
+    from src.models.model_store import ModelStore, STORE_DIR
+
+    if countries is None:
+        countries = list(df.columns[1:])
+
+    keys, params, curves, offsets = [], [], [], []
+    for each in countries:
+        try:
+            fit_line, idx, summary = get_optimum_beta_gamma(df, each, susceptable_perc=susceptable_perc, period=period,
+                                                            method='sensitivity')
+        except (IndexError, KeyError):
+            continue # country never reaches the initial infected threshold or has no population
+        keys.append(each)
+        params.append(summary[['Beta', 'Gamma', 'R0']].to_numpy(dtype=float).ravel())
+        curves.append(fit_line)
+        offsets.append(idx)
+
+    if not keys:
+        raise ValueError('no country could be fitted, nothing to publish')
+    if data_version is None:
+        data_version = get_data_version(get_path(FINAL_SET))
+
+    param_names = [name+'_'+str(n) for n in range(len(summary)) for name in ['Beta', 'Gamma', 'R0']]
+    meta = {'susceptable_perc': susceptable_perc, 'period': str(period),
+            'time_period': list(summary['Time period']), 'actions': list(summary['Actions']),
+            'first_date': str(df.date.iloc[0])[:10], 'data_version': data_version}
+
+    return ModelStore(store_dir or STORE_DIR).publish(get_SIR_table_name(susceptable_perc, period), keys, params,
+                                         param_names, curves=curves, offsets=offsets, meta=meta)
+
+
+def get_stored_beta_gamma(table, country):
+    '''Same result as get_optimum_beta_gamma, read from a published model store table'''
+    fit_line, idx = table.get_curve(country)
+    params = table.get_params(country)
+    summary = [{'Time period': time_period,
+                'Actions': action,
+                'Beta': params['Beta_'+str(n)],
+                'Gamma': params['Gamma_'+str(n)],
+                'R0': params['R0_'+str(n)]}
+               for n, (time_period, action) in enumerate(zip(table.meta['time_period'], table.meta['actions']))]
     return fit_line, idx, pd.DataFrame(summary)
 
 if __name__ == '__main__':
+    from src.data.get_world_population import get_large_dataset
+
+    df_confirmed = get_large_dataset()
     fit_line, idx, summary  = get_optimum_beta_gamma(df_confirmed, country='Germany', susceptable_perc=5)
-    print(summary)
\ No newline at end of file
+    print(summary)
+
+    # cost of the fit methods: ODE solves and wall time for all countries
+    for method, log_space in [('curve_fit', False), ('sensitivity', False), ('sensitivity', True)]:
+        start, n_solves, n_fits = time.perf_counter(), 0, 0
+        for each in df_confirmed.columns[1:]:
+            try:
+                fit_line, idx, summary = get_optimum_beta_gamma(df_confirmed, each, method=method, log_space=log_space)
+            except (IndexError, KeyError):
+                continue
+            n_solves += summary.attrs['n_solves']
+            n_fits += 1
+        print('{:12s} log_space={!s:5s} {:6.1f} solves per country, {:6.3f} s per country'.format(
+              method, log_space, n_solves/max(n_fits, 1), (time.perf_counter()-start)/max(n_fits, 1)))
+    print('published SIR fits as store version '+publish_SIR_fits(df_confirmed))
\ No newline at end of file
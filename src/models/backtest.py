@@ -0,0 +1,342 @@
+import os
+import time
+import itertools
+
+import click
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from src.data.data_access import get_path, load_final_set, load_population
+from src.features.series_matrix import get_series_matrix
+
+
+BACKTEST_DIR=get_path('reports/backtest')
+
+# default sweep, every combination is one configuration
+SG_WINDOWS=[1,5,7,9,11,15]     # 1 is the unfiltered series
+REG_WINDOWS=[3,5,7,10,14]
+SIR_PERIODS=[7,14,21,28]
+SIR_PERCENTAGES=[1,3,5]
+
+
+## Doubling rate model
+def causal_savgol(Y,window,polyorder=1):
+    ''' Savitzky-Golay filter which only uses past values
+
+        The filtered value of day t is the polynomial fitted to the window ending
+        at t evaluated at t (savgol_coeffs with pos=window-1), so the value at a
+        forecast origin does not depend on later days. One pass gives the filtered
+        series for every origin.
+
+        Parameters:
+        ----------
+        Y: np.array (series x dates)
+        window: int
+        polyorder: int
+
+        Returns:
+        ----------
+        F: np.array (series x dates), NaN for the first window-1 days
+    '''
+    if window<=1:
+        return Y.astype(float)
+    from scipy.signal import savgol_coeffs
+
+    coeffs=savgol_coeffs(window,polyorder,pos=window-1,use='dot')
+    F=np.full(Y.shape,np.nan)
+    F[:,window-1:]=np.lib.stride_tricks.sliding_window_view(Y,window,axis=1).dot(coeffs)
+    return F
+
+
+def rolling_level_slope(F,window):
+    ''' Linear regression over the window ending at every day
+
+        Returns:
+        ----------
+        level: np.array (series x dates)
+            fitted value at the last day of the window
+        slope: np.array (series x dates)
+            daily increase, both NaN for the first window-1 days
+    '''
+    x=np.arange(window)-(window-1.0)
+    x_centered=x-x.mean()
+    V=np.lib.stride_tricks.sliding_window_view(F,window,axis=1)
+
+    level=np.full(F.shape,np.nan)
+    slope=np.full(F.shape,np.nan)
+    slope[:,window-1:]=V.dot(x_centered)/(x_centered**2).sum()
+    level[:,window-1:]=V.mean(axis=2)-slope[:,window-1:]*x.mean()
+    return level,slope
+
+
+def forecast_doubling_rate(level,growth,horizon):
+    ''' Exponential extrapolation with the daily growth rate ln(2)/doubling time
+
+        Parameters:
+        ----------
+        level: np.array (series x dates)
+            fitted value at the origin
+        growth: np.array (series x dates)
+            daily growth rate, slope of the log counts (see get_level_growth),
+            a shrinking series is not extrapolated
+
+        Returns:
+        ----------
+        P: np.array (series x dates x horizon), P[s,t,h-1] forecast of day t+h made at t
+    '''
+    growth=np.where(growth>0,growth,0.0)
+    steps=np.arange(1,horizon+1)
+    return level[:,:,None]*np.exp(growth[:,:,None]*steps)
+
+
+def get_level_growth(F,window):
+    ''' Level and daily growth rate of the regression of log F over the window ending at every day
+
+        The slope of the log counts is the growth rate of the exponential, the slope of
+        the counts over their level (the doubling rate of the features) only
+        approximates it and is biased low the longer the window.
+
+        Returns:
+        ----------
+        level, growth: np.array (series x dates), NaN for the first window-1 days
+    '''
+    log_level,growth=rolling_level_slope(np.log(np.clip(F,1,None)),window)
+    return np.exp(log_level),growth
+
+
+def get_actuals(Y,horizon):
+    ''' A[s,t,h-1]=Y[s,t+h], NaN beyond the last date'''
+    A=np.full(Y.shape+(horizon,),np.nan)
+    for h in range(1,horizon+1):
+        A[:,:-h,h-1]=Y[:,h:]
+    return A
+
+
+def get_origins(Y,horizon,min_cases=100,step=1,first=0):
+    ''' Forecast origins: every step days with at least min_cases and horizon days of actuals
+
+        Returns:
+        ----------
+        mask: np.array of bool (series x dates)
+    '''
+    mask=np.zeros(Y.shape,dtype=bool)
+    mask[:,first:Y.shape[1]-horizon:step]=True
+    return mask&(Y>=min_cases)
+
+
+def error_table(P,A,mask,series_keys,model,config):
+    ''' Errors of all origins aggregated per series and horizon
+
+        Returns:
+        ----------
+        df_errors: pd.DataFrame
+            model, config, key, horizon, mape (mean absolute percentage error),
+            male (mean absolute log error), n_origins
+    '''
+    ape=np.abs(P-A)/np.maximum(A,1)
+    ale=np.abs(np.log1p(np.clip(P,0,None))-np.log1p(A))
+    valid=mask[:,:,None]&np.isfinite(ape)
+    n=valid.sum(axis=1) # series x horizon
+    with np.errstate(invalid='ignore'):
+        mape=np.where(valid,ape,0).sum(axis=1)/n
+        male=np.where(valid,ale,0).sum(axis=1)/n
+
+    horizon=P.shape[2]
+    return pd.DataFrame({'model':model,'config':config,
+                         'key':np.repeat(series_keys,horizon),
+                         'horizon':np.tile(np.arange(1,horizon+1),len(series_keys)),
+                         'mape':mape.ravel(),'male':male.ravel(),'n_origins':n.ravel()})
+
+
+def backtest_doubling_rate(Y,series_keys,sg_window,reg_windows=REG_WINDOWS,horizon=14,min_cases=100,step=1):
+    ''' Rolling origin evaluation of the doubling rate forecast for one filter window
+
+        The causal filter is computed once and shared by all regression windows,
+        every origin of every series is evaluated in one vectorized pass.
+
+        Returns:
+        ----------
+        df_errors: pd.DataFrame (see error_table)
+    '''
+    F=causal_savgol(Y,sg_window)
+    A=get_actuals(Y,horizon)
+    results=[]
+    for reg_window in reg_windows:
+        level,growth=get_level_growth(F,reg_window)
+        mask=get_origins(Y,horizon,min_cases,step,first=sg_window+reg_window-2)
+        results.append(error_table(forecast_doubling_rate(level,growth,horizon),A,mask,series_keys,
+                                   'doubling_rate','sg={},reg={}'.format(sg_window,reg_window)))
+    return pd.concat(results,ignore_index=True)
+
+
+## SIR model
+def backtest_SIR(Y,series_keys,population,period,percentage,horizon=14,min_cases=100,step=7):
+    ''' Rolling origin evaluation of the SIR forecast for one period length
+
+        At every origin beta and gamma are fitted to the last period days and the
+        model is integrated horizon days further. The fit of the previous origin
+        of the same series is the start value of the next one (overlapping data).
+
+        Parameters:
+        ----------
+        Y: np.array (series x dates)
+        population: np.array (series,)
+        period: int
+            days before the origin used for the fit
+        percentage: int
+            susceptible percentage of the population
+
+        Returns:
+        ----------
+        df_errors: pd.DataFrame (see error_table)
+    '''
+    from scipy.integrate import odeint
+    from src.models.SIR_model import SIR_Model
+
+    P=np.full(Y.shape+(horizon,),np.nan)
+    mask=get_origins(Y,horizon,min_cases,step,first=period-1)
+    for s,key in enumerate(series_keys):
+        p0=None
+        for t in np.nonzero(mask[s])[0]:
+            try:
+                model=SIR_Model(pd.DataFrame({key:Y[s,t-period+1:t+1]}),key,population[s],percentage)
+                model.fitted_curve(printout=False,method='sensitivity',p0=p0)
+            except (IndexError,RuntimeError,ValueError):
+                p0=None
+                continue # no day above the initial infected threshold or no convergence
+            p0=model.popt
+            t_forecast=np.arange(len(model.ydata)+horizon)
+            I=odeint(model.calculate_SIR,(model.S0,model.I0,model.R0),t_forecast,args=tuple(model.popt))[:,1]
+            P[s,t]=I[len(model.ydata):]
+    return error_table(P,get_actuals(Y,horizon),mask,series_keys,
+                       'SIR','period={},perc={}'.format(period,percentage))
+
+
+def _run_task(task):
+    ''' One configuration for a chunk of series (runs in a worker process)'''
+    name,args,kwargs=task
+    start=time.perf_counter()
+    if name=='doubling_rate':
+        df_errors=backtest_doubling_rate(*args,**kwargs)
+    else:
+        df_errors=backtest_SIR(*args,**kwargs)
+    return df_errors,time.perf_counter()-start
+
+
+def run_backtest(df_input,models=('doubling_rate','SIR'),sg_windows=SG_WINDOWS,reg_windows=REG_WINDOWS,
+                 periods=SIR_PERIODS,percentages=SIR_PERCENTAGES,horizon=14,min_cases=100,
+                 step=1,sir_step=7,countries=None,n_workers=None):
+    ''' Rolling origin backtest of all configurations over all countries
+
+        Configurations are spread over a process pool, the SIR configurations are
+        additionally split into chunks of countries.
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+            relational data set with date, state, country and confirmed
+        step, sir_step: int
+            days between two origins of the doubling rate and the SIR model
+        countries: list of str
+            default all countries
+        n_workers: int
+            process pool size, default os.cpu_count()
+
+        Returns:
+        ----------
+        df_errors: pd.DataFrame
+            model, config, key, horizon, mape, male, n_origins
+    '''
+    df_input=df_input[['date','state','country','confirmed']]
+    df_input=df_input.assign(date=pd.to_datetime(df_input['date']))
+    if countries is not None:
+        df_input=df_input[df_input['country'].isin(countries)]
+    series_keys,dates,Y=get_series_matrix(df_input)
+
+    tasks=[]
+    if 'doubling_rate' in models:
+        for sg_window in sg_windows:
+            tasks.append(('doubling_rate',(Y,series_keys,sg_window),
+                          dict(reg_windows=reg_windows,horizon=horizon,min_cases=min_cases,step=step)))
+    if 'SIR' in models:
+        population=load_population().reindex(series_keys).to_numpy(dtype=float)
+        known=np.nonzero(np.isfinite(population))[0]
+        n_chunks=max(1,min(len(known),(n_workers or os.cpu_count())))
+        for period,percentage in itertools.product(periods,percentages):
+            for rows in np.array_split(known,n_chunks):
+                tasks.append(('SIR',(Y[rows],[series_keys[each] for each in rows],population[rows],period,percentage),
+                              dict(horizon=horizon,min_cases=min_cases,step=sir_step)))
+
+    # the long SIR tasks first, the pool is not idle at the end
+    tasks.sort(key=lambda task: task[0]!='SIR')
+    results=[]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        for n,(task,(df_errors,duration)) in enumerate(zip(tasks,pool.map(_run_task,tasks))):
+            results.append(df_errors)
+            print('{:4d}/{} {} {} ({} series) {:.1f} s'.format(n+1,len(tasks),task[0],
+                  ', '.join(sorted(df_errors['config'].unique())),len(task[1][1]),duration))
+    return pd.concat(results,ignore_index=True)
+
+
+def summarize_errors(df_errors):
+    ''' Error of every configuration and horizon over all series
+
+        Returns:
+        ----------
+        df_summary: pd.DataFrame
+            model, config, horizon, mape (median over series), male (mean over series),
+            n_series, rank of the configuration per model and horizon (by male)
+    '''
+    df_valid=df_errors[df_errors['n_origins']>0]
+    df_summary=df_valid.groupby(['model','config','horizon']).agg(
+        mape=('mape','median'),male=('male','mean'),n_series=('key','nunique')).reset_index()
+    df_summary['rank']=df_summary.groupby(['model','horizon'])['male'].rank(method='min').astype(int)
+    return df_summary.sort_values(['model','horizon','rank']).reset_index(drop=True)
+
+
+def save_backtest(df_errors,output_dir=BACKTEST_DIR):
+    ''' Store the error tables by country and horizon and the summary per configuration
+
+        Returns:
+        ----------
+        df_summary: pd.DataFrame
+    '''
+    os.makedirs(output_dir,exist_ok=True)
+    df_errors.to_csv(os.path.join(output_dir,'errors_by_country.csv'),sep=';',index=False)
+    df_summary=summarize_errors(df_errors)
+    df_summary.to_csv(os.path.join(output_dir,'errors_by_horizon.csv'),sep=';',index=False)
+    return df_summary
+
+
+@click.command()
+@click.option('--model', 'models', multiple=True, type=click.Choice(['doubling_rate', 'SIR']),
+              default=['doubling_rate', 'SIR'])
+@click.option('--sg-window', 'sg_windows', multiple=True, type=int, default=SG_WINDOWS,
+              help='Savitzky-Golay windows, 1 is unfiltered')
+@click.option('--reg-window', 'reg_windows', multiple=True, type=int, default=REG_WINDOWS)
+@click.option('--period', 'periods', multiple=True, type=int, default=SIR_PERIODS, help='SIR fit period in days')
+@click.option('--percentage', 'percentages', multiple=True, type=int, default=SIR_PERCENTAGES)
+@click.option('--horizon', default=14, type=int)
+@click.option('--step', default=1, type=int, help='days between two doubling rate origins')
+@click.option('--sir-step', default=7, type=int, help='days between two SIR origins')
+@click.option('--country', 'countries', multiple=True, help='default all countries')
+@click.option('--n-workers', default=None, type=int)
+@click.option('--output-dir', default=BACKTEST_DIR)
+def main(models, sg_windows, reg_windows, periods, percentages, horizon, step, sir_step, countries, n_workers,
+         output_dir):
+    """ Rolling origin backtest of the doubling rate and SIR forecasts,
+        error tables are written to reports/backtest"""
+    start=time.time()
+    df_errors=run_backtest(load_final_set(),models=models,sg_windows=sg_windows,reg_windows=reg_windows,
+                           periods=periods,percentages=percentages,horizon=horizon,step=step,sir_step=sir_step,
+                           countries=list(countries) or None,n_workers=n_workers)
+    df_summary=save_backtest(df_errors,output_dir)
+
+    print(df_summary[df_summary['horizon'].isin([1,7,horizon])&(df_summary['rank']<=3)].to_string(index=False))
+    print('backtest time: {:.1f} s, results in {}'.format(time.time()-start,output_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import os
+import json
+import shutil
+import tempfile
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+from src.data.data_access import get_path
+
+
+STORE_DIR=get_path('models/store')
+
+
+class ModelTable():
+    '''Fitted results of one model for all series, backed by memory-mapped arrays.
+       Args:
+       -------
+       path: directory of the table inside a store version
+
+       Layout:
+       -------
+       keys.json:   series key -> row, parameter names
+       params.npy:  float64 (series x parameters)
+       curves.npy:  float64 (series x days), NaN padded fitted curves (optional)
+       offsets.npy: int64 (series,) index of the first fitted day (optional)
+       meta.json:   free meta data of the fit
+    '''
+
+    def __init__(self, path):
+
+        self.path = path
+        with open(os.path.join(path, 'keys.json')) as f:
+            index = json.load(f)
+        self.index = index['keys']
+        self.param_names = index['param_names']
+        self.param_pos = {name: pos for pos, name in enumerate(self.param_names)}
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+        self.params = np.load(os.path.join(path, 'params.npy'), mmap_mode='r')
+        self.curves = None
+        self.offsets = None
+        if os.path.exists(os.path.join(path, 'curves.npy')):
+            self.curves = np.load(os.path.join(path, 'curves.npy'), mmap_mode='r')
+            self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return list(self.index.keys())
+
+    def get_params(self, key):
+        ''' Parameter vector of one series as dict'''
+        row = self.params[self.index[key]]
+        return dict(zip(self.param_names, row.tolist()))
+
+    def get_curve(self, key):
+        ''' Fitted curve of one series without padding, plus its start index'''
+        row = self.index[key]
+        curve = np.asarray(self.curves[row])
+        return curve[~np.isnan(curve)], int(self.offsets[row])
+
+    def get_rows(self, keys):
+        ''' Parameter matrix of several series, same order as keys'''
+        return np.asarray(self.params[[self.index[each] for each in keys]])
+
+
+class ModelStore():
+    '''Versioned store of fitted model parameters under models/store.
+       Every publish writes a complete new version directory and then swaps the
+       CURRENT marker with os.replace, so readers always see a consistent version.
+       Publishers are serialized with a lock file, so concurrent publishes of
+       different tables build on each other instead of losing one.
+       Args:
+       -------
+       root: store directory
+    '''
+
+    def __init__(self, root=STORE_DIR):
+
+        self.root = root
+        self._tables = {}
+
+    def current_version(self):
+        ''' Name of the published version, None for an empty store'''
+        try:
+            with open(os.path.join(self.root, 'CURRENT')) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def table(self, name):
+        ''' Open a table of the current version (cached per version)
+
+            Returns:
+            ----------
+            table: ModelTable or None if the model was never published
+        '''
+        version = self.current_version()
+        if version is None:
+            return None
+        if (version, name) not in self._tables:
+            path = os.path.join(self.root, version, name)
+            if not os.path.exists(path):
+                return None
+            self._tables = {key: value for key, value in self._tables.items() if key[0] == version}
+            self._tables[(version, name)] = ModelTable(path)
+        return self._tables[(version, name)]
+
+    def publish(self, name, keys, params, param_names, curves=None, offsets=None, meta=None):
+        ''' Publish one table as a new store version, all other tables are carried over
+
+            Parameters:
+            ----------
+            name: str
+                table name e.g. 'SIR_5_default' or 'forecast_log_linear'
+            keys: list of str
+            params: np.array (series x parameters)
+            param_names: list of str
+            curves: list of np.array
+                fitted curves of different length, stored NaN padded
+            offsets: list of int
+                start index of every curve
+            meta: dict
+
+            Returns:
+            ----------
+            version: str
+        '''
+        params = np.asarray(params, dtype=np.float64).reshape(len(keys), len(param_names))
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+        with _publish_lock(os.path.join(self.root, '.lock')):
+            previous = self.current_version()
+            # left behind by a publisher that was killed, no other publisher holds the lock
+            for each in os.listdir(self.root):
+                if each.startswith('.staging-'):
+                    shutil.rmtree(os.path.join(self.root, each), ignore_errors=True)
+            staging = tempfile.mkdtemp(prefix='.staging-', dir=self.root)
+            try:
+                # carry over the other tables of the previous version (hard links, no copy)
+                if previous is not None:
+                    for each in os.listdir(os.path.join(self.root, previous)):
+                        if each != name:
+                            shutil.copytree(os.path.join(self.root, previous, each), os.path.join(staging, each),
+                                            copy_function=_link_or_copy)
+
+                path = os.path.join(staging, name)
+                os.makedirs(path)
+                with open(os.path.join(path, 'keys.json'), 'w') as f:
+                    json.dump({'keys': {key: pos for pos, key in enumerate(keys)},
+                               'param_names': list(param_names)}, f)
+                with open(os.path.join(path, 'meta.json'), 'w') as f:
+                    json.dump(dict(meta or {}, published_at=pd.Timestamp.now().isoformat()), f)
+                np.save(os.path.join(path, 'params.npy'), params)
+
+                if curves is not None:
+                    length = max([len(each) for each in curves] + [0])
+                    padded = np.full((len(keys), length), np.nan)
+                    for pos, each in enumerate(curves):
+                        padded[pos, :len(each)] = each
+                    np.save(os.path.join(path, 'curves.npy'), padded)
+                    np.save(os.path.join(path, 'offsets.npy'), np.asarray(offsets, dtype=np.int64))
+
+                version = 'v{:06d}'.format(int(previous[1:]) + 1 if previous else 1)
+                os.rename(staging, os.path.join(self.root, version))
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+
+            marker = os.path.join(self.root, 'CURRENT.tmp')
+            with open(marker, 'w') as f:
+                f.write(version)
+            os.replace(marker, os.path.join(self.root, 'CURRENT'))
+
+        return version
+
+    def prune(self, keep=3):
+        ''' Remove old versions, readers still holding an old memory map keep their data'''
+        versions = sorted(each for each in os.listdir(self.root) if each.startswith('v'))
+        current = self.current_version()
+        for each in versions[:-keep]:
+            if each != current:
+                shutil.rmtree(os.path.join(self.root, each))
+
+
+@contextlib.contextmanager
+def _publish_lock(path):
+    ''' Exclusive lock of the store directory, released when the lock file is closed'''
+    with open(path, 'a') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.models.model_store import ModelStore
+from src.models.train_model import MODEL_DIR
+
+# opened tables are cached by the store, parameters stay memory-mapped
+stores={}
+
+
+def load_model(name='log_linear',model_dir=MODEL_DIR):
+    ''' Memory-mapped table of a forecast model published by train_model.save_model
+
+        Returns:
+        ----------
+        table: ModelTable
+    '''
+    if model_dir not in stores:
+        stores[model_dir]=ModelStore(os.path.join(model_dir,'store'))
+    table=stores[model_dir].table('forecast_'+name)
+    if table is None:
+        raise FileNotFoundError('forecast model '+name+' is not published, run train_model first')
+    return table
+
+
+def forecast_log_linear(params,horizon):
+    ''' Log-linear growth, returns np.array (series x horizon)'''
+    h=np.arange(1,horizon+1)
+    return np.expm1(params[:,[0]]+params[:,[1]]*h)
+
+
+def forecast_holt_damped(params,horizon):
+    ''' Damped trend: level + (phi+...+phi^h)*trend, returns np.array (series x horizon)'''
+    phi=params[:,[2]]
+    h=np.arange(1,horizon+1)
+    damping=np.cumsum(phi**h,axis=1)
+    return np.expm1(params[:,[3]]+damping*params[:,[4]])
+
+
+def forecast_ar_logdiff(params,horizon):
+    ''' Recursive AR forecast of the log differences (clipped at 0 for cumulative counts)'''
+    order=(params.shape[1]-2)//2
+    coef=params[:,:order+1]
+    level=params[:,order+1].copy()
+    history=params[:,order+2:].copy() # most recent last
+
+    result=np.empty((params.shape[0],horizon))
+    for h in range(horizon):
+        lags=history[:,::-1] # lag 1 first
+        step=np.maximum(coef[:,0]+np.einsum('sp,sp->s',coef[:,1:],lags),0)
+        level+=step
+        result[:,h]=level
+        history=np.column_stack([history[:,1:],step])
+    return np.expm1(result)
+
+
+FORECASTS={'log_linear':forecast_log_linear,
+           'holt_damped':forecast_holt_damped,
+           'ar_logdiff':forecast_ar_logdiff}
+
+
+def predict_all(horizon=14,name='log_linear',model_dir=MODEL_DIR,countries=None):
+    ''' N-day forecast for all stored series in one call
+
+        Parameters:
+        ----------
+        horizon: int
+            number of forecasted days after the last observed date
+        name: str
+            one of train_model.FORECAST_MODELS
+        model_dir: str
+        countries: list of str
+            optional subset
+
+        Returns:
+        ----------
+        df_forecast: pd.DataFrame
+            date column plus one column per country (same layout as df_confirmed)
+    '''
+    table=load_model(name,model_dir)
+    if countries is None:
+        series_keys,params=table.keys(),np.asarray(table.params)
+    else:
+        series_keys,params=countries,table.get_rows(countries)
+
+    forecast=FORECASTS[name](params,horizon)
+
+    df_forecast=pd.DataFrame(forecast.T,columns=series_keys)
+    df_forecast.insert(0,'date',pd.date_range(pd.Timestamp(table.meta['last_date'])+pd.Timedelta(days=1),periods=horizon))
+    return df_forecast
+
+
+def predict_series(country,horizon=14,name='log_linear',model_dir=MODEL_DIR):
+    ''' Forecast of a single series, one row lookup in the memory-mapped table
+
+        Returns:
+        ----------
+        forecast: np.array (horizon,)
+    '''
+    table=load_model(name,model_dir)
+    return FORECASTS[name](table.get_rows([country]),horizon)[0]
+
+
+if __name__ == '__main__':
+    start=time.time()
+    horizon=int(sys.argv[1]) if len(sys.argv)>1 else 14
+    for name in FORECASTS:
+        df_forecast=predict_all(horizon,name)
+        df_forecast.to_csv(os.path.join(MODEL_DIR,'forecast_'+name+'.csv'),sep=';',index=False)
+        print(name+': '+str(df_forecast.shape[1]-1)+' series, '+str(horizon)+' days')
+    print('prediction time: {:.2f} s'.format(time.time()-start))
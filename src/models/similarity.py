@@ -0,0 +1,311 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from src.features.series_matrix import get_similarity_series
+
+
+ONSET='cases_100' # column of the onset index, windows start at or after this day
+
+
+def normalize_windows(W):
+    ''' z-normalized log10(1+y) of every row, flat rows become zero'''
+    Z=np.log10(1+np.clip(W,0,None))
+    std=Z.std(axis=1,keepdims=True)
+    return np.where(std>1e-3,(Z-Z.mean(axis=1,keepdims=True))/np.where(std>1e-3,std,1),0.0)
+
+
+def get_envelopes(W,radius):
+    ''' Upper and lower envelope of every row for LB_Keogh (running max/min over 2*radius+1 points)'''
+    from scipy.ndimage import maximum_filter1d, minimum_filter1d
+
+    return (maximum_filter1d(W,size=2*radius+1,axis=1,mode='nearest'),
+            minimum_filter1d(W,size=2*radius+1,axis=1,mode='nearest'))
+
+
+def lb_keogh(q,upper,lower):
+    ''' LB_Keogh lower bound of the squared DTW distance between q and all indexed windows
+
+        Parameters:
+        ----------
+        q: np.array (n,)
+        upper, lower: np.array (windows x n)
+            envelopes of the candidates with the band radius of the DTW
+
+        Returns:
+        ----------
+        bound: np.array (windows,)
+    '''
+    above=np.clip(q-upper,0,None)
+    below=np.clip(lower-q,0,None)
+    return (above**2+below**2).sum(axis=1)
+
+
+def dtw_batch(q,C,radius):
+    ''' Squared DTW distance of q to every row of C within a Sakoe-Chiba band
+
+        One loop over the cells of the band, every step is vectorized over the candidates.
+
+        Parameters:
+        ----------
+        q: np.array (n,)
+        C: np.array (candidates x n)
+        radius: int
+
+        Returns:
+        ----------
+        distance: np.array (candidates,)
+    '''
+    n=len(q)
+    D=np.full((C.shape[0],n+1,n+1),np.inf)
+    D[:,0,0]=0
+    for i in range(1,n+1):
+        lo,hi=max(1,i-radius),min(n,i+radius)
+        cost=(q[i-1]-C[:,lo-1:hi])**2
+        for j in range(lo,hi+1):
+            D[:,i,j]=cost[:,j-lo]+np.minimum(np.minimum(D[:,i-1,j-1],D[:,i-1,j]),D[:,i,j-1])
+    return D[:,n,n]
+
+
+def _pairwise_rows(W,rows,radius):
+    ''' Rows of the DTW distance matrix, upper triangle only (runs in a worker process)'''
+    return [dtw_batch(W[i],W[i+1:],radius) for i in rows]
+
+
+def pairwise_dtw(W,radius,n_workers=None):
+    ''' All pairs DTW distances of the rows of W, e.g. for clustering
+
+        Parameters:
+        ----------
+        W: np.array (series x n)
+            normalized windows
+        radius: int
+        n_workers: int
+            process pool size, default os.cpu_count(), 1 computes in this process
+
+        Returns:
+        ----------
+        distances: np.array (series x series), symmetric, not squared
+    '''
+    n_series=W.shape[0]
+    # row i has n_series-1-i pairs, interleaved chunks balance the work
+    n_chunks=max(1,min(n_series,4*(n_workers or os.cpu_count())))
+    chunks=[np.arange(pos,n_series,n_chunks) for pos in range(n_chunks)]
+    if n_workers==1:
+        results=[_pairwise_rows(W,rows,radius) for rows in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results=list(pool.map(_pairwise_rows,[W]*len(chunks),chunks,[radius]*len(chunks)))
+
+    distances=np.zeros((n_series,n_series))
+    for rows,values in zip(chunks,results):
+        for i,each in zip(rows,values):
+            distances[i,i+1:]=each
+    distances=np.sqrt(distances+distances.T)
+    return distances
+
+
+def cluster_series(distances,n_clusters=5):
+    ''' Average linkage clustering of a DTW distance matrix
+
+        Returns:
+        ----------
+        labels: np.array (series,) 1..n_clusters
+    '''
+    from scipy.cluster.hierarchy import linkage, fcluster
+    from scipy.spatial.distance import squareform
+
+    return fcluster(linkage(squareform(distances,checks=False),method='average'),n_clusters,criterion='maxclust')
+
+
+class SimilarityIndex():
+    '''Envelope index of the onset aligned windows of all series for DTW top-k queries.
+       Windows of every series start at the onset and every stride days after it,
+       the window ending at the last date is always indexed.
+       Args:
+       -------
+       series_keys, dates, Y: series as returned by get_similarity_series
+       onset: position of the onset in dates per series (-1 if not reached),
+              see features/onset_index.py
+       window: days per window
+       stride: days between two indexed windows
+       radius: Sakoe-Chiba band of the DTW in days
+    '''
+
+    def __init__(self, series_keys, dates, Y, onset, window=28, stride=7, radius=3):
+
+        self.series_keys = list(series_keys)
+        self.key_pos = {key: pos for pos, key in enumerate(self.series_keys)}
+        self.dates = pd.DatetimeIndex(dates)
+        self.Y = Y
+        self.window = window
+        self.radius = radius
+
+        n_dates = Y.shape[1]
+        self.onset = np.asarray(onset)
+
+        owner, start = [], []
+        for pos, onset in enumerate(self.onset):
+            if onset < 0 or onset > n_dates-window:
+                continue # never reached the threshold or not a full window since
+            starts = list(range(onset, n_dates-window+1, stride))
+            if starts[-1] != n_dates-window:
+                starts.append(n_dates-window)
+            owner += [pos]*len(starts)
+            start += starts
+        self.owner = np.array(owner, dtype=int)
+        self.start = np.array(start, dtype=int)
+
+        self.windows = normalize_windows(Y[self.owner[:, None], self.start[:, None]+np.arange(window)])
+        self.upper, self.lower = get_envelopes(self.windows, radius)
+
+    def get_query(self, key, lag=0):
+        ''' Normalized window of a series ending lag days before the last date'''
+        end = len(self.dates)-lag
+        if end-self.window < 0:
+            raise ValueError('lag {} leaves less than {} days'.format(lag, self.window))
+        return normalize_windows(self.Y[self.key_pos[key], end-self.window:end][None, :])[0]
+
+    def query(self, key, lag=0, k=5, current_only=False, batch_size=32):
+        ''' Most similar series to the window of key ending lag days ago
+
+            Candidates are visited in the order of their LB_Keogh bound, exact DTW
+            distances are computed batch by batch until the bound of the next
+            candidate exceeds the k-th best distance.
+
+            Parameters:
+            ----------
+            key: str
+                series key e.g. 'Germany' or 'Canada|Ontario'
+            lag: int
+                days before the last date, 28 compares with four weeks ago
+            k: int
+                number of returned series, one window per series
+            current_only: bool
+                only windows ending at the last date (where are others now)
+            batch_size: int
+
+            Returns:
+            ----------
+            result: pd.DataFrame
+                key, start, end, days_since_onset, distance and the row of the
+                window in self.windows, sorted by distance; attribute n_dtw is
+                the number of exact DTW computations
+        '''
+        q = self.get_query(key, lag)
+        candidates = np.nonzero(self.owner != self.key_pos[key])[0]
+        if current_only:
+            candidates = candidates[self.start[candidates] == len(self.dates)-self.window]
+
+        bound = lb_keogh(q, self.upper[candidates], self.lower[candidates])
+        order = np.argsort(bound, kind='stable')
+        candidates, bound = candidates[order], bound[order]
+
+        best = {} # series -> (distance, window row)
+        n_dtw = 0
+        for pos in range(0, len(candidates), batch_size):
+            if len(best) >= k and bound[pos] >= sorted(each[0] for each in best.values())[k-1]:
+                break
+            rows = candidates[pos:pos+batch_size]
+            distances = dtw_batch(q, self.windows[rows], self.radius)
+            n_dtw += len(rows)
+            for row, distance in zip(rows, distances):
+                series = self.owner[row]
+                if series not in best or distance < best[series][0]:
+                    best[series] = (distance, row)
+
+        top = sorted(best.items(), key=lambda item: item[1][0])[:k]
+        result = pd.DataFrame({
+            'key': [self.series_keys[series] for series, _ in top],
+            'start': [self.dates[self.start[row]] for _, (_, row) in top],
+            'end': [self.dates[self.start[row]+self.window-1] for _, (_, row) in top],
+            'days_since_onset': [int(self.start[row]-self.onset[series]) for series, (_, row) in top],
+            'distance': [float(np.sqrt(distance)) for _, (distance, _) in top],
+            'row': [int(row) for _, (_, row) in top]})
+        result.attrs['n_dtw'] = n_dtw
+        return result
+
+    def pairwise(self, keys=None, aligned='onset', n_workers=None):
+        ''' All pairs DTW distances of one window per series
+
+            Parameters:
+            ----------
+            keys: list of str
+                default all indexed series
+            aligned: str
+                'onset' compares the first window after the onset, 'current' the last window
+
+            Returns:
+            ----------
+            keys: list of str
+            distances: np.array (series x series)
+        '''
+        if keys is None:
+            keys = [self.series_keys[each] for each in np.unique(self.owner)]
+        owners = np.array([self.key_pos[each] for each in keys])
+        if aligned == 'onset':
+            rows = [np.nonzero(self.owner == each)[0][0] for each in owners]
+        else:
+            rows = [np.nonzero(self.owner == each)[0][-1] for each in owners]
+        return keys, pairwise_dtw(self.windows[rows], self.radius, n_workers=n_workers)
+
+
+def build_similarity_index(df_input,df_onset=None,onset=ONSET,**kwargs):
+    ''' SimilarityIndex of all countries and states of the relational data set
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+        df_onset: pd.DataFrame
+            stored onset index (data_access.load_onset_index), computed if not given
+        onset: str
+            threshold column of the onset index
+    '''
+    from src.features.onset_index import compute_onset_index, get_onset_positions
+
+    series_keys,dates,Y=get_similarity_series(df_input)
+    if df_onset is not None and onset in df_onset.columns:
+        positions=get_onset_positions(df_onset,series_keys,dates,onset)
+    else:
+        kind,value=onset.split('_',1)
+        positions=compute_onset_index(Y,[(kind,float(value))])[:,0]
+    return SimilarityIndex(series_keys,dates,Y,positions,**kwargs)
+
+
+def find_similar(df_input,key,lag=28,k=5,window=28,current_only=True,df_onset=None):
+    ''' Which series look like key did lag days ago
+
+        Returns:
+        ----------
+        result: pd.DataFrame (see SimilarityIndex.query)
+    '''
+    return build_similarity_index(df_input,df_onset,window=window).query(key,lag=lag,k=k,current_only=current_only)
+
+
+if __name__ == '__main__':
+    from src.data.data_access import load_final_set, load_onset_index
+
+    try:
+        df_onset=load_onset_index()
+    except FileNotFoundError:
+        df_onset=None
+    start=time.perf_counter()
+    index=build_similarity_index(load_final_set(),df_onset)
+    print('indexed {} windows of {} series in {:.3f} s'.format(len(index.windows),len(index.series_keys),
+                                                              time.perf_counter()-start))
+
+    start=time.perf_counter()
+    result=index.query('Germany',lag=28,k=5,current_only=True)
+    print('now similar to Germany four weeks ago ({:.1f} ms, {} of {} windows compared with DTW):'.format(
+          (time.perf_counter()-start)*1000,result.attrs['n_dtw'],len(index.windows)))
+    print(result.drop(columns='row'))
+
+    start=time.perf_counter()
+    keys,distances=index.pairwise()
+    labels=cluster_series(distances)
+    print('all pairs of {} series in {:.2f} s, cluster sizes {}'.format(len(keys),time.perf_counter()-start,
+                                                                     np.bincount(labels)[1:].tolist()))
@@ -0,0 +1,215 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from src.data.data_access import get_path, load_final_set
+from src.models.model_store import ModelStore
+from src.features.series_matrix import get_series_matrix
+
+
+MODEL_DIR=get_path('models')
+FORECAST_MODELS=['log_linear','holt_damped','ar_logdiff']
+
+
+def get_param_names(name,order=3):
+    ''' Column names of the parameter matrix of a forecast model'''
+    if name=='log_linear':
+        return ['intercept','slope']
+    if name=='holt_damped':
+        return ['alpha','beta','phi','level','trend']
+    if name=='ar_logdiff':
+        return (['const']+['ar_'+str(k+1) for k in range(order)]+['log_level']
+                +['diff_'+str(order-k) for k in range(order)])
+    raise ValueError('unknown forecast model: '+str(name))
+
+
+## Vectorized models, all series are fitted at once
+def fit_log_linear(Y,window=14):
+    ''' Exponential growth, linear regression of log(1+y) on the last days
+
+        Parameters:
+        ----------
+        Y: np.array (series x dates)
+        window: int
+            used data points at the end of every series
+
+        Returns:
+        ----------
+        params: np.array (series x 2)
+            intercept at the last observed day and daily slope of log(1+y)
+    '''
+    Z=np.log1p(np.clip(Y[:,-window:],0,None))
+    t=np.arange(window)-(window-1) # last day is t=0
+    t_centered=t-t.mean()
+    z_mean=Z.mean(axis=1)
+
+    slope=(Z-z_mean[:,None]).dot(t_centered)/(t_centered**2).sum()
+    intercept=z_mean-slope*t.mean()
+    return np.column_stack([intercept,slope])
+
+
+def holt_damped_filter(Z,alpha,beta,phi):
+    ''' Holt's damped trend smoothing, one loop over time for all series
+
+        Parameters:
+        ----------
+        Z: np.array (series x dates)
+        alpha, beta, phi: float or np.array (series,)
+            level, trend smoothing and damping
+
+        Returns:
+        ----------
+        level, trend, sse: np.array (series,)
+    '''
+    level=Z[:,0].copy()
+    trend=Z[:,1]-Z[:,0]
+    sse=np.zeros(Z.shape[0])
+    for t in range(1,Z.shape[1]):
+        prediction=level+phi*trend
+        sse+=(Z[:,t]-prediction)**2
+        new_level=alpha*Z[:,t]+(1-alpha)*prediction
+        trend=beta*(new_level-level)+(1-beta)*phi*trend
+        level=new_level
+    return level,trend,sse
+
+
+def _optimize_holt_chunk(Z):
+    ''' Optimize alpha, beta, phi for a chunk of series (runs in a worker process)'''
+    from scipy import optimize
+
+    params=[]
+    for z in Z:
+        result=optimize.minimize(lambda p: holt_damped_filter(z[None,:],*p)[2][0],
+                                 x0=[0.5,0.1,0.95],
+                                 bounds=[(0.01,1),(0.01,1),(0.8,0.999)],
+                                 method='L-BFGS-B')
+        params.append(result.x)
+    return np.array(params).reshape(-1,3)
+
+
+def fit_holt_damped(Y,window=60,alpha=0.5,beta=0.1,phi=0.95,optimize=False,n_workers=None):
+    ''' Holt damped trend on log(1+y)
+
+        With fixed smoothing parameters all series are filtered in one vectorized pass,
+        optimize=True fits alpha, beta, phi per series in a process pool.
+
+        Parameters:
+        ----------
+        Y: np.array (series x dates)
+        window: int
+        alpha, beta, phi: float
+        optimize: bool
+        n_workers: int
+            process pool size, default os.cpu_count()
+
+        Returns:
+        ----------
+        params: np.array (series x 5)
+            alpha, beta, phi, last level and last trend
+    '''
+    Z=np.log1p(np.clip(Y[:,-window:],0,None))
+    if optimize:
+        chunks=np.array_split(Z,max(1,min(len(Z),4*(n_workers or os.cpu_count()))))
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            smoothing=np.vstack(list(pool.map(_optimize_holt_chunk,chunks)))
+    else:
+        smoothing=np.tile([alpha,beta,phi],(Z.shape[0],1))
+
+    level,trend,sse=holt_damped_filter(Z,smoothing[:,0],smoothing[:,1],smoothing[:,2])
+    return np.column_stack([smoothing,level,trend])
+
+
+def fit_ar_logdiff(Y,order=3,window=60,ridge=1e-6):
+    ''' AR(order) on the daily log differences, least squares for all series at once
+
+        Parameters:
+        ----------
+        Y: np.array (series x dates)
+        order: int
+        window: int
+            used log differences at the end of every series
+        ridge: float
+            regularization of the normal equations (flat series)
+
+        Returns:
+        ----------
+        params: np.array (series x (2*order+2))
+            intercept, order coefficients (lag 1 first), last log level,
+            last order log differences (most recent last)
+    '''
+    Z=np.log1p(np.clip(Y,0,None))
+    D=np.diff(Z,axis=1)[:,-window:]
+    n=D.shape[1]-order
+
+    lags=[D[:,order-1-k:order-1-k+n] for k in range(order)]
+    X=np.stack([np.ones_like(lags[0])]+lags,axis=2)
+    y=D[:,order:]
+
+    XtX=np.einsum('snp,snq->spq',X,X)+ridge*np.eye(order+1)
+    Xty=np.einsum('snp,sn->sp',X,y)
+    coef=np.linalg.solve(XtX,Xty[...,None])[...,0]
+
+    return np.column_stack([coef,Z[:,-1],D[:,-order:]])
+
+
+def save_model(name,series_keys,last_date,params,model_dir=MODEL_DIR,**meta):
+    ''' Publish fitted parameters of all series as table forecast_<name> of the model store
+
+        Returns:
+        ----------
+        version: str
+            published store version
+    '''
+    meta.update({'model':name,'last_date':str(pd.Timestamp(last_date).date()),
+                 'n_series':len(series_keys)})
+
+    store=ModelStore(os.path.join(model_dir,'store'))
+    return store.publish('forecast_'+name,series_keys,params,get_param_names(name),meta=meta)
+
+
+def train_all(df_input,models=FORECAST_MODELS,model_dir=MODEL_DIR,optimize_holt=False,n_workers=None):
+    ''' Fit every forecast model for every country and persist the parameters
+
+        Parameters:
+        ----------
+        df_input: pd.DataFrame
+            relational data set (COVID_final_set.csv)
+        models: list of str
+        model_dir: str
+        optimize_holt: bool
+            fit the Holt smoothing parameters per series in a process pool
+        n_workers: int
+
+        Returns:
+        ----------
+        versions: dict model -> published store version
+    '''
+    series_keys,dates,Y=get_series_matrix(df_input)
+
+    versions={}
+    for name in models:
+        if name=='log_linear':
+            params=fit_log_linear(Y)
+        elif name=='holt_damped':
+            params=fit_holt_damped(Y,optimize=optimize_holt,n_workers=n_workers)
+        elif name=='ar_logdiff':
+            params=fit_ar_logdiff(Y)
+        else:
+            raise ValueError('unknown forecast model: '+str(name))
+        versions[name]=save_model(name,series_keys,dates[-1],params,model_dir)
+
+    return versions
+
+
+if __name__ == '__main__':
+    start=time.time()
+    df_input=load_final_set(parse_dates=True)
+    versions=train_all(df_input,optimize_holt='--optimize' in sys.argv)
+    for name,version in versions.items():
+        print('published '+name+' as store version '+version)
+    print('training time: {:.2f} s'.format(time.time()-start))
@@ -0,0 +1,85 @@
+import re
+import subprocess
+import sys
+
+import click
+
+
+# cumulative import time budget per module in milliseconds (min over the repeats)
+IMPORT_BUDGET_MS = {
+    'src.data.get_data': 600,
+    'src.data.get_world_population': 600,
+    'src.data.process_JH_data': 600,
+    'src.features.build_features': 650,
+    'src.visualization.visualize': 650,
+    'src.visualization.SIR_visualize': 650,
+}
+
+# heavy packages which must not be loaded by a plain module import
+LAZY_PACKAGES = ['sklearn', 'bs4', 'requests', 'dash', 'plotly', 'scipy']
+
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\s*)(\S+)')
+
+
+def measure_import(module):
+    ''' Import a module in a fresh interpreter with python -X importtime
+
+        Parameters:
+        ----------
+        module : str
+
+        Returns:
+        ----------
+        cumulative_ms: float
+            cumulative import time of the module
+        loaded: set
+            top level packages loaded by the import
+    '''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError('import of {} failed:\n{}'.format(module, proc.stderr[-2000:]))
+
+    cumulative_ms = 0
+    loaded = set()
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        name = match.group(4)
+        loaded.add(name.split('.')[0])
+        if name == module:
+            cumulative_ms = int(match.group(2))/1000
+
+    return cumulative_ms, loaded
+
+
+@click.command()
+@click.option('--repeat', default=3, type=int, help='number of fresh interpreters per module')
+def main(repeat):
+    """ Checks the import time of all src modules against IMPORT_BUDGET_MS,
+        exits with 1 if a budget is exceeded or a heavy package is imported eagerly.
+    """
+    failed = []
+    for module, budget in IMPORT_BUDGET_MS.items():
+        results = [measure_import(module) for n in range(repeat)]
+        cumulative_ms = min(each[0] for each in results)
+        eager = sorted(set(LAZY_PACKAGES) & results[0][1])
+
+        status = 'ok'
+        if cumulative_ms > budget:
+            status = 'OVER BUDGET'
+            failed.append(module)
+        if eager:
+            status = 'EAGER IMPORT of ' + ', '.join(eager)
+            failed.append(module)
+        print('{:40s} {:8.1f} ms  (budget {:5d} ms)  {}'.format(module, cumulative_ms, budget, status))
+
+    if failed:
+        print('import time check failed for: ' + ', '.join(failed))
+        sys.exit(1)
+    print('import time check passed')
+
+
+if __name__ == '__main__':
+    main()
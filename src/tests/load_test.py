@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import random
+import signal
+import tempfile
+import subprocess
+import urllib.request
+import urllib.error
+
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import numpy as np
+import pandas as pd
+
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RESULT_DIR = 'reports/load_tests'
+
+DASHBOARDS = {
+    'visualize': 'src.visualization.visualize',
+    'SIR': 'src.visualization.SIR_visualize',
+}
+
+# option values of the dashboard controls
+METRICS = ['confirmed', 'confirmed_filtered', 'confirmed_DR', 'confirmed_filtered_DR', 'confirmed_Rt']
+PERIODS = ['default', 10, 15, 20, 25, 30]
+PERCENTAGES = [1, 2, 3, 4, 5]
+
+# countries the dashboards pre-select or rely on, always part of the synthetic data
+REQUIRED_COUNTRIES = ['Canada', 'Germany', 'Italy', 'Spain']
+
+
+def make_synthetic_project(root, n_countries=30, n_days=300, seed=0):
+    ''' Processed data set and population file with logistic epidemic curves
+
+        Parameters:
+        ----------
+        root: str
+            project directory, data/processed is created inside
+        n_countries: int
+        n_days: int
+        seed: int
+
+        Returns:
+        ----------
+        countries: list of str
+    '''
+    from src.features.build_features import calc_features_sharded
+    from src.features.rt_estimation import calc_Rt, calc_country_Rt
+    from src.features.onset_index import save_onset_index
+
+    rng = np.random.default_rng(seed)
+    countries = REQUIRED_COUNTRIES+['Country_{:03d}'.format(pos) for pos in range(max(n_countries-len(REQUIRED_COUNTRIES), 0))]
+    dates = pd.date_range('2020-01-22', periods=n_days)
+
+    t = np.arange(n_days)
+    rate = rng.uniform(0.03, 0.12, (len(countries), 1))
+    size = rng.uniform(1e4, 1e6, (len(countries), 1))
+    Y = np.floor(size/(1+np.exp(-rate*(t-rng.uniform(60, 140, (len(countries), 1))))))
+
+    df_output = pd.DataFrame({'date': np.tile(dates, len(countries)),
+                              'state': 'no',
+                              'country': np.repeat(countries, n_days),
+                              'confirmed': Y.ravel()})
+    calc_features_sharded(df_output, keys=('state', 'country'), n_workers=1)
+    calc_Rt(df_output)
+    calc_country_Rt(df_output)
+
+    os.makedirs(os.path.join(root, 'data', 'processed'), exist_ok=True)
+    df_output['date'] = df_output['date'].dt.strftime('%Y-%m-%d')
+    df_output.sort_values(['date', 'country']).to_csv(os.path.join(root, 'data/processed/COVID_final_set.csv'),
+                                                      sep=';', index=False)
+    population = pd.Series(rng.integers(5e6, 3e8, len(countries)), index=countries, name='population')
+    population.to_frame().to_csv(os.path.join(root, 'data/processed/world_population.csv'), sep=';')
+    save_onset_index(df_output, os.path.join(root, 'data/processed/COVID_onset_index.csv'), population)
+    return countries
+
+
+def build_payload(dashboard, countries, metric='confirmed', period='default', perc=5, n_intervals=None,
+                  xaxis='date', held=None):
+    ''' Request body of /_dash-update-component as sent by the browser, without held
+        traces (page load) the server sends the traces of all countries'''
+    if dashboard == 'visualize':
+        return {'output': 'main-delta.data',
+                'outputs': {'id': 'main-delta', 'property': 'data'},
+                'inputs': [{'id': 'country_drop_down', 'property': 'value', 'value': countries},
+                           {'id': 'doubling_time', 'property': 'value', 'value': metric},
+                           {'id': 'xaxis-type', 'property': 'value', 'value': xaxis}],
+                'state': [{'id': 'main-held', 'property': 'data', 'value': held}],
+                'changedPropIds': ['country_drop_down.value']}
+
+    outputs = [('SIR-delta', 'data'), ('result-summary', 'children'), ('fit-status', 'children'),
+               ('fit-poll', 'disabled'), ('scenario-seed', 'data')]
+    return {'output': '..'+'...'.join(each+'.'+prop for each, prop in outputs)+'..',
+            'outputs': [{'id': each, 'property': prop} for each, prop in outputs],
+            'inputs': [{'id': 'country_drop_down', 'property': 'value', 'value': countries},
+                       {'id': 'period-type', 'property': 'value', 'value': period},
+                       {'id': 'susceptible_population_percentage', 'property': 'value', 'value': perc},
+                       {'id': 'fit-poll', 'property': 'n_intervals', 'value': n_intervals},
+                       {'id': 'xaxis-type', 'property': 'value', 'value': xaxis}],
+            'state': [{'id': 'SIR-held', 'property': 'data', 'value': held}],
+            'changedPropIds': ['country_drop_down.value']}
+
+
+def generate_mix(dashboard, countries, n_requests, max_countries=3, periods=PERIODS,
+                 percentages=PERCENTAGES, metrics=METRICS, seed=0):
+    ''' Random but reproducible sequence of callback payloads
+
+        Parameters:
+        ----------
+        dashboard: str
+            'visualize' or 'SIR'
+        countries: list of str
+        n_requests: int
+        max_countries: int
+            a request selects 1..max_countries countries
+        periods, percentages, metrics: list
+            option values to draw from
+
+        Returns:
+        ----------
+        payloads: list of dict
+    '''
+    rng = random.Random(seed)
+    payloads = []
+    for pos in range(n_requests):
+        selected = rng.sample(countries, rng.randint(1, min(max_countries, len(countries))))
+        payloads.append(build_payload(dashboard, selected, metric=rng.choice(metrics), period=rng.choice(periods),
+                                      perc=rng.choice(percentages)))
+    return payloads
+
+
+def send(url, payload, timeout=120):
+    ''' POST one payload
+
+        Returns:
+        ----------
+        latency: float
+            seconds
+        status: int
+            HTTP status, 0 on connection errors
+        n_bytes: int
+    '''
+    data = json.dumps(payload).encode()
+    request = urllib.request.Request(url+'/_dash-update-component', data=data,
+                                     headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            n_bytes = len(response.read())
+            status = response.status
+    except urllib.error.HTTPError as err:
+        n_bytes, status = 0, err.code
+    except (urllib.error.URLError, OSError):
+        n_bytes, status = 0, 0
+    return time.perf_counter()-start, status, n_bytes
+
+
+def run_load(url, payloads, concurrency):
+    ''' Replay payloads with a fixed number of concurrent clients (closed loop)
+
+        Returns:
+        ----------
+        df_requests: pd.DataFrame
+            latency, status and bytes per request
+        wall_time: float
+    '''
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda payload: send(url, payload), payloads))
+    wall_time = time.perf_counter()-start
+    return pd.DataFrame(results, columns=['latency', 'status', 'bytes']), wall_time
+
+
+def summarize(df_requests, wall_time):
+    ''' Throughput and latency percentiles of one run'''
+    ok = df_requests[df_requests['status'] == 200]
+    latency_ms = ok['latency']*1000
+    return {'requests': len(df_requests),
+            'errors': int((df_requests['status'] != 200).sum()),
+            'throughput_rps': round(len(ok)/wall_time, 2) if wall_time else None,
+            'p50_ms': round(latency_ms.quantile(0.5), 1) if len(ok) else None,
+            'p95_ms': round(latency_ms.quantile(0.95), 1) if len(ok) else None,
+            'p99_ms': round(latency_ms.quantile(0.99), 1) if len(ok) else None,
+            'max_ms': round(latency_ms.max(), 1) if len(ok) else None,
+            'mean_kb': round(ok['bytes'].mean()/1024, 1) if len(ok) else None}
+
+
+def start_server(dashboard, project_dir, port):
+    ''' Run a dashboard in a subprocess with its working directory in project_dir'''
+    code = ('from {} import create_app\n'
+            'create_app().run_server(debug=False, use_reloader=False, host="127.0.0.1", port={})').format(DASHBOARDS[dashboard], port)
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT+os.pathsep+os.environ.get('PYTHONPATH', ''),
+               COVID_PROJECT_ROOT=os.path.abspath(project_dir))
+    # own process group, so the fit workers of the SIR dashboard are stopped with it
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=project_dir, env=env, start_new_session=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    url = 'http://127.0.0.1:{}'.format(port)
+    for attempt in range(600):
+        if proc.poll() is not None:
+            raise RuntimeError('dashboard did not start:\n'+proc.stderr.read().decode()[-2000:])
+        try:
+            urllib.request.urlopen(url+'/', timeout=1).read()
+            return proc, url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.1)
+    stop_server(proc)
+    raise RuntimeError('dashboard did not answer on '+url)
+
+
+def stop_server(proc):
+    ''' Terminate the dashboard and its worker processes'''
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+def save_results(result_dir, runs, df_requests_list):
+    ''' Append the runs to summary.csv and keep the raw latencies of this session'''
+    os.makedirs(result_dir, exist_ok=True)
+    stamp = pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')
+
+    df_summary = pd.DataFrame(runs)
+    summary_path = os.path.join(result_dir, 'summary.csv')
+    df_summary.to_csv(summary_path, sep=';', index=False, mode='a', header=not os.path.exists(summary_path))
+
+    for run, df_requests in zip(runs, df_requests_list):
+        df_requests.to_csv(os.path.join(result_dir, '{}_{}_c{}.csv'.format(stamp, run['dashboard'], run['concurrency'])),
+                           sep=';', index=False)
+    return summary_path
+
+
+@click.command()
+@click.option('--dashboard', default='SIR', type=click.Choice(list(DASHBOARDS)))
+@click.option('--concurrency', multiple=True, default=[1, 4, 16], type=int, help='concurrent clients, repeat for a sweep')
+@click.option('--requests', 'n_requests', default=200, type=int, help='requests per concurrency level')
+@click.option('--max-countries', default=3, type=int, help='countries selected per request')
+@click.option('--period', 'periods', multiple=True, default=PERIODS, help='period-type values of the mix')
+@click.option('--percentage', 'percentages', multiple=True, default=PERCENTAGES, type=int,
+              help='susceptible_population_percentage values of the mix')
+@click.option('--n-countries', default=30, type=int, help='countries of the synthetic data set')
+@click.option('--url', default=None, help='test a running dashboard instead of starting one on synthetic data')
+@click.option('--port', default=8090, type=int)
+@click.option('--seed', default=0, type=int)
+@click.option('--result-dir', default=RESULT_DIR)
+def main(dashboard, concurrency, n_requests, max_countries, periods, percentages, n_countries, url, port, seed, result_dir):
+    """ Replays dash callback payloads at several concurrency levels and
+        reports throughput and p50/p95/p99 latency.
+    """
+    periods = [each if each == 'default' else int(each) for each in periods]
+    result_dir = os.path.abspath(result_dir)
+
+    with tempfile.TemporaryDirectory() as project_dir:
+        proc = None
+        if url is None:
+            countries = make_synthetic_project(project_dir, n_countries, seed=seed)
+            proc, url = start_server(dashboard, project_dir, port)
+        else:
+            countries = REQUIRED_COUNTRIES
+
+        runs, df_requests_list = [], []
+        try:
+            for level in concurrency:
+                payloads = generate_mix(dashboard, countries, n_requests, max_countries, periods,
+                                        percentages, seed=seed+level)
+                df_requests, wall_time = run_load(url, payloads, level)
+                run = dict({'timestamp': pd.Timestamp.now().isoformat(timespec='seconds'), 'dashboard': dashboard,
+                            'concurrency': level, 'max_countries': max_countries, 'n_countries': len(countries)},
+                           **summarize(df_requests, wall_time))
+                print('{dashboard:10s} c={concurrency:<4d} {throughput_rps:>8} req/s  p50 {p50_ms} ms  '
+                      'p95 {p95_ms} ms  p99 {p99_ms} ms  errors {errors}'.format(**run))
+                runs.append(run)
+                df_requests_list.append(df_requests)
+        finally:
+            if proc is not None:
+                stop_server(proc)
+
+    print('results appended to '+save_results(result_dir, runs, df_requests_list))
+
+
+if __name__ == '__main__':
+    main()
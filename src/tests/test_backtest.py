@@ -0,0 +1,79 @@
+import numpy as np
+
+from src.models.backtest import (causal_savgol, rolling_level_slope, get_level_growth, forecast_doubling_rate,
+                                 get_actuals, get_origins, error_table, backtest_doubling_rate)
+
+
+def get_exponential(days=60, growth=0.1):
+    return 1000*np.exp(growth*np.arange(days, dtype=float))[None, :]
+
+
+def test_causal_savgol():
+    rng = np.random.default_rng(0)
+    Y = rng.normal(size=(3, 30)).cumsum(axis=1)
+    F = causal_savgol(Y, 7)
+
+    assert np.isnan(F[:, :6]).all()
+    # a later change does not change the filtered values before it
+    changed = Y.copy()
+    changed[:, 20:] += 100
+    np.testing.assert_allclose(causal_savgol(changed, 7)[:, 6:20], F[:, 6:20])
+    # a line is reproduced exactly by the first order filter
+    line = 3.0*np.arange(30)[None, :]+5
+    np.testing.assert_allclose(causal_savgol(line, 7)[:, 6:], line[:, 6:])
+    np.testing.assert_array_equal(causal_savgol(Y, 1), Y)
+
+
+def test_rolling_level_slope():
+    line = 2.0*np.arange(10)[None, :]+1
+    level, slope = rolling_level_slope(line, 4)
+
+    assert np.isnan(level[:, :3]).all() and np.isnan(slope[:, :3]).all()
+    np.testing.assert_allclose(slope[:, 3:], 2)
+    np.testing.assert_allclose(level[:, 3:], line[:, 3:])
+
+
+def test_exponential_forecast_has_no_error():
+    Y = get_exponential()
+    A = get_actuals(Y, 14)
+    for window in [3, 7, 14]:
+        level, growth = get_level_growth(causal_savgol(Y, 1), window)
+        np.testing.assert_allclose(growth[:, window-1:], 0.1)
+        P = forecast_doubling_rate(level, growth, 14)
+        np.testing.assert_allclose(P[:, 20:40], A[:, 20:40], rtol=1e-9)
+
+    df_errors = backtest_doubling_rate(Y, ['Germany'], 1, reg_windows=[3, 7], horizon=7, min_cases=100)
+    assert (df_errors['mape'] < 1e-9).all()
+    assert (df_errors['n_origins'] > 0).all()
+
+
+def test_shrinking_series_is_flat():
+    P = forecast_doubling_rate(np.array([[100.0]]), np.array([[-0.2]]), 3)
+    assert P.tolist() == [[[100, 100, 100]]]
+
+
+def test_actuals_and_origins():
+    Y = np.array([[50., 100, 150, 200, 250]])
+    A = get_actuals(Y, 2)
+
+    assert A[0, :, 0].tolist()[:4] == [100, 150, 200, 250] and np.isnan(A[0, 4, 0])
+    assert A[0, :3, 1].tolist() == [150, 200, 250] and np.isnan(A[0, 3:, 1]).all()
+    # origins need min_cases and horizon days of actuals
+    assert get_origins(Y, 2).tolist() == [[False, True, True, False, False]]
+    assert get_origins(Y, 1, min_cases=0, step=2, first=1).tolist() == [[False, True, False, True, False]]
+
+
+def test_error_table():
+    A = np.array([[[100., 200], [200, 400]],
+                  [[10, 20], [np.nan, np.nan]]])
+    P = np.array([[[110., 200], [180, 400]],
+                  [[10, 30], [50, 50]]])
+    mask = np.array([[True, True], [True, True]])
+
+    df_errors = error_table(P, A, mask, ['Germany', 'Italy'], 'doubling_rate', 'sg=1,reg=3')
+
+    assert df_errors[['key', 'horizon']].values.tolist() == [['Germany', 1], ['Germany', 2], ['Italy', 1], ['Italy', 2]]
+    np.testing.assert_allclose(df_errors['mape'], [0.1, 0, 0, 0.5])
+    assert df_errors['n_origins'].tolist() == [2, 2, 1, 1]
+    assert (df_errors['model'] == 'doubling_rate').all()
+    np.testing.assert_allclose(df_errors['male'].iloc[3], np.log1p(30)-np.log1p(20))
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.features.build_features import (calc_features_sharded, calc_dense_features, to_compact_frame,
+                                         calc_doubling_rate_compact)
+from src.features.repair_counts import repair_cumulative_counts
+from src.features.rt_estimation import calc_Rt
+
+
+def get_counties(n_counties=7, days=40):
+    rng = np.random.default_rng(4)
+    dates = pd.date_range('2020-03-01', periods=days)
+    Y = np.cumsum(rng.poisson(rng.uniform(1, 40, (n_counties, 1)), (n_counties, days)), axis=1)
+    Y[:, 20] -= 15 # a correction in every county
+    df = pd.DataFrame({'date': np.tile(dates, n_counties),
+                       'state': np.repeat(['State_'+str(each % 3) for each in range(n_counties)], days),
+                       'country': 'US',
+                       'county': np.repeat(['County_'+str(each) for each in range(n_counties)], days),
+                       'confirmed': Y.ravel().astype('int32')})
+    return df.sample(frac=1, random_state=1).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_sharded_features_match_full_layout(n_workers):
+    keys = ('state', 'country', 'county')
+    df_full, df_log = repair_cumulative_counts(get_counties(), keys=keys)
+    calc_features_sharded(df_full, keys=keys, shard_size=100, n_workers=1)
+    calc_Rt(df_full, keys=keys)
+
+    df_sharded, df_sharded_log = calc_features_sharded(get_counties(), keys=keys, shard_size=2, n_workers=n_workers,
+                                                       repair_strategy='redistribute', rt=True)
+
+    assert df_sharded['confirmed'].dtype == np.int32
+    pd.testing.assert_frame_equal(df_sharded, df_full[df_sharded.columns])
+    pd.testing.assert_frame_equal(df_sharded_log.sort_values('county').reset_index(drop=True),
+                                  df_log.sort_values('county').reset_index(drop=True), check_dtype=False)
+
+
+def test_sharded_dtype_and_no_repair():
+    df, df_log = calc_features_sharded(get_counties(), shard_size=3, n_workers=1, dtype='float32')
+
+    assert df_log is None
+    assert df['confirmed_filtered_DR'].dtype == np.float32
+    assert 'confirmed_Rt' not in df
+
+
+def test_dense_features():
+    Y = 2.0*np.arange(1, 11)[None, :]
+    features = calc_dense_features(Y)
+
+    np.testing.assert_allclose(features['confirmed_filtered'], Y)
+    # mean of three days over the daily increase
+    np.testing.assert_allclose(features['confirmed_DR'][0, 2:], np.arange(2, 10))
+    assert np.isnan(features['confirmed_DR'][0, :2]).all()
+
+
+def test_compact_doubling_rate_matches_grouped_shift():
+    df = get_counties().drop(columns=['country']).rename(columns={'county': 'country'})
+    df.loc[df.index[:5], 'state'] = np.nan # rows without a series
+    df_compact = to_compact_frame(df)
+    calc_doubling_rate_compact(df_compact)
+
+    grouped = df_compact.groupby(['state', 'country'], observed=True, sort=False)['confirmed']
+    y = df_compact['confirmed'].astype(float)
+    y_back_1, y_back_2 = grouped.shift(1), grouped.shift(2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = ((y_back_2+y_back_1+y)/3)/((y-y_back_2)/2)
+
+    assert df_compact['confirmed_DR'].dtype == np.float32
+    np.testing.assert_allclose(df_compact['confirmed_DR'], expected, rtol=1e-6)
+    assert df_compact['confirmed_DR'].isna().sum() == 2*7+5
@@ -0,0 +1,73 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from src.data import data_access
+from src.data.data_access import freeze, memoized
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_access, 'project_root', str(tmp_path))
+    data_access.clear_cache()
+    for name in ['a.csv', 'b.csv']:
+        (tmp_path/name).write_text('x\n1\n')
+    yield tmp_path
+    data_access.clear_cache()
+
+
+def test_freeze_is_read_only():
+    df = pd.DataFrame({'date': pd.to_datetime(['2020-03-01', '2020-03-02']),
+                       'country': ['Germany', 'Italy'], 'confirmed': [1, 2], 'confirmed_DR': [1.5, 2.5]})
+    df_frozen = freeze(df)
+
+    for column in ['date', 'confirmed', 'confirmed_DR']:
+        with pytest.raises(ValueError):
+            df_frozen.copy(deep=False).loc[0, column] = df_frozen.loc[1, column]
+    # the source frame is not touched, new columns only change the copy
+    df.loc[0, 'confirmed'] = 10
+    df_copy = df_frozen.copy(deep=False)
+    df_copy['confirmed'] = 0
+    assert df_frozen['confirmed'].tolist() == [1, 2]
+    assert df_frozen.groupby('country')['confirmed'].sum().tolist() == [1, 2]
+
+    population = freeze(pd.Series([83.0, 60.0], index=['Germany', 'Italy'], name='population'))
+    with pytest.raises(ValueError):
+        population.copy(deep=False)['Germany'] = 0
+    assert population.name == 'population'
+
+
+def test_memoized_parses_once_per_version(project):
+    calls = []
+
+    def parse():
+        calls.append(1)
+        return pd.DataFrame({'x': [1.0]})
+
+    assert memoized('a', 'a.csv', parse)['x'].tolist() == [1.0]
+    memoized('a', 'a.csv', parse)
+    assert len(calls) == 1
+
+    (project/'a.csv').write_text('x\n1\n2\n')
+    memoized('a', 'a.csv', parse)
+    assert len(calls) == 2
+
+
+def test_memoized_parses_keys_in_parallel(project):
+    started, release = threading.Event(), threading.Event()
+
+    def slow_parse():
+        started.set()
+        release.wait(5)
+        return 'a'
+
+    thread = threading.Thread(target=memoized, args=('a', 'a.csv', slow_parse))
+    thread.start()
+    started.wait(5)
+    # key 'b' does not wait for the parse of key 'a'
+    assert memoized('b', 'b.csv', lambda: 'b') == 'b'
+    assert 'a' not in data_access.memo
+    release.set()
+    thread.join(5)
+    assert memoized('a', 'a.csv', lambda: 'not parsed again') == 'a'
@@ -0,0 +1,61 @@
+import gc
+import os
+import threading
+
+from src.data.data_provider import DataProvider, write_version_marker
+
+
+class Frame():
+    '''Loaded data set with weak reference support'''
+
+    def __init__(self, content):
+        self.content = content
+
+
+def write(file_path, content, ns):
+    with open(file_path, 'w') as f:
+        f.write(content)
+    os.utime(file_path, ns=(ns, ns))
+
+
+def test_swap_on_new_version(tmp_path):
+    file_path, marker_path = str(tmp_path/'final_set.csv'), str(tmp_path/'VERSION')
+    write(file_path, 'v1', 10**9)
+    write_version_marker(marker_path)
+    provider = DataProvider(marker_path)
+    provider.register('final_set', file_path, lambda path: Frame(open(path).read()))
+    swaps = []
+    provider.on_swap('final_set', lambda: swaps.append(provider.get('final_set').content))
+
+    held = provider.get('final_set')
+    assert provider.check() == []
+
+    write(file_path, 'v2', 2*10**9)
+    assert provider.check() == [] # not published yet
+    write_version_marker(marker_path)
+    assert provider.check() == ['final_set']
+    assert swaps == ['v2'] and held.content == 'v1'
+    assert provider.live_versions() == {'final_set': 1}
+
+    del held
+    gc.collect()
+    assert provider.live_versions() == {'final_set': 0}
+
+
+def test_release_tracking_is_thread_safe():
+    provider = DataProvider()
+    frames = [Frame(pos) for pos in range(2000)]
+
+    def track(part):
+        for each in part:
+            provider._track_release('final_set', each)
+
+    threads = [threading.Thread(target=track, args=(frames[pos::4],)) for pos in range(4)]
+    for each in threads:
+        each.start()
+    while any(each.is_alive() for each in threads):
+        provider.live_versions()
+    for each in threads:
+        each.join()
+
+    assert provider.live_versions() == {'final_set': 2000}
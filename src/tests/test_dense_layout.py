@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from src.features.dense_layout import DenseLayout, get_daily_codes, fill_cumulative
+
+
+def get_relational():
+    dates = pd.date_range('2020-03-01', periods=5)
+    df = pd.DataFrame({'date': np.concatenate([dates, dates[[0, 1, 3]]]),
+                       'state': ['no']*5+['Bavaria']*3,
+                       'country': 'Germany',
+                       'confirmed': [1., 2, 3, 4, 5, 10, 20, 40]})
+    return df.sample(frac=1, random_state=0).reset_index(drop=True)
+
+
+def test_round_trip():
+    df = get_relational()
+    layout = DenseLayout(df)
+
+    assert layout.shape == (2, 5)
+    assert layout.series_names() == ['Germany|Bavaria', 'Germany|no']
+    Y = layout.to_dense(df, 'confirmed')
+    assert np.isnan(Y[0]).tolist() == [False, False, True, False, True]
+
+    result = layout.assign(df.copy(), 'doubled', Y*2)
+    assert (result['doubled'] == df['confirmed']*2).all()
+
+
+def test_missing_days_are_columns():
+    df = get_relational()
+    df = df[df['date'] != '2020-03-03']
+    layout = DenseLayout(df)
+
+    assert len(layout.times) == 5
+    Y = fill_cumulative(layout.to_dense(df, 'confirmed'))
+    assert Y.tolist() == [[10, 20, 20, 40, 40], [1, 2, 2, 4, 5]]
+
+
+def test_integer_days():
+    codes, axis = get_daily_codes(pd.Series([3, 5, 3, 7], dtype=np.int16))
+    assert codes.tolist() == [0, 2, 0, 4]
+    assert axis.tolist() == [3, 4, 5, 6, 7]
+
+
+def test_fill_cumulative():
+    values = np.array([[np.nan, 2, np.nan, 5], [1, 2, 3, 4]])
+    assert fill_cumulative(values).tolist() == [[0, 2, 2, 5], [1, 2, 3, 4]]
@@ -0,0 +1,46 @@
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.models.train_model import fit_log_linear, fit_holt_damped, fit_ar_logdiff, save_model
+from src.models.predict_model import predict_all, predict_series
+
+GROWTH = np.array([0.05, 0.1, 0.0])
+HORIZON = 10
+
+
+def get_exponential(days=80):
+    ''' Cumulative counts with constant growth of log(1+y), the last one flat'''
+    t = np.arange(days+HORIZON)
+    Y = np.expm1(np.log(100)+GROWTH[:, None]*t)
+    return Y[:, :days], Y[:, days:]
+
+
+@pytest.mark.parametrize('name,fit,rtol', [('log_linear', fit_log_linear, 1e-9),
+                                           ('ar_logdiff', fit_ar_logdiff, 1e-3),
+                                           ('holt_damped', partial(fit_holt_damped, phi=1.0), 1e-9)])
+def test_forecast_round_trip(tmp_path, name, fit, rtol):
+    Y, Y_future = get_exponential()
+    keys = ['Germany', 'Italy', 'Spain']
+    save_model(name, keys, '2020-05-19', fit(Y), str(tmp_path))
+
+    df_forecast = predict_all(HORIZON, name, str(tmp_path))
+
+    assert df_forecast.columns.tolist() == ['date']+keys
+    assert df_forecast['date'].iloc[0] == pd.Timestamp('2020-05-20')
+    np.testing.assert_allclose(df_forecast[keys].to_numpy().T, Y_future, rtol=rtol)
+    np.testing.assert_allclose(predict_series('Italy', HORIZON, name, str(tmp_path)), df_forecast['Italy'])
+    assert predict_all(HORIZON, name, str(tmp_path), countries=['Spain'])['Spain'].tolist() == \
+        df_forecast['Spain'].tolist()
+
+
+def test_damped_trend_grows_slower(tmp_path):
+    Y, Y_future = get_exponential()
+    save_model('holt_damped', ['Germany', 'Italy', 'Spain'], '2020-05-19', fit_holt_damped(Y, phi=0.9), str(tmp_path))
+
+    forecast = predict_all(HORIZON, 'holt_damped', str(tmp_path))[['Germany', 'Italy']].to_numpy().T
+
+    assert (np.diff(forecast, axis=1) > 0).all()
+    assert (forecast[:, 1:] < Y_future[:2, 1:]).all()
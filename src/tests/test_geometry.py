@@ -0,0 +1,66 @@
+import os
+import json
+import gzip
+import threading
+
+import pytest
+
+from src.visualization import geometry
+
+
+def write_source(file_path):
+    squares = [('A', [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]),
+               ('B', [[1, 0], [2, 0], [2, 1], [1.5, 1.001], [1, 1], [1, 0]])]
+    features = [{'type': 'Feature', 'properties': {'ADMIN': key}, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+                for key, ring in squares]
+    with open(file_path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    source_path = str(tmp_path/'countries.geojson')
+    write_source(source_path)
+    monkeypatch.setitem(geometry.GEOMETRY_SOURCES, 'countries', (source_path, 'ADMIN'))
+    return source_path, str(tmp_path/'geometry')
+
+
+def test_build_and_read(source):
+    source_path, geometry_dir = source
+    index = geometry.load_geometry_index('countries', geometry_dir=geometry_dir)
+
+    assert index['keys'] == ['A', 'B']
+    assert len(index['levels']) == len(geometry.LEVELS)
+    # no temporary files are left next to the cache
+    assert sorted(os.listdir(os.path.join(geometry_dir, 'countries'))) == \
+        sorted(['index.json']+[str(level)+'.json.gz' for level in range(len(geometry.LEVELS))])
+    with gzip.open(geometry.get_geometry_path('countries', 0, geometry_dir), 'rt') as f:
+        assert [each['id'] for each in json.load(f)['features']] == ['A', 'B']
+
+
+def test_concurrent_requests_build_once(source, monkeypatch):
+    source_path, geometry_dir = source
+    builds = []
+    build = geometry.build_geometry_cache
+
+    def counting_build(*args, **kwargs):
+        builds.append(threading.get_ident())
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(geometry, 'build_geometry_cache', counting_build)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(geometry.load_geometry_index('countries', geometry_dir)))
+               for _ in range(8)]
+    for each in threads:
+        each.start()
+    for each in threads:
+        each.join()
+
+    assert len(builds) == 1
+    assert all(each['keys'] == ['A', 'B'] for each in results)
+
+    # a changed source is rebuilt once
+    os.utime(source_path, ns=(1, 1))
+    geometry.load_geometry_index('countries', geometry_dir)
+    geometry.load_geometry_index('countries', geometry_dir)
+    assert len(builds) == 2
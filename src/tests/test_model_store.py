@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from src.models.model_store import ModelStore
+
+
+def test_publish_new_versions(tmp_path):
+    store = ModelStore(str(tmp_path/'store'))
+    assert store.current_version() is None
+    assert store.table('SIR') is None
+
+    version = store.publish('SIR', ['Germany', 'Italy'], [[0.3, 0.1], [0.2, 0.1]], ['beta', 'gamma'],
+                            curves=[np.arange(3.), np.arange(5.)], offsets=[2, 0], meta={'days': 5})
+    table = store.table('SIR')
+
+    assert version == 'v000001'
+    assert 'Germany' in table and 'US' not in table
+    assert table.get_params('Italy') == {'beta': 0.2, 'gamma': 0.1}
+    assert table.get_rows(['Italy', 'Germany'])[:, 0].tolist() == [0.2, 0.3]
+    curve, offset = table.get_curve('Germany')
+    assert curve.tolist() == [0, 1, 2] and offset == 2
+    assert table.meta['days'] == 5
+
+    # a second table is published on top, the first one is carried over
+    assert store.publish('forecast', ['Germany'], [[1.5]], ['slope']) == 'v000002'
+    assert store.table('SIR').get_params('Germany') == {'beta': 0.3, 'gamma': 0.1}
+    assert store.table('forecast').curves is None
+    # tables of the old version stay readable
+    assert table.get_params('Germany')['beta'] == 0.3
+
+
+def test_prune_keeps_current(tmp_path):
+    store = ModelStore(str(tmp_path/'store'))
+    for pos in range(4):
+        store.publish('SIR', ['Germany'], [[pos]], ['beta'])
+    store.prune(keep=2)
+
+    assert sorted(each for each in (tmp_path/'store').iterdir() if each.name.startswith('v')) == \
+        [tmp_path/'store'/'v000003', tmp_path/'store'/'v000004']
+    assert store.table('SIR').get_params('Germany') == {'beta': 3}
+
+
+def test_publish_shape_mismatch(tmp_path):
+    with pytest.raises(ValueError):
+        ModelStore(str(tmp_path/'store')).publish('SIR', ['Germany'], [[1, 2, 3]], ['beta', 'gamma'])
+
+
+def test_failed_publish_leaves_no_staging(tmp_path):
+    store = ModelStore(str(tmp_path/'store'))
+    store.publish('SIR', ['Germany'], [[0.3]], ['beta'])
+    (tmp_path/'store'/'.staging-killed').mkdir()
+
+    with pytest.raises(TypeError):
+        store.publish('SIR', ['Germany'], [[0.4]], ['beta'], curves=[np.arange(3.)], offsets=[None])
+
+    assert sorted(each.name for each in (tmp_path/'store').iterdir()) == ['.lock', 'CURRENT', 'v000001']
+    assert store.table('SIR').get_params('Germany') == {'beta': 0.3}
@@ -0,0 +1,149 @@
+import gzip
+import json
+import threading
+import http.client
+from urllib.parse import parse_qs
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.query_service import _parse_query, create_server
+
+
+def test_repeated_country_parameters():
+    params = parse_qs('country=Germany,Italy&country=Spain&metric=doubling_rate&start=2020-03-01')
+    query = _parse_query(params, query_string=True)
+
+    assert query['countries'] == ['Germany', 'Italy', 'Spain']
+    assert query['metric'] == 'doubling_rate'
+    assert query['start'] == '2020-03-01'
+    assert query['end'] is None
+    assert query['level'] == 'country'
+
+
+def test_comma_in_country_name():
+    params = parse_qs('country=Korea, South,Germany', keep_blank_values=True)
+    assert _parse_query(params, query_string=True)['countries'] == ['Korea, South', 'Germany']
+
+
+def test_json_lists_are_not_split():
+    query = _parse_query({'country': ['Korea,South', 'Germany'], 'level': 'state'})
+    assert query['countries'] == ['Korea,South', 'Germany']
+    assert query['level'] == 'state'
+
+
+def test_json_string_is_split():
+    assert _parse_query({'country': 'Germany,Korea, South'})['countries'] == ['Germany', 'Korea, South']
+    assert _parse_query({})['countries'] is None
+
+
+def write_final_set(file_path, scale=1):
+    dates = pd.date_range('2020-03-01', periods=10)
+    rows = []
+    for country, state, growth in [('Germany', 'no', 50), ('Canada', 'Ontario', 20), ('Canada', 'Quebec', 30)]:
+        confirmed = scale*growth*np.arange(1, 11)
+        rows.append(pd.DataFrame({'date': dates, 'state': state, 'country': country,
+                                  'confirmed': confirmed, 'confirmed_filtered': confirmed,
+                                  'confirmed_DR': 1.0, 'confirmed_filtered_DR': 1.0,
+                                  'confirmed_Rt': growth/10, 'confirmed_country_Rt': 4.2 if country == 'Canada' else 5.0}))
+    pd.concat(rows).to_csv(file_path, sep=';', index=False)
+
+
+@pytest.fixture
+def server(tmp_path):
+    file_path = str(tmp_path/'COVID_final_set.csv')
+    write_final_set(file_path)
+    server = create_server(file_path, port=0)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server, file_path
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    if response.getheader('Content-Encoding') == 'gzip':
+        data = gzip.decompress(data)
+    return response, (json.loads(data) if data else None)
+
+
+def test_series_and_country_aggregation(server):
+    server, file_path = server
+    response, payload = request(server, 'GET', '/series?country=Canada&metric=confirmed&end=2020-03-02')
+    assert response.status == 200
+    assert payload['series'] == {'Canada': [50.0, 100.0]}
+
+    # rates of a country are not averaged over its states
+    payload = request(server, 'GET', '/series?country=Canada&metric=confirmed_Rt')[1]
+    assert payload['series']['Canada'] == [4.2]*10
+    payload = request(server, 'GET', '/series?country=Canada&metric=confirmed_DR&start=2020-03-03')[1]
+    np.testing.assert_allclose(payload['series']['Canada'], np.arange(2, 10)/1.0)
+
+    payload = request(server, 'GET', '/keys?level=state')[1]
+    assert payload['keys'] == ['Canada|Ontario', 'Canada|Quebec', 'Germany|no']
+    payload = request(server, 'GET', '/series?country=Canada&level=state&end=2020-03-01')[1]
+    assert payload['series'] == {'Canada|Ontario': [20.0], 'Canada|Quebec': [30.0]}
+
+
+def test_etag_and_gzip(server):
+    server, file_path = server
+    response, payload = request(server, 'GET', '/series?country=Germany', headers={'Accept-Encoding': 'gzip'})
+    etag = response.getheader('ETag')
+    assert response.status == 200 and response.getheader('Content-Encoding') == 'gzip'
+    assert etag.startswith('"'+payload['version'])
+
+    response, payload = request(server, 'GET', '/series?country=Germany', headers={'If-None-Match': etag})
+    assert response.status == 304 and payload is None
+    response = request(server, 'GET', '/series?country=Germany')[0]
+    assert response.getheader('Content-Encoding') is None
+
+    # a new data version changes the ETag
+    write_final_set(file_path, scale=2)
+    response, payload = request(server, 'GET', '/series?country=Germany', headers={'If-None-Match': etag})
+    assert response.status == 200 and response.getheader('ETag') != etag
+    assert payload['series']['Germany'][0] == 100
+
+
+@pytest.mark.parametrize('path', ['/series?country=Germany&metric=deaths', '/keys?level=county',
+                                  '/series?country=Germany&start=yesterday'])
+def test_bad_query(server, path):
+    response, payload = request(server[0], 'GET', path)
+    assert response.status == 400 and 'error' in payload
+
+
+def test_unknown_series_and_endpoint(server):
+    assert request(server[0], 'GET', '/series?country=Atlantis')[0].status == 404
+    assert request(server[0], 'GET', '/countries')[0].status == 404
+
+
+@pytest.mark.parametrize('body', ['not json', '{"query": []}', '{"queries": ["x"]}', '{"queries": 5}',
+                                  '{"queries": [{"country": 5}]}', '{"queries": [{"country": [["Germany"]]}]}'])
+def test_bad_batch(server, body):
+    response, payload = request(server[0], 'POST', '/batch', body=body)
+    assert response.status == 400 and 'error' in payload
+
+
+def test_batch_answers_from_one_version(server):
+    server, file_path = server
+    body = json.dumps({'queries': [{'country': ['Germany'], 'end': '2020-03-01'},
+                                   {'country': 'Canada', 'metric': 'confirmed_Rt', 'level': 'state'}]})
+    response, payload = request(server, 'POST', '/batch', body=body)
+
+    assert response.status == 200
+    assert [each['version'] for each in payload['results']] == [payload['version']]*2
+    assert payload['results'][0]['series'] == {'Germany': [50.0]}
+    assert payload['results'][1]['series']['Canada|Quebec'][0] == 3.0
+
+    store = server.RequestHandlerClass.store
+    state = store.state
+    write_final_set(file_path, scale=2)
+    store.reload()
+    # queries with the state of the batch keep answering from it after a reload
+    assert store.query(['Germany'], state=state)['series']['Germany'][0] == 50
+    assert store.query(['Germany'])['series']['Germany'][0] == 100
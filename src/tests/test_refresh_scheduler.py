@@ -0,0 +1,205 @@
+import os
+
+import pytest
+
+from src.data import data_access
+from src.data.data_access import ROOT_ENV
+from src.data.data_provider import read_version_marker
+from src.data.refresh_scheduler import RefreshScheduler, LocalUpstream, Stage, STAGING_DIR, STAGES
+
+
+class Clock():
+    '''Injected time source of the scheduler, advanced by the test'''
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CopyStage(Stage):
+    '''Stage running in process: copies input to output under the root it is passed,
+       written partially before failing if fail is set'''
+
+    def __init__(self, name, after, source, target):
+        super().__init__(name, [], after)
+        self.source = source
+        self.target = target
+        self.fail = False
+        self.runs = 0
+
+    def run(self, env):
+        self.runs += 1
+        root = env[ROOT_ENV]
+        with open(os.path.join(root, self.source)) as f:
+            content = f.read()
+        target = os.path.join(root, self.target)
+        with open(target+'.tmp', 'w') as f:
+            f.write('partial' if self.fail else content.upper())
+        os.replace(target+'.tmp', target)
+        if self.fail:
+            raise RuntimeError('stage {} failed'.format(self.name))
+        return 'done'
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    root = tmp_path/'project'
+    (root/'data'/'processed').mkdir(parents=True)
+    (root/'data'/'raw').mkdir()
+    source = tmp_path/'upstream'
+    source.mkdir()
+    (source/'cases.txt').write_text('day 1')
+    monkeypatch.setattr(data_access, 'project_root', str(root))
+    return root, source
+
+
+def get_scheduler(project, clock):
+    root, source = project
+    stages = [CopyStage('relational', ['fake'], 'data/raw/fake/cases.txt', 'data/processed/relational.txt'),
+              CopyStage('features', ['relational'], 'data/processed/relational.txt', 'data/processed/final.txt')]
+    upstream = LocalUpstream('fake', str(source), 'data/raw/fake', interval=10)
+    return RefreshScheduler([upstream], stages, quiet_period=30, max_delay=300, max_parallel=1,
+                            backoff=60, max_backoff=600, state_path=str(root/'data'/'processed'/'state.json'),
+                            marker_path=str(root/'data'/'processed'/'VERSION'), clock=clock)
+
+
+def test_refresh_after_quiet_period(project):
+    root, source = project
+    clock = Clock()
+    scheduler = get_scheduler(project, clock)
+
+    assert scheduler.step() is None             # first change, quiet period starts
+    clock.now = 20
+    assert scheduler.step() is None
+    clock.now = 30
+    version = scheduler.step()
+
+    assert version is not None
+    assert read_version_marker(str(root/'data'/'processed'/'VERSION')) == version
+    assert (root/'data'/'processed'/'final.txt').read_text() == 'DAY 1'
+    assert not (root/STAGING_DIR).exists()
+    assert scheduler.state['stages']['features']['status'] == 'done'
+
+
+def test_changes_are_coalesced(project):
+    root, source = project
+    clock = Clock()
+    scheduler = get_scheduler(project, clock)
+
+    scheduler.step()
+    for now, content in [(10, 'day 2'), (20, 'day 3')]:
+        clock.now = now
+        (source/'cases.txt').write_text(content)
+        os.utime(source/'cases.txt', ns=(now*10**9, now*10**9))
+        assert scheduler.step() is None
+    clock.now = 49
+    assert scheduler.step() is None
+    clock.now = 50
+    assert scheduler.step() is not None
+
+    assert [stage.runs for stage in scheduler.stages] == [1, 1]
+    assert (root/'data'/'processed'/'final.txt').read_text() == 'DAY 3'
+
+
+def test_failed_run_keeps_published_data(project):
+    root, source = project
+    clock = Clock()
+    scheduler = get_scheduler(project, clock)
+    scheduler.step()
+    clock.now = 30
+    version = scheduler.step()
+
+    (source/'cases.txt').write_text('day 2')
+    os.utime(source/'cases.txt', ns=(40*10**9, 40*10**9))
+    scheduler.stages[1].fail = True
+    clock.now = 40
+    scheduler.step()
+    clock.now = 70
+    assert scheduler.step() is None
+
+    # the first stage succeeded, nothing of the run is published
+    assert (root/'data'/'processed'/'relational.txt').read_text() == 'DAY 1'
+    assert (root/'data'/'processed'/'final.txt').read_text() == 'DAY 1'
+    assert read_version_marker(str(root/'data'/'processed'/'VERSION')) == version
+    assert not (root/STAGING_DIR).exists()
+    assert 'fake' in scheduler.pending
+
+    scheduler.stages[1].fail = False
+    clock.now = 100
+    assert scheduler.step() is None             # still in backoff
+    clock.now = 70+scheduler.max_backoff
+    new_version = scheduler.step()
+    assert new_version not in (None, version)
+    assert (root/'data'/'processed'/'final.txt').read_text() == 'DAY 2'
+    assert not scheduler.pending
+
+
+def test_restart_skips_unchanged_sources(project):
+    clock = Clock()
+    scheduler = get_scheduler(project, clock)
+    scheduler.step()
+    clock.now = 30
+    scheduler.step()
+
+    restarted = get_scheduler(project, clock)
+    clock.now = 100
+    assert restarted.poll() == []
+    assert not restarted.is_due()
+    assert [stage.runs for stage in restarted.stages] == [0, 0]
+
+
+class AppendStage(Stage):
+    '''Stage appending to its output in place, fails after the write if fail is set'''
+
+    def __init__(self, name, after, target):
+        super().__init__(name, [], after, outputs=[target])
+        self.target = target
+        self.fail = False
+
+    def run(self, env):
+        with open(os.path.join(env[ROOT_ENV], self.target), 'a') as f:
+            f.write('appended\n')
+        if self.fail:
+            raise RuntimeError('stage {} failed'.format(self.name))
+        return 'done'
+
+
+def test_outputs_rewritten_in_place_are_isolated(project):
+    root, source = project
+    log_path = root/'data'/'processed'/'snapshots'/'log.txt'
+    log_path.parent.mkdir()
+    log_path.write_text('published\n')
+    (root/'data'/'processed'/'snapshots'/'other.txt').write_text('other')
+    stage = AppendStage('append', ['fake'], 'data/processed/snapshots/log.txt')
+    clock = Clock()
+    scheduler = RefreshScheduler([LocalUpstream('fake', str(source), 'data/raw/fake', interval=10)], [stage],
+                                 quiet_period=0, state_path=str(root/'data'/'processed'/'state.json'),
+                                 marker_path=str(root/'data'/'processed'/'VERSION'), clock=clock)
+
+    stage.fail = True
+    assert scheduler.step() is None
+    assert log_path.read_text() == 'published\n'
+
+    stage.fail = False
+    clock.now = 10**4
+    assert scheduler.step() is not None
+    assert log_path.read_text() == 'published\nappended\n'
+    assert (root/'data'/'processed'/'snapshots'/'other.txt').read_text() == 'other'
+    assert not (root/STAGING_DIR).exists()
+
+
+def test_outputs_are_declared_in_processed():
+    assert all(output.startswith('data/processed/') for stage in STAGES for output in stage.outputs)
+    with pytest.raises(ValueError):
+        Stage('raw', ['src.data.get_data'], [], outputs=['data/raw/COVID-19'])
+
+
+def test_missing_symlinks_fail_clearly(project, monkeypatch):
+    def symlink(*args, **kwargs):
+        raise OSError('symbolic link privilege not held')
+
+    monkeypatch.setattr(os, 'symlink', symlink)
+    with pytest.raises(RuntimeError, match='symbolic links'):
+        get_scheduler(project, Clock())
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.features.repair_counts import (repair_redistribute, repair_carry_forward, repair_backdate,
+                                        repair_cumulative_counts, REPAIR_STRATEGIES)
+
+
+Y = np.array([[0., 10, 20, 30, 25, 40, 50],
+              [1., 2, 3, 4, 5, 6, 7]])
+
+
+def test_carry_forward_and_backdate():
+    assert repair_carry_forward(Y)[0].tolist() == [0, 10, 20, 30, 30, 40, 50]
+    assert repair_backdate(Y)[0].tolist() == [0, 10, 20, 25, 25, 40, 50]
+
+
+def test_redistribute_keeps_last_count():
+    repaired = repair_redistribute(Y, window=3)
+
+    assert (np.diff(repaired, axis=1) >= 0).all()
+    assert repaired[:, -1].tolist() == Y[:, -1].tolist()
+    assert repaired[1].tolist() == Y[1].tolist()
+    # the decrease of 5 on day 4 is taken from the days before, outside the window nothing changes
+    assert repaired[0, :2].tolist() == [0, 10] and repaired[0, 4:].tolist() == [25, 40, 50]
+    assert repaired[0, 2] < 20 and repaired[0, 3] <= 25
+
+
+@pytest.mark.parametrize('strategy', REPAIR_STRATEGIES)
+def test_repair_cumulative_counts(strategy):
+    dates = pd.date_range('2020-03-01', periods=Y.shape[1])
+    df = pd.DataFrame({'date': np.tile(dates, 2),
+                       'state': 'no',
+                       'country': np.repeat(['Germany', 'Italy'], len(dates)),
+                       'confirmed': Y.ravel()}).sample(frac=1, random_state=0)
+
+    df_repaired, df_log = repair_cumulative_counts(df.copy(), strategy=strategy, window=3)
+
+    assert df_log['country'].tolist() == ['Germany']
+    assert df_log.loc[0, 'n_decreases'] == 1
+    assert df_log.loc[0, 'total_decrease'] == 5
+    for country, group in df_repaired.sort_values('date').groupby('country'):
+        assert (np.diff(group['confirmed'].to_numpy()) >= 0).all()
+    italy = df_repaired[df_repaired['country'] == 'Italy'].sort_values('date')
+    assert italy['confirmed'].tolist() == Y[1].tolist()
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        repair_cumulative_counts(pd.DataFrame(), strategy='interpolate')
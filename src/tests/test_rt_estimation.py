@@ -0,0 +1,50 @@
+import numpy as np
+from scipy import stats
+
+from src.features.rt_estimation import calc_dense_Rt, get_serial_interval
+
+
+def get_direct_Rt(y, w, window, prior_shape, prior_scale, credible_interval, min_pressure):
+    ''' Cori et al. 2013 with explicit loops over days and windows'''
+    incidence = np.maximum(np.diff(y, prepend=y[0]), 0)
+    pressure = np.array([sum(w[s]*incidence[t-s] for s in range(1, min(t, len(w)-1)+1))
+                         for t in range(len(y))])
+    tail = (1-credible_interval)/2
+    result = np.full((3, len(y)), np.nan)
+    for t in range(window, len(y)):
+        if y[0] > 0 and t < len(w):
+            continue
+        days = slice(t-window+1, t+1)
+        if pressure[days].sum() < min_pressure:
+            continue
+        shape = prior_shape+incidence[days].sum()
+        scale = 1/(1/prior_scale+pressure[days].sum())
+        result[:, t] = [shape*scale, stats.gamma.ppf(tail, shape, scale=scale),
+                        stats.gamma.ppf(1-tail, shape, scale=scale)]
+    return result
+
+
+def test_serial_interval():
+    w = get_serial_interval()
+    assert w[0] == 0
+    assert np.isclose(w.sum(), 1)
+    # w[s] is the mass of (s-1, s], the mean is shifted by half a day
+    assert np.isclose((w*np.arange(len(w))).sum(), 4.7+0.5, atol=0.1)
+
+
+def test_dense_Rt_matches_direct_computation():
+    rng = np.random.default_rng(0)
+    days = 60
+    growing = np.cumsum(rng.poisson(np.linspace(1, 80, days)))
+    shrinking = np.cumsum(rng.poisson(np.linspace(80, 5, days)))+500  # starts mid-epidemic
+    Y = np.vstack([growing, shrinking]).astype(float)
+    w = get_serial_interval()
+
+    Rt_mean, Rt_lower, Rt_upper = calc_dense_Rt(Y, w, window=7)
+
+    for row in range(len(Y)):
+        expected = get_direct_Rt(Y[row], w, 7, 1, 5, 0.95, 10)
+        np.testing.assert_allclose(np.vstack([Rt_mean[row], Rt_lower[row], Rt_upper[row]]), expected,
+                                   rtol=1e-6, equal_nan=True)
+    assert np.nanmean(Rt_mean[0, -10:]) > 1 > np.nanmean(Rt_mean[1, -10:])
+    assert np.isnan(Rt_mean[1, :len(w)]).all()
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from src.models.similarity import get_envelopes, lb_keogh, dtw_batch, normalize_windows, SimilarityIndex
+
+
+def get_dtw(q, c, radius):
+    ''' Squared DTW distance within a Sakoe-Chiba band, brute force'''
+    n = len(q)
+    D = np.full((n+1, n+1), np.inf)
+    D[0, 0] = 0
+    for i in range(1, n+1):
+        for j in range(1, n+1):
+            if abs(i-j) <= radius:
+                D[i, j] = (q[i-1]-c[j-1])**2+min(D[i-1, j-1], D[i-1, j], D[i, j-1])
+    return D[n, n]
+
+
+def test_dtw_batch_matches_brute_force():
+    rng = np.random.default_rng(1)
+    W = normalize_windows(np.cumsum(rng.poisson(20, (12, 21)), axis=1))
+    for radius in [0, 2, 5]:
+        distance = dtw_batch(W[0], W, radius)
+        expected = [get_dtw(W[0], each, radius) for each in W]
+        np.testing.assert_allclose(distance, expected)
+    assert dtw_batch(W[0], W, 3)[0] == 0
+
+
+def test_lb_keogh_is_lower_bound():
+    rng = np.random.default_rng(2)
+    W = rng.normal(size=(50, 28)).cumsum(axis=1)
+    radius = 3
+    upper, lower = get_envelopes(W, radius)
+    for q in W[:5]:
+        bound = lb_keogh(q, upper, lower)
+        assert (bound <= dtw_batch(q, W, radius)+1e-9).all()
+
+
+def test_query_matches_exhaustive_search():
+    rng = np.random.default_rng(3)
+    keys = ['country_'+str(each) for each in range(20)]
+    Y = np.cumsum(rng.poisson(rng.uniform(5, 50, (20, 1)), (20, 90)), axis=1).astype(float)
+    onset = rng.integers(0, 40, 20)
+    index = SimilarityIndex(keys, pd.date_range('2020-03-01', periods=90), Y, onset, window=21, stride=5, radius=2)
+
+    result = index.query('country_0', lag=7, k=4, batch_size=4)
+
+    q = index.get_query('country_0', lag=7)
+    distances = dtw_batch(q, index.windows, 2)
+    best = {}
+    for row, series in enumerate(index.owner):
+        if series != 0:
+            best[series] = min(best.get(series, np.inf), distances[row])
+    expected = sorted(best.items(), key=lambda item: item[1])[:4]
+    assert result['key'].tolist() == [keys[series] for series, _ in expected]
+    np.testing.assert_allclose(result['distance'], [np.sqrt(distance) for _, distance in expected])
+    assert result.attrs['n_dtw'] <= len(index.owner)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.snapshot_store import SnapshotStore
+
+
+def get_version(days, revised=None):
+    dates = pd.date_range('2020-03-01', periods=days)
+    df = pd.DataFrame({'date': np.tile(dates, 2),
+                       'state': 'no',
+                       'country': np.repeat(['Germany', 'Italy'], days),
+                       'confirmed': np.concatenate([np.arange(days)*10., np.arange(days)*5.])})
+    if revised is not None:
+        df.loc[revised, 'confirmed'] += 1
+    return df
+
+
+def get_sorted(df):
+    return df.sort_values(['date', 'state', 'country']).reset_index(drop=True)
+
+
+def test_read_as_of(tmp_path):
+    store = SnapshotStore('final_set', root=str(tmp_path), full_every=3)
+    published = {}
+    for day, (days, revised) in enumerate([(3, None), (4, None), (5, 1), (5, None), (6, 2)]):
+        df = get_version(days, revised)
+        date = '2020-04-0'+str(day+1)
+        store.append(df, snapshot_date=date)
+        published[date] = df
+
+    assert store.summary()['kind'].tolist() == ['base', 'delta', 'delta', 'base', 'delta']
+    for date, df in published.items():
+        pd.testing.assert_frame_equal(store.read_as_of(date), get_sorted(df)[['date', 'state', 'country', 'confirmed']])
+
+    # the last version on or before the day, one country only
+    df_italy = store.read_as_of('2020-04-03 12:00', countries=['Italy'])
+    expected = get_sorted(published['2020-04-03'])
+    pd.testing.assert_frame_equal(df_italy, expected[expected['country'] == 'Italy'].reset_index(drop=True)
+                                  [['date', 'state', 'country', 'confirmed']])
+
+
+def test_unchanged_version_is_not_stored(tmp_path):
+    store = SnapshotStore('final_set', root=str(tmp_path))
+    assert store.append(get_version(3), snapshot_date='2020-04-01') is not None
+    assert store.append(get_version(3), snapshot_date='2020-04-02') is None
+    with pytest.raises(KeyError):
+        store.read_as_of('2020-03-31')
@@ -1,17 +1,186 @@
-import dash
-dash.__version__
-import dash_core_components as dcc
-import dash_html_components as html
-from dash.dependencies import Input, Output,State
+import time
 import random
+import threading
 
-import plotly.graph_objects as go
-import plotly
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from src.data.data_access import get_path, load_wide_confirmed, load_onset_index, load_population, FINAL_SET, \
+    ONSET_INDEX
+from src.features.onset_index import get_threshold_label
+from src.data.data_provider import DataProvider
+from src.models.model_store import ModelStore
+from src.visualization import metrics
+
+# dash, plotly and the SIR fit (scipy) are imported on use only, so the data
+# helpers and update_figure can be used without loading them
+color_list=[]
+model_store=ModelStore()
+
+# the data set is replaced in the running app when build_features publishes a new version
+provider=DataProvider()
+
+# days the what-if scenario is simulated beyond the last observed day
+SCENARIO_HORIZON=60
+
+# background fitting: finished fits per (country, period, percentage), least recently
+# used first, and running futures
+FIT_WORKERS=4
+FIT_CACHE_SIZE=512
+fit_pool=None
+fit_cache=OrderedDict()
+fit_pending={}
+fit_lock=threading.Lock()
+
+
+def read_confirmed(file_path):
+    df_confirmed=load_wide_confirmed()
+    metrics.record_data_memory('SIR', 'confirmed_wide', df_confirmed)
+
+    ## list of hex color codes, kept over reloads
+    for i in range(len(color_list), df_confirmed.shape[1]-1):
+        random_color = '#%02x%02x%02x' % (random.randint(0, 255),random.randint(0, 255), random.randint(0, 255))
+        color_list.append(random_color)
+    return df_confirmed
+
+
+def invalidate_fits():
+    ''' Drop all fits of the previous data version, the worker processes hold
+        their own copy of the data and are replaced as well'''
+    global fit_pool
+    with fit_lock:
+        fit_cache.clear()
+        for future in fit_pending.values():
+            future.cancel()
+        fit_pending.clear()
+        if fit_pool is not None:
+            fit_pool.shutdown(wait=False)
+            fit_pool=None
+
+
+provider.register('confirmed_wide', get_path(FINAL_SET), read_confirmed)
+provider.on_swap('confirmed_wide', invalidate_fits)
+provider.register('onset_index', get_path(ONSET_INDEX), lambda file_path: load_onset_index())
+
+
+def get_data():
+    ''' Confirmed cases per country (wide format), read on first use
+
+        Returns:
+        ----------
+        df_confirmed: pd.DataFrame
+    '''
+    return provider.get('confirmed_wide')
+
+
+def get_onset_index():
+    ''' Onset dates per series and threshold stored by build_features.py, None if missing'''
+    try:
+        return provider.get('onset_index')
+    except FileNotFoundError:
+        return None
+
+
+def fit_country(country, period, susceptable_perc):
+    ''' SIR fit of one country, runs in a worker process of fit_pool
+
+        Returns:
+        ----------
+        fit: tuple (fit_line, idx, summary)
+        duration: float
+            seconds spent in the fit
+    '''
+    from src.models.SIR_model import get_optimum_beta_gamma
+
+    start=time.perf_counter()
+    fit=get_optimum_beta_gamma(get_data(), country, susceptable_perc=susceptable_perc, period=period,
+                               method='sensitivity')
+    return fit, time.perf_counter()-start
+
+
+def get_store_table(period, susceptable_perc):
+    ''' Fits published by SIR_model.publish_SIR_fits (memory-mapped store), None if
+        missing or fitted on another version of the data set than the loaded one'''
+    from src.models.SIR_model import get_SIR_table_name
+
+    get_data() # loads the data set, so its version is known
+    table=model_store.table(get_SIR_table_name(susceptable_perc, period))
+    if table is None or table.meta.get('data_version') != provider.version('confirmed_wide'):
+        return None
+    return table
+
+
+def cache_fit(key, fit):
+    ''' Add a fit to fit_cache, the least recently used fit is dropped above FIT_CACHE_SIZE'''
+    fit_cache[key]=fit
+    fit_cache.move_to_end(key)
+    if len(fit_cache) > FIT_CACHE_SIZE:
+        fit_cache.popitem(last=False)
+
+
+def request_fits(country_list, period, susceptable_perc, record=True):
+    ''' Return all finished fits and dispatch the missing ones to the process pool
+
+        Fits of countries which are no longer selected are cancelled if they did not start yet.
+        record=False skips the cache metrics, used for the repeated lookups of the fit-poll interval.
+
+        Returns:
+        ----------
+        fits: dict country -> (fit_line, idx, summary)
+        n_pending: int
+    '''
+    global fit_pool
+    from src.models.SIR_model import get_stored_beta_gamma
+
+    table=get_store_table(period, susceptable_perc)
+    requested=[(each, period, susceptable_perc) for each in country_list]
+
+    fits={}
+    with fit_lock:
+        if fit_pool is None:
+            fit_pool=ProcessPoolExecutor(max_workers=FIT_WORKERS)
+
+        for key, future in list(fit_pending.items()):
+            if future.done():
+                del fit_pending[key]
+                if future.exception() is None:
+                    fit, duration=future.result()
+                    cache_fit(key, fit)
+                    metrics.FIT_DURATION.observe(duration, country=key[0])
+                else:
+                    cache_fit(key, None) # country can not be fitted, show observed data only
+            elif key not in requested and future.cancel():
+                del fit_pending[key]
+
+        for key in requested:
+            if key in fit_cache:
+                fit_cache.move_to_end(key)
+                if record:
+                    metrics.CACHE_REQUESTS.inc(cache='fit_cache', result='hit')
+                if fit_cache[key] is not None:
+                    fits[key[0]]=fit_cache[key]
+            elif table is not None and key[0] in table:
+                if record:
+                    metrics.CACHE_REQUESTS.inc(cache='model_store', result='hit')
+                fits[key[0]]=get_stored_beta_gamma(table, key[0])
+            elif key not in fit_pending:
+                metrics.CACHE_REQUESTS.inc(cache='fit_cache', result='miss')
+                fit_pending[key]=fit_pool.submit(fit_country, *key)
+
+        n_pending=len([key for key in requested if key in fit_pending])
+
+    return fits, n_pending
 
 
 def generate_table(dataframe, max_rows=10):
     '''Given dataframe, return template generated using Dash components
     '''
+    import dash_html_components as html
+
     return html.Table(
         # Header
         [html.Tr([html.Th(col) for col in dataframe.columns])] +
@@ -22,174 +191,386 @@ def generate_table(dataframe, max_rows=10):
         ]) for i in range(min(len(dataframe), max_rows))]
     )
 
-## list of hex color codes 
-color_list = []
-for i in range(int((df_confirmed.shape[1]-1)/2)):
-    random_color = '#%02x%02x%02x' % (random.randint(0, 255),random.randint(0, 255), random.randint(0, 255))
-    color_list.append(random_color)
-
-fig = go.Figure()
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-
-app.layout = html.Div([
-    
-    html.H1('SIR Model (Susceptible, Infectious, or Recovered)', style={'text-align': 'center',
-                                                                        'color': 'white',
-                                                                        'padding': 10,
-                                                                        'background-color': '#25383C',}),
-    
-    dcc.Markdown(''' Simulation can be carried out at different time periods e.g, 7 days, 15 days. 
+
+
+def create_app():
+    ''' Build the dash app with layout and callbacks
+
+        Returns:
+        ----------
+        app: dash.Dash
+    '''
+    import dash
+    import dash_core_components as dcc
+    import dash_html_components as html
+    from dash.dependencies import Input, Output,State, ClientsideFunction
+
+    import plotly.graph_objects as go
+
+    get_data()
+    provider.start()
+
+    app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+    metrics.instrument_app(app, 'SIR')
+
+    def serve_layout():
+        # called on every page load, so the country options follow data reloads
+        country_list=list(get_data().columns[1:])
+        df_onset=get_onset_index()
+        onset_names=[] if df_onset is None else list(df_onset.columns)
+
+        return html.Div([
+
+            html.H1('SIR Model (Susceptible, Infectious, or Recovered)', style={'text-align': 'center',
+                                                                                'color': 'white',
+                                                                                'padding': 10,
+                                                                                'background-color': '#25383C',}),
+
+            dcc.Markdown(''' Simulation can be carried out at different time periods e.g, 7 days, 15 days.
     Based on that, curve fitting algorithm from scipy calculates beta and gamma values.
 
     Note: Initially, it is assumed that 5% of total population of selected country is under threat of virus and simulation 
     begins once 0.005% (applicable for all countries) of susceptible population is infected.  ''',
-                 style={'text-align': 'center',
-                        'padding': 1,
-                        'background-color': '#FAFFFF',}),
-    
-    dcc.Markdown(''' ''',
-                 style={'text-align': 'center',
-                        'padding': 10,}),
-    
-    html.Div([
-        
-        html.Div([  
-            
-            html.Div([
-               dcc.Markdown('''Country:''')
-            ],
-                style={'width': '45%', 'display': 'inline-block', 'padding-left': 10,}),
+                         style={'text-align': 'center',
+                                'padding': 1,
+                                'background-color': '#FAFFFF',}),
 
-            html.Div([
-                dcc.Markdown('''Susceptible population out of total population:''')
-            ],
-                style={'width': '40%', 'float': 'right', 'display': 'inline-block',})
-        ],
-        style={'width': '60%', 'display': 'inline-block'}
-        ),
-        
-        html.Div([dcc.Markdown('''Period :''', style={'width': '15%', 'float': 'right'})],
-                 style={'width': '40%','float': 'right', 'display': 'inline-block',}
-        ),
-    ]),
-    
-    html.Div([
-        
-        html.Div([
+            dcc.Markdown(''' ''',
+                         style={'text-align': 'center',
+                                'padding': 10,}),
 
             html.Div([
-                dcc.Dropdown(
-                    id='country_drop_down',
-                    options=[{'label': each,'value':each} for each in country_list],
-                    value=['Germany'], # Which is pre-selected
-                    multi=True,
-                    style={'padding-left': 10}
+
+                html.Div([
+
+                    html.Div([
+                       dcc.Markdown('''Country:''')
+                    ],
+                        style={'width': '45%', 'display': 'inline-block', 'padding-left': 10,}),
+
+                    html.Div([
+                        dcc.Markdown('''Susceptible population out of total population:''')
+                    ],
+                        style={'width': '40%', 'float': 'right', 'display': 'inline-block',})
+                ],
+                style={'width': '60%', 'display': 'inline-block'}
                 ),
-                dcc.RadioItems(
-                    id='yaxis-type',
-                    options=[{'label': i, 'value': i} for i in ['Log', 'Linear']],
-                    value='Log',
-                    labelStyle={'display': 'inline-block'},
-                    style={'padding': 10}
-                )
-            ],
-                style={'width': '45%', 'display': 'inline-block'}),
+
+                html.Div([dcc.Markdown('''Period :''', style={'width': '15%', 'float': 'right'})],
+                         style={'width': '40%','float': 'right', 'display': 'inline-block',}
+                ),
+            ]),
 
             html.Div([
-                dcc.Dropdown(
-                    id='susceptible_population_percentage',
-                    options=[{'label': str(number)+'%', 'value': number} for number in range(1,6)],
-                    value=5, # Which is pre-selected
-                    multi=False,
-                    
+
+                html.Div([
+
+                    html.Div([
+                        dcc.Dropdown(
+                            id='country_drop_down',
+                            options=[{'label': each,'value':each} for each in country_list],
+                            value=['Germany'], # Which is pre-selected
+                            multi=True,
+                            style={'padding-left': 10}
+                        ),
+                        dcc.RadioItems(
+                            id='yaxis-type',
+                            options=[{'label': i, 'value': i} for i in ['Log', 'Linear']],
+                            value='Log',
+                            labelStyle={'display': 'inline-block'},
+                            style={'padding': 10}
+                        ),
+                        dcc.Dropdown(
+                            id='xaxis-type',
+                            options=[{'label': 'Timeline', 'value': 'date'}]+
+                                    [{'label': get_threshold_label(each), 'value': each} for each in onset_names],
+                            value='date',
+                            clearable=False,
+                            style={'padding-left': 10}
+                        )
+                    ],
+                        style={'width': '45%', 'display': 'inline-block'}),
+
+                    html.Div([
+                        dcc.Dropdown(
+                            id='susceptible_population_percentage',
+                            options=[{'label': str(number)+'%', 'value': number} for number in range(1,6)],
+                            value=5, # Which is pre-selected
+                            multi=False,
+
+                        ),
+                    ],
+                        style={'width': '40%', 'float': 'right', 'display': 'inline-block'})
+                ],
+                style={'width': '60%', 'display': 'inline-block'}
+
                 ),
-            ],
-                style={'width': '40%', 'float': 'right', 'display': 'inline-block'})
-        ],
-        style={'width': '60%', 'display': 'inline-block'}
-
-        ),
-        
-        html.Div([
-            dcc.Dropdown(
-                id='period-type',
-                options=[{'label': str(each)+' days', 'value': each} for each in ['default', 10, 15, 20, 25, 30]],
-                value='default', # Which is pre-selected
-                multi=False,
-                style={'width': '90%', 'float': 'left'}
-            ),
-        ],
-            style={'width': '15%','float': 'right', 'display': 'inline-block'}
-        ),
-    ]),
-    
-    html.Div([  
-        
-        html.Div([
-            dcc.Graph(figure=fig, id='SIR',)],
-                style={'width': '60%', 'display': 'inline-block', 'padding-left': 10}),
-
-        html.Div([
-            dcc.Markdown('''Beta: infection rate | Gamma: recovery rate | R0: beta/gamma 
+
+                html.Div([
+                    dcc.Dropdown(
+                        id='period-type',
+                        options=[{'label': str(each)+' days', 'value': each} for each in ['default', 10, 15, 20, 25, 30]],
+                        value='default', # Which is pre-selected
+                        multi=False,
+                        style={'width': '90%', 'float': 'left'}
+                    ),
+                ],
+                    style={'width': '15%','float': 'right', 'display': 'inline-block'}
+                ),
+            ]),
+
+            html.Div([
+
+                html.Div([
+                    dcc.Graph(figure=go.Figure(), id='SIR',),
+                    dcc.Store(id='SIR-delta'),
+                    dcc.Store(id='SIR-held')],
+                        style={'width': '60%', 'display': 'inline-block', 'padding-left': 10}),
+
+                html.Div([
+                    dcc.Markdown('''Beta: infection rate | Gamma: recovery rate | R0: beta/gamma
                       
                     ''', style={'padding-top': 10}),
-            
-            html.Table(id='result-summary'),
-            dcc.Markdown('''Note: Table will show data of lastly selected country only.''', style={'padding-top': 15}),
 
+                    html.Table(id='result-summary'),
+                    dcc.Markdown(id='fit-status', style={'padding-top': 10}),
+                    # polls for running background fits, disabled when all fits are done
+                    dcc.Interval(id='fit-poll', interval=500, disabled=True),
+                    dcc.Markdown('''Note: Table will show data of lastly selected country only.''', style={'padding-top': 15}),
+
+                    ],
+
+                        style={'width': '37%', 'float': 'right', 'display': 'inline-block'})
+            ]),
+
+            # what-if scenario, simulated in the browser by assets/sir_scenario.js
+            html.Div([
+                dcc.Markdown('''What-if scenario of the lastly selected country, starting with its last fitted period
+    (dashed: fitted parameters). Drag the sliders to change the infection rate, the recovery rate and the
+    susceptible population:''', style={'padding-top': 20}),
+                html.Div([
+                    dcc.Markdown('''Beta:'''),
+                    dcc.Slider(id='scenario-beta', min=0, max=1, step=0.001, value=0.3, updatemode='drag',
+                               marks={each/10: str(each/10) for each in range(0, 11, 2)}),
+                    dcc.Markdown('''Gamma:'''),
+                    dcc.Slider(id='scenario-gamma', min=0, max=1, step=0.001, value=0.1, updatemode='drag',
+                               marks={each/10: str(each/10) for each in range(0, 11, 2)}),
+                    dcc.Markdown('''Susceptible population (%):'''),
+                    dcc.Slider(id='scenario-percentage', min=0.5, max=20, step=0.5, value=5, updatemode='drag',
+                               marks={each: str(each)+'%' for each in [1, 5, 10, 15, 20]}),
+                ],
+                    style={'width': '30%', 'display': 'inline-block', 'vertical-align': 'top', 'padding': 10}),
+                html.Div([
+                    dcc.Graph(figure=go.Figure(), id='SIR-scenario'),
+                ],
+                    style={'width': '65%', 'display': 'inline-block'}),
+                dcc.Store(id='scenario-seed'),
+                dcc.Store(id='scenario-seeded'),
             ],
-                
-                style={'width': '37%', 'float': 'right', 'display': 'inline-block'})
-    ]),
-
-])
-
-
-@app.callback(
-    [
-        Output(component_id='SIR', component_property='figure'),
-        Output(component_id='result-summary', component_property='children'),
-    ],
-    [
-        Input(component_id='country_drop_down', component_property='value'),
-        Input(component_id='period-type', component_property='value'),
-        Input(component_id='susceptible_population_percentage', component_property='value'),
-        Input(component_id='yaxis-type', component_property='value')
-    ]
-)
-def update_figure(country_list, period, susceptable_perc, yaxis):
-    
+                style={'padding-left': 10}),
+
+        ])
+
+    app.layout = serve_layout
+
+    app.callback(
+        [
+            Output(component_id='SIR-delta', component_property='data'),
+            Output(component_id='result-summary', component_property='children'),
+            Output(component_id='fit-status', component_property='children'),
+            Output(component_id='fit-poll', component_property='disabled'),
+            Output(component_id='scenario-seed', component_property='data'),
+        ],
+        [
+            Input(component_id='country_drop_down', component_property='value'),
+            Input(component_id='period-type', component_property='value'),
+            Input(component_id='susceptible_population_percentage', component_property='value'),
+            Input(component_id='fit-poll', component_property='n_intervals'),
+            Input(component_id='xaxis-type', component_property='value')
+        ],
+        [State(component_id='SIR-held', component_property='data')]
+    )(metrics.timed_callback('SIR', update_figure))
+    # the axis type and the merge of the sent traces run in the browser
+    app.clientside_callback(
+        ClientsideFunction(namespace='figure', function_name='merge'),
+        [Output('SIR', 'figure'), Output('SIR-held', 'data')],
+        [Input('SIR-delta', 'data'), Input('yaxis-type', 'value')],
+        [State('SIR', 'figure')])
+    # the scenario is integrated in the browser, the server only sends the seed
+    app.clientside_callback(
+        ClientsideFunction(namespace='scenario', function_name='seed'),
+        [Output('scenario-beta', 'value'), Output('scenario-gamma', 'value'),
+         Output('scenario-percentage', 'value'), Output('scenario-seeded', 'data')],
+        [Input('scenario-seed', 'data')],
+        [State('scenario-seeded', 'data')])
+    app.clientside_callback(
+        ClientsideFunction(namespace='scenario', function_name='render'),
+        Output('SIR-scenario', 'figure'),
+        [Input('scenario-beta', 'value'), Input('scenario-gamma', 'value'),
+         Input('scenario-percentage', 'value'), Input('yaxis-type', 'value'), Input('scenario-seed', 'data')])
+
+    return app
+
+
+def update_figure(country_list, period, susceptable_perc, n_intervals=None, xaxis='date', held=None):
+    ''' Dash callback: traces missing in the browser and the summary table of the lastly selected country
+
+        Fits run in the background, finished fits are sent by the fit-poll interval
+        until no fit is pending. The delta is merged into the figure by
+        assets/figure_delta.js, which also sets the axis type of the yaxis-type radio,
+        held lists the traces shown for the period, percentage, x axis and data versions.
+
+        Returns:
+        ----------
+        delta: dict
+            context, reset, keys (countries in order), traces, layout, yaxis_fixed
+        table, status, poll disabled
+        seed: dict
+            what-if scenario of the lastly selected country, see get_scenario_seed
+    '''
+    country_list=country_list or []
+    fits, n_pending = request_fits(country_list, period, susceptable_perc,
+                                   record=n_intervals is None or get_triggered_id() != 'fit-poll')
+    df_confirmed=get_data()
+    df_onset=get_aligned_onset(xaxis)
+
+    # a reloaded data set (new fits) or onset index resends all traces
+    context=[period, susceptable_perc, xaxis, provider.version('confirmed_wide'),
+             provider.version('onset_index') if df_onset is not None else None]
+    reset=not held or held.get('context') != context
+    shown=set() if reset else set(held.get('traces', []))
+
+    summary = pd.DataFrame()
     traces = []
-    for pos, each in enumerate(country_list):
-
-        traces.append(dict(x=df_confirmed.date,
-                                y=df_confirmed[each],
-                                mode='lines',
-                                opacity=0.9,
-                                name=each,
-                                line = dict(color = color_list[pos])
-                        )
-                )
-        fit_line, idx, summary = get_optimum_beta_gamma(df_confirmed, each, susceptable_perc=susceptable_perc,
-                                                        period=period)
-        traces.append(dict(x=df_confirmed.date[idx:],
-                                    y=fit_line,
-                                    mode='markers+lines',
-                                    opacity=0.9,
-                                    name=each+'_simulated',
-                                    line = dict(color = color_list[pos])
-                            )
+    for each in country_list:
+        missing=[part for part in ['observed', 'fit'] if each+'|'+part not in shown]
+        country_traces, country_summary=get_country_traces(each, fits.get(each), df_confirmed, df_onset, xaxis)
+        traces+=[trace for trace in country_traces if trace['meta']['part'] in missing]
+        if country_summary is not None:
+            summary=country_summary
+
+    delta={'context': context, 'reset': reset, 'keys': country_list, 'traces': traces,
+           'layout': get_figure_layout('Log', df_onset is not None, xaxis), 'yaxis_fixed': False}
+    seed=None
+    if country_list and fits.get(country_list[-1]) is not None:
+        seed=get_scenario_seed(country_list[-1], fits[country_list[-1]], df_confirmed, period, susceptable_perc)
+    status = 'Fitting '+str(n_pending)+' more countries ...' if n_pending else ''
+    return delta, generate_table(summary), status, n_pending == 0, seed
+
+
+def get_triggered_id():
+    ''' Id of the component which triggered the running dash callback, None outside a callback'''
+    from dash import ctx
+    from dash.exceptions import MissingCallbackContextException
+
+    try:
+        return ctx.triggered_id
+    except MissingCallbackContextException:
+        return None
+
+
+def get_scenario_seed(country, fit, df_confirmed, period, susceptable_perc, horizon=SCENARIO_HORIZON):
+    ''' Initial state and fitted parameters of the what-if scenario
+
+        The scenario starts where SIR_Model starts the fit of the last period with
+        parameters, assets/sir_scenario.js integrates it for the slider values.
+
+        Returns:
+        ----------
+        seed: dict
+            id (country, period, percentage), dates (observed plus horizon days),
+            observed, I0, population, beta, gamma, percentage, period label;
+            None without fitted period or population
+    '''
+    from src.models.SIR_model import SIR_Model, get_periods
+
+    fit_line, idx, summary = fit
+    fitted = np.nonzero(np.isfinite(summary['Beta'].to_numpy(dtype=float)))[0]
+    if not len(fitted):
+        return None
+    n = fitted[-1]
+    first, last = get_periods(df_confirmed, period)[0][n]
+    try:
+        population = load_population()[country]
+        model = SIR_Model(df_confirmed[first:last], country=country, population=population,
+                          percentage=susceptable_perc)
+    except (KeyError, IndexError):
+        return None # no population or the period never reaches the initial infected threshold
+    start = first+model.idx_I0
+
+    dates = pd.DatetimeIndex(df_confirmed.date[start:])
+    dates = dates.append(pd.date_range(dates[-1]+pd.Timedelta(days=1), periods=horizon))
+    return {'id': '|'.join([country, str(period), str(susceptable_perc)]),
+            'country': country,
+            'dates': list(dates.strftime('%Y-%m-%d')),
+            'observed': df_confirmed[country][start:].tolist(),
+            'I0': float(model.I0),
+            'population': float(population),
+            'beta': float(summary['Beta'][n]),
+            'gamma': float(summary['Gamma'][n]),
+            'percentage': susceptable_perc,
+            'period': summary['Time period'][n].strip()}
+
+
+def get_aligned_onset(xaxis):
+    ''' Onset index if xaxis is a threshold of it, else None (timeline)'''
+    df_onset = get_onset_index() if xaxis != 'date' else None
+    return df_onset if df_onset is not None and xaxis in df_onset.columns else None
+
+
+def get_country_traces(each, fit, df_confirmed, df_onset=None, xaxis='date'):
+    ''' Observed and simulated curve of one country, meta identifies them for
+        the clientside merge, the color follows the column of the country
+
+        Returns:
+        ----------
+        traces: list of dict
+            empty if the country did not reach the onset threshold of an aligned x axis
+        summary: pd.DataFrame
+            None without fit
+    '''
+    start, x_values = 0, df_confirmed.date
+    if df_onset is not None:
+        # aligned x axis: the onset is looked up, observed and simulated curves are sliced from it
+        onset = df_onset[xaxis].get(each)
+        if onset is None or onset != onset:
+            return [], None # threshold not reached
+        start = int(df_confirmed.date.searchsorted(onset))
+        x_values = np.arange(len(df_confirmed))-start
+
+    color = color_list[df_confirmed.columns.get_loc(each)-1]
+    traces = [dict(x=x_values[start:],
+                        y=df_confirmed[each][start:],
+                        mode='lines',
+                        opacity=0.9,
+                        name=each,
+                        line = dict(color = color),
+                        meta = dict(key=each, part='observed', order=0)
+                )]
+    if fit is None:
+        return traces, None
+    fit_line, idx, summary = fit
+    traces.append(dict(x=x_values[idx:idx+len(fit_line)],
+                            y=fit_line,
+                            mode='markers+lines',
+                            opacity=0.9,
+                            name=each+'_simulated',
+                            line = dict(color = color),
+                            meta = dict(key=each, part='fit', order=1)
                     )
-        
-    return {
-            'data': traces,
-            'layout': dict (
+            )
+    return traces, summary
+
+
+def get_figure_layout(yaxis, aligned, xaxis='date'):
+    ''' Layout of the SIR figure'''
+    return dict (
                 autosize=True,
                 #width=900,
                 #height=700,
-                xaxis={'title':'Timeline',
+                xaxis={'title':get_threshold_label(xaxis) if aligned else 'Timeline',
                         'tickangle':-25,
                         'nticks':20,
                         'tickfont': 18,
@@ -208,11 +589,54 @@ def update_figure(country_list, period, susceptable_perc, yaxis):
                             x=1)
 
             )
-            
-}, generate_table(summary)
+
+
+def build_figure(country_list, period, susceptable_perc, yaxis, xaxis='date'):
+    ''' Complete figure dict with observed and simulated curves, plus the SIR summary,
+        missing fits are computed in this process (static export)
+
+        Parameters:
+        ----------
+        xaxis: str
+            'date' or a threshold of the onset index, days since the onset
+
+        Returns:
+        ----------
+        figure: dict
+        summary: pd.DataFrame
+    '''
+    from src.models.SIR_model import get_optimum_beta_gamma, get_stored_beta_gamma
+
+    df_confirmed=get_data()
+    table=get_store_table(period, susceptable_perc)
+    fits = {}
+    for each in country_list:
+        if table is not None and each in table:
+            fits[each] = get_stored_beta_gamma(table, each)
+        else:
+            start = time.perf_counter()
+            fits[each] = get_optimum_beta_gamma(df_confirmed, each, susceptable_perc=susceptable_perc,
+                                                period=period, method='sensitivity')
+            metrics.FIT_DURATION.observe(time.perf_counter()-start, country=each)
+
+    df_onset = get_aligned_onset(xaxis)
+    summary = pd.DataFrame()
+    traces = []
+    for each in country_list:
+        country_traces, country_summary = get_country_traces(each, fits[each], df_confirmed, df_onset, xaxis)
+        traces += country_traces
+        if country_summary is not None:
+            summary = country_summary
+
+    figure = {
+            'data': traces,
+            'layout': get_figure_layout(yaxis, df_onset is not None, xaxis)
+    }
+    return figure, summary
+
 
 if __name__ == '__main__':
-    app.run_server(debug=True, 
+    create_app().run_server(debug=True, 
                    use_reloader=False,
                    host='127.0.0.2',
-                   port=8050)
\ No newline at end of file
+                   port=8050)
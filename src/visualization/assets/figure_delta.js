@@ -0,0 +1,36 @@
+// Clientside merge of partial figure updates in visualize.py and SIR_visualize.py
+//
+// The server callbacks only send the traces the browser does not show yet (delta
+// store) and never look at the axis type, switching Log/Linear is handled here.
+// Every trace carries meta.key (country), meta.part and meta.order. The held store
+// returns the context and the ids of the shown traces to the server.
+
+(function () {
+    function getId(trace) {
+        return trace.meta.key + '|' + trace.meta.part;
+    }
+
+    function merge(delta, yaxis, figure) {
+        if (!delta) {
+            return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+        }
+        const incoming = {};
+        delta.traces.forEach(trace => { incoming[getId(trace)] = true; });
+        const position = {};
+        delta.keys.forEach((key, pos) => { position[key] = pos; });
+
+        // keep the shown traces of selected countries which are not replaced by the delta
+        const kept = (delta.reset || !figure || !figure.data) ? [] : figure.data.filter(trace =>
+            trace.meta && trace.meta.key in position && !(getId(trace) in incoming));
+        const data = kept.concat(delta.traces).sort((a, b) =>
+            (position[a.meta.key] - position[b.meta.key]) || (a.meta.order - b.meta.order));
+
+        const layout = JSON.parse(JSON.stringify(delta.layout));
+        if (!delta.yaxis_fixed) {
+            layout.yaxis.type = yaxis === 'Linear' ? 'linear' : 'log';
+        }
+        return [{data: data, layout: layout}, {context: delta.context, traces: data.map(getId)}];
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {figure: {merge: merge}});
+})();
@@ -0,0 +1,76 @@
+// Clientside rendering of the map view in visualize.py
+//
+// The server only sends the values of the selected metric and day (map-values store).
+// The simplified geometry of a region is fetched once per detail level from
+// geometry/<region>/<level>.json (gzip, cached by the browser) and the level
+// follows the zoom of the map. values.geometry is the version of the geometry cache,
+// a rebuilt cache is fetched under a new URL.
+
+(function () {
+    const geometries = {};
+    const state = {region: null, level: null, values: null, scale: 1};
+
+    function getGeometry(region, level, version) {
+        const key = region + '/' + level;
+        if (!(key in geometries) || geometries[key].version !== version) {
+            geometries[key] = {version: version, geometry: fetch('geometry/' + key + '.json?v=' + version)
+                .then(response => response.json())
+                .then(geometry => ({
+                    geojson: geometry,
+                    locations: geometry.features.map(feature => feature.id)
+                }))};
+        }
+        return geometries[key].geometry;
+    }
+
+    function getLevel(scale, levels) {
+        // one level finer for every 4x zoom
+        return Math.min(levels - 1, Math.max(0, Math.floor(Math.log(scale * 2) / Math.log(4))));
+    }
+
+    async function render(values, relayout) {
+        if (!values) {
+            return window.dash_clientside.no_update;
+        }
+        if (relayout && relayout['geo.projection.scale'] !== undefined) {
+            state.scale = relayout['geo.projection.scale'];
+        }
+        if (values.region !== state.region) {
+            state.scale = 1;
+        }
+
+        const level = getLevel(state.scale, values.levels);
+        if (values === state.values && values.region === state.region && level === state.level) {
+            return window.dash_clientside.no_update; // pan or zoom within the same level
+        }
+        state.region = values.region;
+        state.level = level;
+        state.values = values;
+
+        const geometry = await getGeometry(values.region, level, values.geometry);
+        return {
+            data: [{
+                type: 'choropleth',
+                geojson: geometry.geojson,
+                featureidkey: 'id',
+                locations: geometry.locations,
+                z: values.z,
+                zmid: values.zmid,
+                colorscale: values.colorscale,
+                colorbar: {title: {text: values.title}},
+                marker: {line: {width: 0.3, color: 'white'}}
+            }],
+            layout: {
+                title: {text: values.title + ' on ' + String(values.date).slice(0, 10)},
+                geo: {fitbounds: 'locations', visible: false},
+                // keeps zoom and pan when values or the detail level change
+                uirevision: values.region,
+                margin: {l: 0, r: 0, t: 40, b: 0}
+            }
+        };
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        map: {render: render}
+    });
+})();
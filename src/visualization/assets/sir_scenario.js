@@ -0,0 +1,67 @@
+// Clientside what-if scenario of the SIR dashboard (SIR_visualize.py)
+//
+// The server sends the seed of the lastly selected country once (scenario-seed store):
+// initial infected, population and the fitted beta and gamma of its last period.
+// The SIR model of SIR_model.SIR_Model is integrated here with a classic Runge-Kutta
+// scheme on the daily grid, so moving a slider redraws without a server call.
+
+(function () {
+    const SUBSTEPS = 4; // Runge-Kutta steps per day
+
+    function simulate(I0, N0, beta, gamma, days) {
+        // same equations as SIR_Model.calculate_SIR, infected of every day
+        const derivative = (S, I) => [-beta * S * I / N0, beta * S * I / N0 - gamma * I];
+        const h = 1 / SUBSTEPS;
+        let S = Math.max(N0 - I0, 0), I = I0;
+        const infected = [I];
+        for (let day = 1; day < days; day++) {
+            for (let step = 0; step < SUBSTEPS; step++) {
+                const k1 = derivative(S, I);
+                const k2 = derivative(S + h / 2 * k1[0], I + h / 2 * k1[1]);
+                const k3 = derivative(S + h / 2 * k2[0], I + h / 2 * k2[1]);
+                const k4 = derivative(S + h * k3[0], I + h * k3[1]);
+                S += h / 6 * (k1[0] + 2 * k2[0] + 2 * k3[0] + k4[0]);
+                I += h / 6 * (k1[1] + 2 * k2[1] + 2 * k3[1] + k4[1]);
+            }
+            infected.push(I);
+        }
+        return infected;
+    }
+
+    function seed(data, seeded) {
+        // sliders follow a new seed only, not every resend of the same one
+        const no_update = window.dash_clientside.no_update;
+        if (!data || data.id === seeded) {
+            return [no_update, no_update, no_update, no_update];
+        }
+        return [data.beta, data.gamma, data.percentage, data.id];
+    }
+
+    function render(beta, gamma, percentage, yaxis, data) {
+        if (!data) {
+            return {data: [], layout: {title: 'No fitted period of the selected country'}};
+        }
+        const days = data.dates.length;
+        const scenario = simulate(data.I0, percentage / 100 * data.population, beta, gamma, days);
+        const fitted = simulate(data.I0, data.percentage / 100 * data.population, data.beta, data.gamma, days);
+        const R0 = gamma > 0 ? (beta / gamma).toFixed(2) : '-';
+        return {
+            data: [
+                {x: data.dates.slice(0, data.observed.length), y: data.observed, mode: 'markers',
+                 name: data.country, opacity: 0.7},
+                {x: data.dates, y: fitted, mode: 'lines', line: {dash: 'dash'}, name: 'fitted'},
+                {x: data.dates, y: scenario, mode: 'lines', name: 'scenario'}
+            ],
+            layout: {
+                title: data.country + ' | ' + data.period + ' | R0 = ' + R0,
+                xaxis: {title: 'Timeline', tickangle: -25, nticks: 20},
+                yaxis: {type: yaxis === 'Linear' ? 'linear' : 'log', title: 'Number of infected people'},
+                legend: {orientation: 'h', yanchor: 'bottom', y: 1.02, xanchor: 'right', x: 1},
+                autosize: true
+            }
+        };
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside,
+                                           {scenario: {seed: seed, render: render, simulate: simulate}});
+})();
@@ -0,0 +1,232 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import pandas as pd
+
+from src.visualization import visualize, SIR_visualize
+from src.data.data_access import get_path
+
+
+EXPORT_DIR = get_path('reports/static')
+METRICS = ['confirmed', 'confirmed_filtered', 'confirmed_DR', 'confirmed_filtered_DR', 'confirmed_Rt']
+YAXIS_TYPES = ['Log', 'Linear']
+SIR_PERIODS = ['default', 10, 15, 20, 25, 30]
+SIR_PERCENTAGES = [1, 2, 3, 4, 5]
+
+
+def slugify(name):
+    ''' File system safe name of a country e.g. 'Korea, South' -> 'Korea__South' '''
+    return re.sub(r'[^A-Za-z0-9_-]', '_', name)
+
+
+def get_series_hashes(countries):
+    ''' Hash of the underlying data of every country, changes trigger a rebuild
+
+        Returns:
+        ----------
+        hashes: dict country -> {'visualize': str, 'SIR': str}
+    '''
+    df_input_large = visualize.get_data()
+    df_confirmed = SIR_visualize.get_data()
+
+    hashes = {}
+    for each in countries:
+        df_country = df_input_large[df_input_large['country'] == each]
+        hashes[each] = {
+            'visualize': hashlib.sha1(pd.util.hash_pandas_object(df_country, index=False).values).hexdigest(),
+            'SIR': hashlib.sha1(pd.util.hash_pandas_object(df_confirmed[each], index=False).values).hexdigest()
+                   if each in df_confirmed.columns else None,
+        }
+    return hashes
+
+
+def write_payload(file_path, figure, images=False):
+    ''' Pre-serialized gzip JSON of a figure dict, optionally a png next to it'''
+    from plotly.utils import PlotlyJSONEncoder
+
+    with gzip.open(file_path, 'wt', compresslevel=9) as f:
+        json.dump(figure, f, cls=PlotlyJSONEncoder, separators=(',', ':'))
+
+    if images:
+        import plotly.io as pio
+        try:
+            pio.write_image(figure, file_path.replace('.json.gz', '.png'), width=1200, height=700)
+        except (ValueError, ImportError) as err: # kaleido not installed
+            print('image export skipped: '+str(err))
+
+
+def export_country(country, dashboards, export_dir, sir_periods, sir_percentages, images):
+    ''' All figure payloads of one country (runs in a worker process)
+
+        Returns:
+        ----------
+        files: list of str
+            written files relative to export_dir
+    '''
+    files = []
+    slug = slugify(country)
+
+    if 'visualize' in dashboards:
+        os.makedirs(os.path.join(export_dir, 'visualize', slug), exist_ok=True)
+        for metric in METRICS:
+            for yaxis in YAXIS_TYPES:
+                name = os.path.join('visualize', slug, metric+'_'+yaxis+'.json.gz')
+                write_payload(os.path.join(export_dir, name), visualize.update_figure([country], metric, yaxis), images)
+                files.append(name)
+
+    if 'SIR' in dashboards:
+        os.makedirs(os.path.join(export_dir, 'SIR', slug), exist_ok=True)
+        for period in sir_periods:
+            for perc in sir_percentages:
+                try:
+                    figure, summary = SIR_visualize.build_figure([country], period, perc, 'Log')
+                except (IndexError, KeyError, ValueError, RuntimeError):
+                    continue # not enough infected people or no population for this country
+                figure['summary'] = summary.to_dict(orient='records')
+                for yaxis in YAXIS_TYPES:
+                    figure['layout']['yaxis']['type'] = 'linear' if yaxis == 'Linear' else 'log'
+                    name = os.path.join('SIR', slug, str(period)+'_'+str(perc)+'_'+yaxis+'.json.gz')
+                    write_payload(os.path.join(export_dir, name), figure, images)
+                    files.append(name)
+
+    return files
+
+
+def write_index(export_dir, manifest):
+    ''' Static index.html, loads and decompresses the payloads in the browser'''
+    entries = {country: {'slug': value['slug'], 'files': value['files']}
+               for country, value in sorted(manifest['countries'].items())}
+    html = INDEX_TEMPLATE.replace('__ENTRIES__', json.dumps(entries)) \
+                         .replace('__UPDATED__', manifest['updated'])
+    with open(os.path.join(export_dir, 'index.html'), 'w') as f:
+        f.write(html)
+
+
+def export_all(export_dir=EXPORT_DIR, dashboards=('visualize', 'SIR'), countries=None,
+               sir_periods=SIR_PERIODS, sir_percentages=SIR_PERCENTAGES,
+               images=False, force=False, n_workers=None):
+    ''' Export all figure payloads, only countries with changed data are rebuilt
+
+        Parameters:
+        ----------
+        export_dir: str
+        dashboards: tuple of 'visualize', 'SIR'
+        countries: list of str
+            default all countries of the processed data set
+        sir_periods, sir_percentages: list
+            SIR dashboard options to export
+        images: bool
+            additionally write png files (needs kaleido)
+        force: bool
+            rebuild all entries
+        n_workers: int
+
+        Returns:
+        ----------
+        rebuilt: list of str
+            countries which were exported
+    '''
+    os.makedirs(export_dir, exist_ok=True)
+    manifest_path = os.path.join(export_dir, 'manifest.json')
+    manifest = {'countries': {}}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    if countries is None:
+        countries = list(visualize.get_data()['country'].unique())
+    hashes = get_series_hashes(countries)
+
+    options = {'dashboards': list(dashboards), 'sir_periods': [str(each) for each in sir_periods],
+               'sir_percentages': list(sir_percentages)}
+    rebuild = [each for each in countries
+               if manifest['countries'].get(each, {}).get('hashes') != hashes[each]
+               or manifest['countries'][each].get('options') != options]
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = {each: pool.submit(export_country, each, dashboards, export_dir,
+                                     sir_periods, sir_percentages, images) for each in rebuild}
+        for each, future in futures.items():
+            manifest['countries'][each] = {'slug': slugify(each), 'hashes': hashes[each],
+                                           'options': options, 'files': future.result()}
+
+    manifest['updated'] = pd.Timestamp.now().isoformat(timespec='seconds')
+    with open(manifest_path+'.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path+'.tmp', manifest_path)
+    write_index(export_dir, manifest)
+
+    return rebuild
+
+
+INDEX_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Applied Data Science on COVID-19 data</title>
+<script src="https://cdn.plot.ly/plotly-basic-latest.min.js"></script>
+<style>
+body {font-family: sans-serif; margin: 0;}
+h1 {text-align: center; color: white; padding: 10px; background-color: #25383C; margin: 0;}
+#controls {padding: 10px;}
+select {margin-right: 10px;}
+</style>
+</head>
+<body>
+<h1>Applied Data Science on COVID-19 data</h1>
+<div id="controls">
+  <select id="country"></select>
+  <select id="file"></select>
+  <span>updated __UPDATED__</span>
+</div>
+<div id="graph" style="height: 700px;"></div>
+<script>
+const entries = __ENTRIES__;
+const country = document.getElementById('country');
+const file = document.getElementById('file');
+
+async function load(path) {
+  const response = await fetch(path);
+  const stream = response.body.pipeThrough(new DecompressionStream('gzip'));
+  const figure = JSON.parse(await new Response(stream).text());
+  Plotly.react('graph', figure.data, figure.layout);
+}
+function fillFiles() {
+  file.innerHTML = entries[country.value].files
+      .map(each => '<option value="' + each + '">' + each.split('/').slice(-2).join(' / ') + '</option>').join('');
+  load(file.value);
+}
+country.innerHTML = Object.keys(entries).map(each => '<option>' + each + '</option>').join('');
+country.onchange = fillFiles;
+file.onchange = () => load(file.value);
+fillFiles();
+</script>
+</body>
+</html>
+'''
+
+
+@click.command()
+@click.option('--export-dir', default=EXPORT_DIR)
+@click.option('--dashboard', 'dashboards', multiple=True, default=['visualize', 'SIR'],
+              type=click.Choice(['visualize', 'SIR']))
+@click.option('--country', 'countries', multiple=True, help='restrict the export to some countries')
+@click.option('--images', is_flag=True, help='write png images as well (needs kaleido)')
+@click.option('--force', is_flag=True, help='rebuild all entries')
+@click.option('--workers', default=None, type=int)
+def main(export_dir, dashboards, countries, images, force, workers):
+    """ Exports the dashboard figures as compressed JSON plus a static index.html.
+    """
+    rebuilt = export_all(export_dir, dashboards, list(countries) or None,
+                         images=images, force=force, n_workers=workers)
+    print('exported '+str(len(rebuilt))+' countries to '+export_dir)
+
+
+if __name__ == '__main__':
+    main()
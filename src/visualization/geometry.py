@@ -0,0 +1,277 @@
+import os
+import sys
+import gzip
+import json
+import tempfile
+import threading
+
+import numpy as np
+
+from src.data.data_access import get_path
+
+
+GEOMETRY_DIR = get_path('data/processed/geometry')
+
+# name -> (source GeoJSON, property identifying a feature)
+GEOMETRY_SOURCES = {
+    'districts': (get_path('data/raw/NPGEO/GER_districts.geojson'), 'RS'),
+    'countries': (get_path('data/external/countries.geojson'), 'ADMIN'),
+}
+
+# tolerance of each level as fraction of the larger side of the bounding box (coarse to fine)
+LEVELS = [1/400, 1/1600, 1/6400]
+
+# vertices closer than 1e-6 degrees are treated as the same point
+PRECISION = 6
+
+# one rebuild of a cache at a time, concurrent requests wait for it
+build_lock = threading.Lock()
+
+
+def read_features(source_path, key_property):
+    ''' Polygons of a GeoJSON FeatureCollection
+
+        Returns:
+        ----------
+        keys: list of str
+        polygons: list (per feature) of polygons, a polygon is a list of rings (np.array n x 2)
+    '''
+    with open(source_path) as f:
+        collection = json.load(f)
+
+    keys, polygons = [], []
+    for feature in collection['features']:
+        geometry = feature.get('geometry')
+        if not geometry:
+            continue
+        parts = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+        keys.append(str(feature['properties'][key_property]))
+        polygons.append([[np.round(np.asarray(ring, dtype=float)[:, :2], PRECISION) for ring in part] for part in parts])
+    return keys, polygons
+
+
+def build_arcs(polygons):
+    ''' Split all rings into arcs shared between neighbouring rings (TopoJSON style)
+
+        A vertex is a junction where the set of rings using the incoming edge differs
+        from the set using the outgoing edge. Rings are cut at junctions, every border
+        between two regions becomes one arc stored once. Simplifying arcs with fixed
+        end points keeps neighbours gap free.
+
+        Returns:
+        ----------
+        arcs: list of np.array (n x 2)
+        topology: like polygons, rings are lists of (arc index, reversed)
+    '''
+    rings = []
+    for feature in polygons:
+        for polygon in feature:
+            for ring in polygon:
+                points = [tuple(each) for each in ring]
+                if points[0] == points[-1]:
+                    points = points[:-1]
+                points = [each for pos, each in enumerate(points) if each != points[pos-1]] or points[:1]
+                rings.append(points)
+
+    owners = {}
+    for ring_id, points in enumerate(rings):
+        for pos in range(len(points)):
+            edge = tuple(sorted((points[pos], points[(pos+1) % len(points)])))
+            owners.setdefault(edge, set()).add(ring_id)
+
+    arcs, arc_index, ring_arcs = [], {}, []
+    for points in rings:
+        n = len(points)
+        edge_owners = [owners[tuple(sorted((points[pos], points[(pos+1) % n])))] for pos in range(n)]
+        junctions = [pos for pos in range(n) if edge_owners[pos-1] != edge_owners[pos]]
+        if not junctions:
+            # ring shares all or nothing, start at the smallest vertex so the arc is found again
+            junctions = [min(range(n), key=lambda pos: points[pos])]
+
+        refs = []
+        for pos, start in enumerate(junctions):
+            end = junctions[(pos+1) % len(junctions)]
+            length = (end-start) % n or n
+            arc = tuple(points[(start+step) % n] for step in range(length+1))
+            reverse = arc[::-1] < arc
+            key = arc[::-1] if reverse else arc
+            if key not in arc_index:
+                arc_index[key] = len(arcs)
+                arcs.append(np.array(key))
+            refs.append((arc_index[key], reverse))
+        ring_arcs.append(refs)
+
+    topology, pos = [], 0
+    for feature in polygons:
+        topology.append([])
+        for polygon in feature:
+            topology[-1].append(ring_arcs[pos:pos+len(polygon)])
+            pos += len(polygon)
+    return arcs, topology
+
+
+def douglas_peucker(points, tolerance):
+    ''' Indices of the points kept by the Douglas-Peucker algorithm (end points are always kept)'''
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points)-1)]
+    while stack:
+        start, end = stack.pop()
+        if end-start < 2:
+            continue
+        segment = points[end]-points[start]
+        relative = points[start+1:end]-points[start]
+        length = np.hypot(*segment)
+        if length == 0: # closed arc, distance to the start point
+            distance = np.hypot(relative[:, 0], relative[:, 1])
+        else:
+            distance = np.abs(segment[0]*relative[:, 1]-segment[1]*relative[:, 0])/length
+        farthest = int(np.argmax(distance))
+        if distance[farthest] > tolerance:
+            split = start+1+farthest
+            keep[split] = True
+            stack += [(start, split), (split, end)]
+    return np.nonzero(keep)[0]
+
+
+def assemble(arcs, topology, decimals):
+    ''' MultiPolygon coordinates per feature from (simplified) arcs
+
+        Rings collapsed below 3 distinct points are dropped, a feature without any
+        remaining polygon keeps its exterior rings at full resolution.
+    '''
+    def ring_points(refs, arcs):
+        points = []
+        for arc_id, reverse in refs:
+            arc = arcs[arc_id][::-1] if reverse else arcs[arc_id]
+            points.append(arc if not points else arc[1:])
+        return np.vstack(points)
+
+    result = []
+    for feature in topology:
+        parts = []
+        for polygon in feature:
+            rings = [np.round(ring_points(refs, arcs), decimals) for refs in polygon]
+            if len(np.unique(rings[0], axis=0)) < 3:
+                continue # exterior ring collapsed, holes are dropped with it
+            parts.append([ring.tolist() for ring in rings if len(np.unique(ring, axis=0)) >= 3])
+        result.append(parts)
+    return result
+
+
+def build_geometry_cache(name, source_path=None, key_property=None, levels=LEVELS, geometry_dir=GEOMETRY_DIR):
+    ''' Simplify a geometry source once per detail level and store compact GeoJSON
+
+        Files:
+        ----------
+        <name>/index.json:      keys in feature order, levels with tolerance and size
+        <name>/<level>.json.gz: FeatureCollection, feature id = key, no properties
+
+        Returns:
+        ----------
+        index: dict
+    '''
+    if source_path is None:
+        source_path, key_property = GEOMETRY_SOURCES[name]
+
+    keys, polygons = read_features(source_path, key_property)
+    arcs, topology = build_arcs(polygons)
+    all_points = np.vstack(arcs)
+    extent = float(np.max(all_points.max(axis=0)-all_points.min(axis=0)))
+    full = assemble(arcs, topology, PRECISION)
+
+    target_dir = os.path.join(geometry_dir, name)
+    os.makedirs(target_dir, exist_ok=True)
+    index = {'source': source_path, 'source_mtime_ns': os.stat(source_path).st_mtime_ns,
+             'keys': keys, 'levels': []}
+    for level, fraction in enumerate(levels):
+        tolerance = extent*fraction
+        simplified = [arc[douglas_peucker(arc, tolerance)] for arc in arcs]
+        # coordinates are rounded to a tenth of the tolerance
+        decimals = int(min(PRECISION, max(0, np.ceil(-np.log10(tolerance/10)))))
+        coordinates = assemble(simplified, topology, decimals)
+        features = [{'type': 'Feature', 'id': key, 'properties': {},
+                     'geometry': {'type': 'MultiPolygon', 'coordinates': parts or fallback}}
+                    for key, parts, fallback in zip(keys, coordinates, full)]
+
+        file_path = os.path.join(target_dir, str(level)+'.json.gz')
+        handle, tmp_path = tempfile.mkstemp(dir=target_dir) # other processes may build at the same time
+        with gzip.open(os.fdopen(handle, 'wb'), 'wt', compresslevel=9) as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f, separators=(',', ':'))
+        os.replace(tmp_path, file_path)
+        index['levels'].append({'tolerance': tolerance, 'decimals': decimals,
+                                'points': int(sum(len(each) for each in simplified)),
+                                'bytes': os.path.getsize(file_path)})
+
+    # written last, a reader never sees an index of levels which are not written yet
+    handle, tmp_path = tempfile.mkstemp(dir=target_dir)
+    with os.fdopen(handle, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(target_dir, 'index.json'))
+    return index
+
+
+def load_geometry_index(name, geometry_dir=GEOMETRY_DIR):
+    ''' Index of a geometry cache, rebuilt if the source file changed
+
+        Called from request callbacks, concurrent requests wait for one rebuild.
+
+        Returns:
+        ----------
+        index: dict or None if neither cache nor source exist
+    '''
+    index = _read_geometry_index(name, geometry_dir)
+    if _is_outdated(name, index):
+        with build_lock:
+            index = _read_geometry_index(name, geometry_dir) # rebuilt by a concurrent request
+            if _is_outdated(name, index):
+                index = build_geometry_cache(name, geometry_dir=geometry_dir)
+    return index
+
+
+def _read_geometry_index(name, geometry_dir):
+    try:
+        with open(os.path.join(geometry_dir, name, 'index.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _is_outdated(name, index):
+    source_path = GEOMETRY_SOURCES[name][0]
+    return os.path.exists(source_path) and (index is None or index['source_mtime_ns'] != os.stat(source_path).st_mtime_ns)
+
+
+def get_geometry_path(name, level, geometry_dir=GEOMETRY_DIR):
+    return os.path.join(geometry_dir, name, str(int(level))+'.json.gz')
+
+
+def get_uncompressed_geometry(name, level, geometry_dir=GEOMETRY_DIR):
+    ''' Path of an uncompressed copy of a cached level, written on first use and
+        whenever the compressed level was rebuilt after it
+
+        Returns:
+        ----------
+        file_path: str
+    '''
+    source_path = get_geometry_path(name, level, geometry_dir)
+    file_path = source_path[:-len('.gz')]
+    if not os.path.exists(file_path) or os.stat(file_path).st_mtime_ns < os.stat(source_path).st_mtime_ns:
+        with gzip.open(source_path, 'rb') as f:
+            content = f.read()
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path)) # requests may race here
+        with os.fdopen(handle, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, file_path)
+    return file_path
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or GEOMETRY_SOURCES:
+        if not os.path.exists(GEOMETRY_SOURCES[name][0]):
+            print(name+': source '+GEOMETRY_SOURCES[name][0]+' not found')
+            continue
+        index = build_geometry_cache(name)
+        print(name+': '+str(len(index['keys']))+' features, '+
+              ', '.join('level {}: {} points {:.0f} kB'.format(pos, each['points'], each['bytes']/1024)
+                        for pos, each in enumerate(index['levels'])))
@@ -0,0 +1,199 @@
+import time
+import hashlib
+import threading
+import functools
+
+from collections import OrderedDict
+
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+BYTES_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{'+','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for key, value in labels)+'}'
+
+
+class Metric():
+    '''Base of counters, gauges and histograms, one value (set) per label combination'''
+
+    kind = None
+
+    def __init__(self, name, documentation, registry):
+
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines += self._render_value(labels, value)
+        return lines
+
+    def _render_value(self, labels, value):
+        return ['{}{} {}'.format(self.name, _format_labels(labels), repr(float(value)))]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0)+amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, registry, buckets=LATENCY_BUCKETS):
+
+        self.buckets = list(buckets)
+        super().__init__(name, documentation, registry)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, n = self._values.get(key, ([0]*len(self.buckets), 0.0, 0))
+            counts = [count+(value <= bound) for count, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total+value, n+1)
+
+    def _render_value(self, labels, value):
+        counts, total, n = value
+        lines = ['{}_bucket{} {}'.format(self.name, _format_labels(labels+(('le', repr(float(bound))),)), count)
+                 for bound, count in zip(self.buckets, counts)]
+        lines.append('{}_bucket{} {}'.format(self.name, _format_labels(labels+(('le', '+Inf'),)), n))
+        lines.append('{}_sum{} {}'.format(self.name, _format_labels(labels), repr(float(total))))
+        lines.append('{}_count{} {}'.format(self.name, _format_labels(labels), n))
+        return lines
+
+    def time(self, **labels):
+        ''' Decorator measuring the duration of every call'''
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter()-start, **labels)
+            return wrapper
+        return decorator
+
+
+class Registry():
+    '''Collection of metrics rendered in the Prometheus text exposition format'''
+
+    def __init__(self):
+
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines)+'\n'
+
+
+REGISTRY = Registry()
+
+CALLBACK_DURATION = Histogram('dashboard_callback_duration_seconds',
+                              'Duration of dash callbacks.', REGISTRY)
+REQUEST_DURATION = Histogram('dashboard_http_request_duration_seconds',
+                             'Duration of HTTP requests by path.', REGISTRY)
+RESPONSE_BYTES = Histogram('dashboard_response_bytes',
+                           'Size of HTTP responses by path.', REGISTRY, buckets=BYTES_BUCKETS)
+REQUESTS = Counter('dashboard_requests_total',
+                   'HTTP requests by path and status.', REGISTRY)
+REPEATED_REQUESTS = Counter('dashboard_repeated_requests_total',
+                            'Callback requests with a payload seen before (cache potential).', REGISTRY)
+FIT_DURATION = Histogram('dashboard_sir_fit_duration_seconds',
+                         'Duration of the SIR fit of one country.', REGISTRY)
+CACHE_REQUESTS = Counter('dashboard_cache_requests_total',
+                         'Cache lookups by cache and result (hit/miss).', REGISTRY)
+DATA_MEMORY = Gauge('dashboard_data_memory_bytes',
+                    'Memory of the loaded data sets.', REGISTRY)
+
+# payload hashes of recent callback requests, used for REPEATED_REQUESTS
+recent_payloads = OrderedDict()
+recent_lock = threading.Lock()
+RECENT_PAYLOADS = 10000
+
+
+def record_data_memory(app_name, dataset, df_input):
+    ''' Set the memory gauge of a loaded pd.DataFrame'''
+    DATA_MEMORY.set(int(df_input.memory_usage(deep=True).sum()), app=app_name, dataset=dataset)
+
+
+def timed_callback(app_name, function):
+    ''' Wrap a dash callback so its latency is recorded'''
+    return CALLBACK_DURATION.time(app=app_name, callback=function.__name__)(function)
+
+
+def _is_repeated(payload):
+    digest = hashlib.sha1(payload).hexdigest()
+    with recent_lock:
+        if digest in recent_payloads:
+            recent_payloads.move_to_end(digest)
+            return True
+        recent_payloads[digest] = True
+        if len(recent_payloads) > RECENT_PAYLOADS:
+            recent_payloads.popitem(last=False)
+    return False
+
+
+def instrument_app(app, app_name):
+    ''' Record latency, size and repetition of all requests of a dash app and
+        expose all metrics on /metrics
+
+        Parameters:
+        ----------
+        app: dash.Dash
+        app_name: str
+            label value to distinguish the dashboards
+    '''
+    from flask import g, request, Response
+
+    server = app.server
+
+    @server.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        if request.path.endswith('_dash-update-component'):
+            if _is_repeated(request.get_data()):
+                REPEATED_REQUESTS.inc(app=app_name)
+
+    @server.after_request
+    def record_request(response):
+        path = request.path if request.path.startswith('/_dash') or request.path in ('/', '/metrics') else 'other'
+        if 'metrics_start' in g:
+            REQUEST_DURATION.observe(time.perf_counter()-g.metrics_start, app=app_name, path=path)
+        if not response.direct_passthrough:
+            RESPONSE_BYTES.observe(response.calculate_content_length() or 0, app=app_name, path=path)
+        REQUESTS.inc(app=app_name, path=path, status=response.status_code)
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    return app
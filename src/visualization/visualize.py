@@ -1,145 +1,462 @@
-import pandas as pd
+import os
+import threading
+
 import numpy as np
 
-import dash
-dash.__version__
-import dash_core_components as dcc
-import dash_html_components as html
-from dash.dependencies import Input, Output,State
+from src.data.data_access import get_path, load_final_set, load_district_set, load_onset_index, \
+                                 FINAL_SET, DISTRICT_SET, ONSET_INDEX
+from src.data.data_provider import DataProvider
+from src.visualization import metrics
+from src.visualization.geometry import GEOMETRY_SOURCES, load_geometry_index, get_geometry_path, \
+    get_uncompressed_geometry
+from src.features.onset_index import get_threshold_label
+from src.features.series_matrix import get_similarity_keys
+from src.models.similarity import build_similarity_index
 
-import plotly.graph_objects as go
+# dash and plotly are imported in create_app, so the data helpers and
+# update_figure can be used (e.g. for exports) without loading them
 
-import os
-print(os.getcwd())
-df_input_large=pd.read_csv('data/processed/COVID_final_set.csv',sep=';')
+# data sets are replaced in the running app when build_features publishes a new version
+provider=DataProvider()
+
+# map view: per (region, metric) the geometry version, the dates and a (features x dates)
+# matrix aligned with the geometry keys
+map_frames={}
+MAP_REGIONS={'districts': 'German districts (NPGEO)', 'countries': 'Countries'}
+MAP_METRICS={'confirmed': 'Confirmed (log10)', 'confirmed_filtered_DR': 'Doubling rate filtered',
+             'confirmed_Rt': 'Effective reproduction number Rt'}
+# Johns Hopkins country names -> ADMIN property of the Natural Earth country polygons
+COUNTRY_ALIASES={'US': 'United States of America', 'Korea, South': 'South Korea', 'Taiwan*': 'Taiwan',
+                 'Czechia': 'Czech Republic', 'Congo (Kinshasa)': 'Democratic Republic of the Congo',
+                 'Congo (Brazzaville)': 'Republic of Congo', "Cote d'Ivoire": 'Ivory Coast', 'Burma': 'Myanmar',
+                 'Tanzania': 'United Republic of Tanzania', 'Serbia': 'Republic of Serbia',
+                 'North Macedonia': 'Macedonia', 'Eswatini': 'eSwatini', 'Bahamas': 'The Bahamas',
+                 'Timor-Leste': 'East Timor', 'Guinea-Bissau': 'Guinea Bissau'}
+
+# similarity panel: DTW envelope index of all countries and states, built by the first
+# similarity request of a data version (one build at a time)
+similarity_index={}
+similarity_lock=threading.Lock()
+
+
+def read_final_set(file_path):
+    df_input_large=load_final_set()
+    metrics.record_data_memory('visualize', 'COVID_final_set', df_input_large)
+    return df_input_large
+
+
+def read_district_set(file_path):
+    df_districts=load_district_set()
+    metrics.record_data_memory('visualize', 'COVID_final_set_GER', df_districts)
+    return df_districts
+
+
+def invalidate_map_frames(region):
+    for key in [each for each in map_frames if each[0] == region]:
+        map_frames.pop(key, None)
+
+
+provider.register('final_set', get_path(FINAL_SET), read_final_set)
+provider.register('districts', get_path(DISTRICT_SET), read_district_set)
+provider.register('onset_index', get_path(ONSET_INDEX), lambda file_path: load_onset_index())
+provider.on_swap('final_set', lambda: invalidate_map_frames('countries'))
+provider.on_swap('final_set', similarity_index.clear)
+provider.on_swap('onset_index', similarity_index.clear)
+provider.on_swap('districts', lambda: invalidate_map_frames('districts'))
+
+
+def get_data():
+    ''' Processed data set, read on first use
+
+        A request should call it once and keep the result, so it works on
+        one version even if a reload happens meanwhile.
+
+        Returns:
+        ----------
+        df_input_large: pd.DataFrame
+    '''
+    return provider.get('final_set')
+
+
+def get_district_data():
+    ''' District features built by build_features.py --germany, read on first use'''
+    return provider.get('districts')
+
+
+def get_onset_index():
+    ''' Onset dates per series and threshold stored by build_features.py, None if missing'''
+    try:
+        return provider.get('onset_index')
+    except FileNotFoundError:
+        return None
+
+
+def get_similarity_index():
+    ''' SimilarityIndex of the current data set, built on first use, concurrent
+        requests wait for the running build instead of starting their own'''
+    df_input_large=get_data()
+    entry=similarity_index.get('final_set')
+    if entry is None or entry[0] is not df_input_large:
+        with similarity_lock:
+            entry=similarity_index.get('final_set')
+            if entry is None or entry[0] is not df_input_large:
+                entry=(df_input_large, build_similarity_index(df_input_large, get_onset_index()))
+                similarity_index['final_set']=entry
+    return entry[1]
+
+
+def get_map_regions():
+    ''' Regions with a geometry cache and a data set'''
+    data_files={'districts': get_path(DISTRICT_SET), 'countries': get_path(FINAL_SET)}
+    return [each for each in MAP_REGIONS
+            if os.path.exists(data_files[each]) and load_geometry_index(each) is not None]
+
+
+def get_map_matrix(region, metric, index=None):
+    ''' Values of a metric for all features of a region and all dates
+
+        The matrix is rebuilt if the geometry cache was rebuilt (source file changed)
+        since its rows follow the feature order of the cache.
+
+        Parameters:
+        ----------
+        index: dict
+            geometry index of the region, default load_geometry_index(region)
+
+        Returns:
+        ----------
+        dates: list of str
+        matrix: np.array (features x dates), rows in the order of the geometry keys
+    '''
+    index=index or load_geometry_index(region)
+    entry=map_frames.get((region, metric))
+    if entry is None or entry[0] != index['source_mtime_ns']:
+        keys=index['keys']
+        if region == 'districts':
+            df_map=get_district_data().rename(columns={'RS': 'key'})
+        else:
+            df_map=get_data().copy()
+            df_map['key']=df_map['country'].replace(COUNTRY_ALIASES)
+        aggregate='sum' if metric == 'confirmed' else 'mean'
+        column=metric
+        if region == 'countries' and metric == 'confirmed_Rt':
+            column, aggregate='confirmed_country_Rt', 'first' # Rt of the summed counts, see calc_country_Rt
+        df_wide=df_map.groupby(['key', 'date'])[column].agg(aggregate).unstack('date')
+        entry=(index['source_mtime_ns'], list(df_wide.columns), df_wide.reindex(keys).to_numpy(dtype=np.float32))
+        map_frames[(region, metric)]=entry
+    return entry[1:]
+
+
+def get_map_values(region, metric, date_pos):
+    ''' Values array of one date, the geometry is loaded by the browser separately
 
+        Returns:
+        ----------
+        values: dict
+            z aligned with the features of the geometry cache plus colorbar settings
+    '''
+    index=load_geometry_index(region)
+    dates, matrix=get_map_matrix(region, metric, index)
+    date_pos=min(int(date_pos if date_pos is not None else len(dates)-1), len(dates)-1)
+    z=matrix[:, date_pos].astype(np.float64)
+    if metric == 'confirmed':
+        z=np.log10(np.where(z > 0, z, np.nan))
+
+    return {'region': region,
+            'levels': len(index['levels']),
+            'geometry': index['source_mtime_ns'],
+            'date': dates[date_pos],
+            'title': MAP_METRICS[metric],
+            'z': [None if np.isnan(each) else round(float(each), 3) for each in z],
+            'zmid': 1 if metric == 'confirmed_Rt' else None,
+            'colorscale': 'RdBu_r' if metric == 'confirmed_Rt' else 'Viridis'}
 
-fig = go.Figure()
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-
-app.layout = html.Div([
-    
-    html.H1('Applied Data Science on COVID-19 data', style={'text-align': 'center',
-                                                                        'color': 'white',
-                                                                        'padding': 10,
-                                                                        'background-color': '#25383C',}),
-    dcc.Markdown('''Goal of the project is to analyse and learn patterns in COVID-19 dataset from different 
+
+
+def create_app():
+    ''' Build the dash app with layout and callbacks
+
+        Returns:
+        ----------
+        app: dash.Dash
+    '''
+    import dash
+    import dash_core_components as dcc
+    import dash_html_components as html
+    from dash.dependencies import Input, Output,State, ClientsideFunction
+
+    import plotly.graph_objects as go
+
+    get_data()
+    provider.start()
+
+    app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+    metrics.instrument_app(app, 'visualize')
+
+    # map view, only shown if a geometry cache and the matching data set exist
+    regions=get_map_regions()
+    map_section=[] if not regions else [
+        dcc.Markdown('''Map of the selected metric and day:''', style={'padding-left': 10, 'font-size':18}),
+        html.Div([
+            dcc.Dropdown(
+                id='map-region',
+                options=[{'label': MAP_REGIONS[each], 'value': each} for each in regions],
+                value=regions[0],
+                clearable=False)],
+            style={'width': '45%', 'display': 'inline-block', 'padding-left': 10}),
+        html.Div([
+            dcc.Dropdown(
+                id='map-metric',
+                options=[{'label': label, 'value': each} for each, label in MAP_METRICS.items()],
+                value='confirmed',
+                clearable=False)],
+            style={'width': '45%', 'float': 'right', 'display': 'inline-block'}),
+        html.Div([dcc.Slider(id='map-date', min=0, max=0, step=1, value=0)], style={'padding': 10}),
+        # values only, the simplified geometry per zoom level is fetched by assets/map.js
+        dcc.Store(id='map-values'),
+        dcc.Graph(figure=go.Figure(), id='map', style={'height': 700}),
+    ]
+
+    def serve_layout():
+        # called on every page load, so the country options follow data reloads
+        df_input_large=get_data()
+        similarity_keys=get_similarity_keys(df_input_large) # the index is built by update_similarity
+        df_onset=get_onset_index()
+        onset_names=[] if df_onset is None else list(df_onset.columns)
+
+        return html.Div([
+
+            html.H1('Applied Data Science on COVID-19 data', style={'text-align': 'center',
+                                                                                'color': 'white',
+                                                                                'padding': 10,
+                                                                                'background-color': '#25383C',}),
+            dcc.Markdown('''Goal of the project is to analyse and learn patterns in COVID-19 dataset from different
     open sources. It covers the full walkthrough of: automated data gathering, data transformations, filtering and machine learning to approximating the doubling time, and
     (static) deployment of responsive dashboard.''',
-                 style={'text-align': 'center',
-                        'padding': 1,
-                        'background-color': '#FAFFFF',}),
-    
-    dcc.Markdown(''' ''',
-                 style={'text-align': 'center',
-                        'padding': 10,}),
-    
-    html.Div([  
-        
-        html.Div([
-            
-            dcc.Markdown('''Multi-Select Country for visualization:''')
-            ],
-                style={'width': '45%', 'display': 'inline-block', 'padding-left': 10, 'font-size':18}),
+                         style={'text-align': 'center',
+                                'padding': 1,
+                                'background-color': '#FAFFFF',}),
+
+            dcc.Markdown(''' ''',
+                         style={'text-align': 'center',
+                                'padding': 10,}),
 
             html.Div([
-                dcc.Markdown('''Select Timeline or doubling time:''')
-            ],
-                style={'width': '45%', 'float': 'right', 'display': 'inline-block', 'font-size':18})
-    ]),
-    
-
-    
-    html.Div([  
-        
-        html.Div([
-            dcc.Dropdown(
-            id='country_drop_down',
-            options=[ {'label': each,'value':each} for each in df_input_large['country'].unique()],
-            value=['Spain', 'Germany','Italy'], # which are pre-selected
-            multi=True
-            )],
-                style={'width': '45%', 'display': 'inline-block', 'padding-left': 10}),
+
+                html.Div([
+
+                    dcc.Markdown('''Multi-Select Country for visualization:''')
+                    ],
+                        style={'width': '45%', 'display': 'inline-block', 'padding-left': 10, 'font-size':18}),
+
+                    html.Div([
+                        dcc.Markdown('''Select Timeline or doubling time:''')
+                    ],
+                        style={'width': '45%', 'float': 'right', 'display': 'inline-block', 'font-size':18})
+            ]),
+
+
 
+            html.Div([
+
+                html.Div([
+                    dcc.Dropdown(
+                    id='country_drop_down',
+                    options=[ {'label': each,'value':each} for each in df_input_large['country'].unique()],
+                    value=['Spain', 'Germany','Italy'], # which are pre-selected
+                    multi=True
+                    )],
+                        style={'width': '45%', 'display': 'inline-block', 'padding-left': 10}),
+
+                    html.Div([
+                        dcc.Dropdown(
+                        id='doubling_time',
+                        options=[
+                            {'label': 'Timeline Confirmed ', 'value': 'confirmed'},
+                            {'label': 'Timeline Confirmed Filtered', 'value': 'confirmed_filtered'},
+                            {'label': 'Timeline Doubling Rate', 'value': 'confirmed_DR'},
+                            {'label': 'Timeline Doubling Rate Filtered', 'value': 'confirmed_filtered_DR'},
+                            {'label': 'Timeline Effective Reproduction Number Rt', 'value': 'confirmed_Rt'},
+                        ],
+                            value='confirmed',
+                            multi=False
+                        )],
+
+                        style={'width': '45%', 'float': 'right', 'display': 'inline-block'})
+            ]),
+
+             html.Div([
+                            dcc.RadioItems(
+                            id='yaxis-type',
+                            options=[{'label': i, 'value': i} for i in ['Log', 'Linear']],
+                            value='Log',
+                            labelStyle={'display': 'inline-block'},
+                            style={'padding': 10})
+                                ],
+                        style={'width': '45%', 'display': 'inline-block'}),
+
+             html.Div([
+                        dcc.Dropdown(
+                        id='xaxis-type',
+                        options=[{'label': 'Timeline', 'value': 'date'}]+
+                                [{'label': get_threshold_label(each), 'value': each} for each in onset_names],
+                        value='date',
+                        clearable=False)
+                                ],
+                        style={'width': '45%', 'float': 'right', 'display': 'inline-block'}),
+
+
+            dcc.Graph(figure=go.Figure(), id='main_window_slope'),
+            dcc.Store(id='main-delta'),
+            dcc.Store(id='main-held'),
+
+            dcc.Markdown('''Similar trajectories (DTW of the normalized log cases, 28 day windows after the onset):''',
+                         style={'padding-left': 10, 'font-size':18}),
             html.Div([
                 dcc.Dropdown(
-                id='doubling_time',
-                options=[
-                    {'label': 'Timeline Confirmed ', 'value': 'confirmed'},
-                    {'label': 'Timeline Confirmed Filtered', 'value': 'confirmed_filtered'},
-                    {'label': 'Timeline Doubling Rate', 'value': 'confirmed_DR'},
-                    {'label': 'Timeline Doubling Rate Filtered', 'value': 'confirmed_filtered_DR'},
-                ],
-                    value='confirmed',
-                    multi=False
-                )],
-                
-                style={'width': '45%', 'float': 'right', 'display': 'inline-block'})
-    ]),
-    
-     html.Div([ 
-                    dcc.RadioItems(
-                    id='yaxis-type',
-                    options=[{'label': i, 'value': i} for i in ['Log', 'Linear']],
-                    value='Log',
-                    labelStyle={'display': 'inline-block'},
-                    style={'padding': 10})
-                        ]),
-
-
-    dcc.Graph(figure=fig, id='main_window_slope')
-])
-
-
-
-@app.callback(
-    Output('main_window_slope', 'figure'),
-    [Input('country_drop_down', 'value'),
-    Input('doubling_time', 'value'),
-    Input(component_id='yaxis-type', component_property='value')])
-def update_figure(country_list,show_doubling, yaxis):
+                    id='similarity-key',
+                    options=[{'label': each.replace('|', ' / '), 'value': each} for each in similarity_keys],
+                    value='Germany' if 'Germany' in similarity_keys else similarity_keys[0],
+                    clearable=False)],
+                style={'width': '45%', 'display': 'inline-block', 'padding-left': 10}),
+            html.Div([
+                dcc.Checklist(
+                    id='similarity-current',
+                    options=[{'label': ' only compare with the last 28 days of the others', 'value': 'current'}],
+                    value=['current'])],
+                style={'width': '45%', 'float': 'right', 'display': 'inline-block'}),
+            html.Div([dcc.Slider(id='similarity-lag', min=0, max=56, step=7, value=28,
+                                 marks={lag: str(lag)+' days ago' for lag in range(0, 57, 7)})],
+                     style={'padding': 10}),
+            dcc.Graph(figure=go.Figure(), id='similarity'),
 
+            html.Div(map_section, id='map-section')
+        ])
 
-    if 'doubling_rate' in show_doubling:
-        my_yaxis={'type':"log",
-               'title':'Approximated doubling rate over 3 days (larger numbers are better #stayathome)'
-              }
-    else:
-        my_yaxis={'type': 'linear' if yaxis == 'Linear' else 'log', 
-                  'title':'Confirmed infected people (source johns hopkins csse)'
-              }
+    app.layout = serve_layout
 
+    if regions:
+        @app.server.route('/geometry/<name>/<int:level>.json')
+        def geometry(name, level):
+            from flask import abort, request, send_file
+            if name not in GEOMETRY_SOURCES or not os.path.exists(get_geometry_path(name, level)):
+                abort(404)
+            # the cache is stored gzipped, clients without gzip get an uncompressed copy
+            compressed='gzip' in request.headers.get('Accept-Encoding', '')
+            file_path=get_geometry_path(name, level) if compressed else get_uncompressed_geometry(name, level)
+            response=send_file(os.path.abspath(file_path), mimetype='application/json',
+                               max_age=86400, conditional=True)
+            if compressed:
+                response.headers['Content-Encoding']='gzip'
+            response.vary.add('Accept-Encoding')
+            return response
 
-    traces = []
-    for each in country_list:
+        app.callback(
+            [Output('map-date', 'max'), Output('map-date', 'marks'), Output('map-date', 'value')],
+            [Input('map-region', 'value')])(metrics.timed_callback('visualize', update_map_dates))
+        app.callback(
+            Output('map-values', 'data'),
+            [Input('map-region', 'value'),
+             Input('map-metric', 'value'),
+             Input('map-date', 'value')])(metrics.timed_callback('visualize', get_map_values))
+        app.clientside_callback(
+            ClientsideFunction(namespace='map', function_name='render'),
+            Output('map', 'figure'),
+            [Input('map-values', 'data'), Input('map', 'relayoutData')])
 
-        df_plot=df_input_large[df_input_large['country']==each]
 
-        if show_doubling=='doubling_rate_filtered':
-            df_plot=df_plot[['state','country','confirmed','confirmed_filtered','confirmed_DR','confirmed_filtered_DR','date']].groupby(['country','date']).agg(np.mean).reset_index()
-        else:
-            df_plot=df_plot[['state','country','confirmed','confirmed_filtered','confirmed_DR','confirmed_filtered_DR','date']].groupby(['country','date']).agg(np.sum).reset_index()
+    app.callback(
+        Output('similarity', 'figure'),
+        [Input('similarity-key', 'value'),
+         Input('similarity-lag', 'value'),
+         Input('similarity-current', 'value')])(metrics.timed_callback('visualize', update_similarity))
+
+    # the server only sends missing traces, axis type and merge run in the browser
+    app.callback(
+        Output('main-delta', 'data'),
+        [Input('country_drop_down', 'value'),
+        Input('doubling_time', 'value'),
+        Input(component_id='xaxis-type', component_property='value')],
+        [State('main-held', 'data')])(metrics.timed_callback('visualize', update_traces))
+    app.clientside_callback(
+        ClientsideFunction(namespace='figure', function_name='merge'),
+        [Output('main_window_slope', 'figure'), Output('main-held', 'data')],
+        [Input('main-delta', 'data'), Input('yaxis-type', 'value')],
+        [State('main_window_slope', 'figure')])
 
+    return app
 
-        traces.append(dict(x=df_plot.date,
-                                y=df_plot[show_doubling],
-                                mode='markers+lines',
-                                opacity=0.9,
-                                name=each
-                        )
-                )
 
+def update_map_dates(region):
+    ''' Dash callback: date slider of the map, the last day is pre-selected'''
+    dates, matrix=get_map_matrix(region, 'confirmed')
+    step=max(len(dates)//8, 1)
+    marks={pos: str(dates[pos])[:10] for pos in range(0, len(dates), step)}
+    return len(dates)-1, marks, len(dates)-1
+
+
+def update_similarity(key, lag, current):
+    ''' Dash callback: top 5 series whose window is most similar to the window of key
+        ending lag days ago, as table next to the overlaid normalized windows'''
+    index=get_similarity_index()
+    lag=int(lag or 0)
+    result=index.query(key, lag=lag, k=5, current_only='current' in (current or []))
+
+    days=list(range(index.window))
+    query_end=index.dates[len(index.dates)-1-lag]
+    traces=[dict(x=days, y=index.get_query(key, lag).round(3).tolist(), mode='lines', line=dict(width=4, color='black'),
+                 name=key.replace('|', ' / ')+' until '+str(query_end.date()))]
+    for row in result.itertuples():
+        traces.append(dict(x=days, y=index.windows[row.row].round(3).tolist(), mode='lines', opacity=0.8,
+                           name=row.key.replace('|', ' / ')+' until '+str(row.end.date())))
+
+    traces.append(dict(type='table', domain=dict(x=[0, 0.38], y=[0, 1]),
+                       header=dict(values=['Series', 'Window', 'Days since onset', 'DTW distance']),
+                       cells=dict(values=[[each.replace('|', ' / ') for each in result['key']],
+                                          [str(a.date())+' to '+str(b.date()) for a, b in zip(result['start'], result['end'])],
+                                          result['days_since_onset'].tolist(),
+                                          result['distance'].round(2).tolist()])))
     return {
             'data': traces,
-            'layout': dict (
+            'layout': dict(
+                xaxis={'title': 'Day of the window', 'domain': [0.45, 1]},
+                yaxis={'title': 'log10 cases (z-normalized)'},
+                legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
+                hovermode='closest')
+    }
+
+
+def get_figure_layout(show_doubling, yaxis, xaxis_title):
+    ''' Layout of the main figure, yaxis_fixed is True if the axis type does not follow the radio
+
+        Returns:
+        ----------
+        layout: dict
+        yaxis_fixed: bool
+    '''
+    yaxis_fixed=True
+    if 'doubling_rate' in show_doubling:
+        my_yaxis={'type':"log",
+               'title':'Approximated doubling rate over 3 days (larger numbers are better #stayathome)'
+              }
+    elif show_doubling=='confirmed_Rt':
+        my_yaxis={'type':'linear',
+               'title':'Effective reproduction number Rt (7 day window, 95% credible interval)'
+              }
+    else:
+        yaxis_fixed=False
+        my_yaxis={'type': 'linear' if yaxis == 'Linear' else 'log', 
+                  'title':'Confirmed infected people (source johns hopkins csse)'
+              }
+
+    layout=dict (
 
-                xaxis={'title':'Timeline',
-                        'tickangle':-45,
-                        'nticks':20,
-                        'tickfont':dict(size=14,color="#7f7f7f"),
-                      },
+                xaxis=dict(xaxis_title,
+                           nticks=20,
+                           tickfont=dict(size=14,color="#7f7f7f"),
+                      ),
 
                 yaxis=my_yaxis,
                 legend=dict(orientation="h",
@@ -152,8 +469,129 @@ def update_figure(country_list,show_doubling, yaxis):
                 #width=1360,
                 hovermode='closest'
         )
+    return layout, yaxis_fixed
+
+
+def get_country_traces(each, show_doubling, df_input_large, df_onset=None, xaxis='date'):
+    ''' Traces of one country, meta identifies them for the clientside merge (assets/figure_delta.js)
+
+        Returns:
+        ----------
+        traces: list of dict
+            empty if the country did not reach the onset threshold of an aligned x axis
+    '''
+    df_plot=df_input_large[df_input_large['country']==each]
+    onset=None
+    if df_onset is not None:
+        # aligned x axis: days since the onset stored in the onset index
+        onset=df_onset[xaxis].get(each)
+        if onset is None or onset != onset:
+            return [] # threshold not reached
+        onset=np.datetime64(onset, 'D')
+        df_plot=df_plot[df_plot['date'].values >= str(onset)]
+
+    def get_x(dates):
+        # dates of the timeline or days since the onset
+        return dates if onset is None else (np.array(dates, dtype='datetime64[D]')-onset).astype(int)
+
+    traces = []
+    if show_doubling=='confirmed_Rt':
+        # Rt of the summed country counts (rt_estimation.calc_country_Rt), the same on
+        # every state row, the credible interval is drawn as band
+        df_plot=df_plot[['country','confirmed_country_Rt','confirmed_country_Rt_lower','confirmed_country_Rt_upper','date']].groupby(['country','date']).first().reset_index()
+        df_plot=df_plot.rename(columns=lambda column: column.replace('_country_Rt', '_Rt'))
+        traces.append(dict(x=get_x(df_plot.date),
+                           y=df_plot['confirmed_Rt_upper'],
+                           mode='lines',
+                           line=dict(width=0),
+                           hoverinfo='skip',
+                           showlegend=False,
+                           name=each+' upper',
+                           meta=dict(key=each, part='upper', order=0)))
+        traces.append(dict(x=get_x(df_plot.date),
+                           y=df_plot['confirmed_Rt_lower'],
+                           mode='lines',
+                           line=dict(width=0),
+                           fill='tonexty',
+                           hoverinfo='skip',
+                           showlegend=False,
+                           name=each+' lower',
+                           meta=dict(key=each, part='lower', order=1)))
+    elif show_doubling=='doubling_rate_filtered':
+        df_plot=df_plot[['state','country','confirmed','confirmed_filtered','confirmed_DR','confirmed_filtered_DR','date']].groupby(['country','date']).agg(np.mean).reset_index()
+    else:
+        df_plot=df_plot[['state','country','confirmed','confirmed_filtered','confirmed_DR','confirmed_filtered_DR','date']].groupby(['country','date']).agg(np.sum).reset_index()
+
+
+    traces.append(dict(x=get_x(df_plot.date),
+                            y=df_plot[show_doubling],
+                            mode='markers+lines',
+                            opacity=0.9,
+                            name=each,
+                            meta=dict(key=each, part='line', order=2)
+                    )
+            )
+    return traces
+
+
+def get_aligned_onset(xaxis):
+    ''' Onset index if xaxis is a threshold of it, else None (timeline)'''
+    df_onset=get_onset_index() if xaxis != 'date' else None
+    return df_onset if df_onset is not None and xaxis in df_onset.columns else None
+
+
+def get_xaxis_title(df_onset, xaxis):
+    return {'title':get_threshold_label(xaxis)} if df_onset is not None else {'title':'Timeline','tickangle':-45}
+
+
+def update_figure(country_list,show_doubling, yaxis, xaxis='date'):
+    ''' Complete figure dict of the selected countries (static export, tests)'''
+    df_input_large=get_data()
+    df_onset=get_aligned_onset(xaxis)
+
+    traces = []
+    for each in country_list:
+        traces+=get_country_traces(each, show_doubling, df_input_large, df_onset, xaxis)
+
+    layout, _=get_figure_layout(show_doubling, yaxis, get_xaxis_title(df_onset, xaxis))
+    return {
+            'data': traces,
+            'layout': layout
     }
 
+
+def update_traces(country_list, show_doubling, xaxis, held):
+    ''' Dash callback: traces of the countries the browser does not show yet
+
+        The delta is merged into the figure by assets/figure_delta.js, which also
+        sets the axis type of the yaxis-type radio without a server call. held is
+        written by the merge: the metric, x axis and data versions of the shown traces
+        and their ids, a reloaded data set resends all traces.
+
+        Returns:
+        ----------
+        delta: dict
+            context, reset, keys (countries in order), traces, layout, yaxis_fixed
+    '''
+    country_list=country_list or []
+    df_input_large=get_data()
+    df_onset=get_aligned_onset(xaxis)
+
+    context=[show_doubling, xaxis, provider.version('final_set'),
+             provider.version('onset_index') if df_onset is not None else None]
+    reset=not held or held.get('context') != context
+    shown=set() if reset else set(held.get('traces', []))
+
+    traces=[]
+    for each in country_list:
+        if each+'|line' not in shown:
+            traces+=get_country_traces(each, show_doubling, df_input_large, df_onset, xaxis)
+
+    layout, yaxis_fixed=get_figure_layout(show_doubling, 'Log', get_xaxis_title(df_onset, xaxis))
+    return {'context': context, 'reset': reset, 'keys': country_list, 'traces': traces,
+            'layout': layout, 'yaxis_fixed': yaxis_fixed}
+
+
 if __name__ == '__main__':
 
-    app.run_server(debug=True, use_reloader=False)
+    create_app().run_server(debug=True, use_reloader=False)